@@ -0,0 +1,160 @@
+import mimetypes
+import os
+import sys
+import zlib
+
+from flask import request, safe_join, send_from_directory
+
+# Brotli is optional. Without it, only gzip variants are made and served.
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+# Precompressed variants, in order of preference when a client
+# accepts more than one equally.
+ENCODINGS = ['br', 'gzip']
+
+# File suffix for each variant of a static asset.
+SUFFIXES = {
+  'br': '.br',
+  'gzip': '.gz'
+}
+
+# Static assets worth compressing. Images and web fonts other than
+# the old eot/ttf formats are already compressed.
+COMPRESSIBLE = [
+  '.css', '.js', '.map', '.json', '.csv',
+  '.svg', '.eot', '.ttf', '.ico', '.txt', '.xml'
+]
+
+# Static assets are compressed once at deploy time, so use the best
+# settings. Exports are compressed on the live server the first time
+# they're requested, where brotli's top quality costs too much time.
+STATIC_LEVELS = {'gzip': 9, 'br': 11}
+EXPORT_LEVELS = {'gzip': 9, 'br': 9}
+
+
+# Compresses a body fed to it in chunks into every variant we can make.
+class Compressor:
+
+  def __init__(self, levels=EXPORT_LEVELS):
+    # wbits=31 makes zlib write a gzip header and trailer.
+    self.gzip = zlib.compressobj(levels['gzip'], zlib.DEFLATED, 31)
+    self.brotli = brotli.Compressor(quality=levels['br']) if brotli else None
+    self.parts = {encoding: [] for encoding in self.encodings()}
+
+  def encodings(self):
+    return ['gzip'] + (['br'] if self.brotli else [])
+
+  def update(self, chunk):
+    self.parts['gzip'].append(self.gzip.compress(chunk))
+    if self.brotli:
+      self.parts['br'].append(self.brotli.process(chunk))
+
+  # Returns the finished variants, keyed by encoding.
+  def finish(self):
+    self.parts['gzip'].append(self.gzip.flush())
+    if self.brotli:
+      self.parts['br'].append(self.brotli.finish())
+    return {
+      encoding: b"".join(parts) for encoding, parts in self.parts.items()
+    }
+
+# Returns every variant we can make of `body`, keyed by encoding.
+def compress(body, levels=EXPORT_LEVELS):
+  compressor = Compressor(levels)
+  compressor.update(body)
+  return compressor.finish()
+
+# Which of the `available` encodings to send for the current request,
+# going by its Accept-Encoding. None means send the body as-is.
+def best_encoding(available):
+  best = None
+  best_quality = 0
+  for encoding in ENCODINGS:
+    if encoding not in available:
+      continue
+    quality = request.accept_encodings[encoding]
+    if quality > best_quality:
+      best, best_quality = encoding, quality
+  return best
+
+# Writes .gz (and .br) copies alongside each compressible file under
+# `directory`, skipping any that are already up to date. Variants that
+# don't come out smaller than the original aren't kept.
+def precompress(directory, levels=STATIC_LEVELS):
+  written = 0
+  for root, dirs, files in os.walk(directory):
+    for name in files:
+      if os.path.splitext(name)[1].lower() not in COMPRESSIBLE:
+        continue
+
+      path = os.path.join(root, name)
+      modified = os.path.getmtime(path)
+      stale = [
+        encoding for encoding in ENCODINGS
+        if not (
+          os.path.exists(path + SUFFIXES[encoding]) and
+          (os.path.getmtime(path + SUFFIXES[encoding]) >= modified)
+        )
+      ]
+      if not stale:
+        continue
+
+      with open(path, 'rb') as f:
+        body = f.read()
+
+      for encoding, variant in compress(body, levels).items():
+        if encoding not in stale:
+          continue
+        destination = path + SUFFIXES[encoding]
+        if len(variant) >= len(body):
+          if os.path.exists(destination):
+            os.remove(destination)
+          continue
+        with open(destination + '.tmp', 'wb') as f:
+          f.write(variant)
+        os.replace(destination + '.tmp', destination)
+        written += 1
+
+  return written
+
+
+# For use by the app: serve precompressed copies of static assets,
+# when they exist and the client accepts them, instead of the original.
+def register(app):
+
+  def static(filename):
+    path = safe_join(app.static_folder, filename)
+    available = [
+      encoding for encoding in ENCODINGS
+      if os.path.isfile(path + SUFFIXES[encoding])
+    ]
+
+    encoding = best_encoding(available)
+    if encoding is None:
+      response = app.send_static_file(filename)
+    else:
+      response = send_from_directory(
+        app.static_folder, filename + SUFFIXES[encoding],
+        mimetype=(mimetypes.guess_type(filename)[0] or 'application/octet-stream'),
+        cache_timeout=app.get_send_file_max_age(filename)
+      )
+      response.headers['Content-Encoding'] = encoding
+
+    if available:
+      response.vary.add('Accept-Encoding')
+    return response
+
+  app.view_functions['static'] = static
+
+
+### Run when executed.
+#
+# Run with:
+#   python -m app.compression [directory]
+
+if __name__ == '__main__':
+  directory = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), '../static')
+  print("Wrote %i compressed files." % precompress(directory))
@@ -9,18 +9,27 @@ def register(app):
   ###
   # Context processors and filters.
 
+  # When the data was scanned, worked out once per read model, or None if
+  # there's no report yet.
   def scan_date():
-    return models.Report.report_time(models.Report.latest()['report_date'])
+    def build():
+      report = models.Report.latest()
+      if report is None:
+        return None
+      return models.Report.report_time(report['report_date'])
+    return models.read_model().memo('scan_date', build)
 
   # Make site metadata available everywhere.
+  # The scan date follows the data, which can be reloaded at any time.
   meta = yaml.safe_load(open("meta.yml"))
-  last_scan_date = scan_date()
   @app.context_processor
   def inject_meta():
-      return dict(site=meta, now=datetime.datetime.utcnow, scan_date=last_scan_date)
+      return dict(site=meta, now=datetime.datetime.utcnow, scan_date=scan_date())
 
   @app.template_filter('date')
   def datetimeformat(value, format='%H:%M / %d-%m-%Y'):
+      if value is None:
+        return ""
       return value.strftime(format)
 
   @app.template_filter('field_map')
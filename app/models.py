@@ -1,14 +1,38 @@
 from tinydb import TinyDB, where, Query
 import os
 import io
+import bisect
+import hashlib
 import datetime
 import csv
+import threading
+import time
+import types
+import collections.abc
+import sqlite3
+import ujson
 from app.data import CSV_FIELDS, FIELD_MAPPING, LABELS
+from app import compression
+from app import records
 
 this_dir = os.path.dirname(__file__)
 
+# Rough size (in characters) of each chunk of a streamed CSV export.
+CSV_CHUNK_SIZE = 64 * 1024
+
+# How often (in seconds) to check db.json for new data. 0 turns it off.
+RELOAD_INTERVAL = int(os.getenv("DB_RELOAD_INTERVAL", 60))
+
+DB_PATH = os.path.join(this_dir, '../data/db.json')
+SQLITE_PATH = os.path.join(this_dir, '../data/db.sqlite')
+HISTORY_PATH = os.path.join(this_dir, '../data/history.jsonl')
+
+# Which store the web app reads from: "tinydb" (db.json) or "sqlite"
+# (db.sqlite). Data loads can write either or both; see data/processing.py.
+BACKEND = os.getenv("DB_BACKEND", "tinydb")
+
 try:
-  db = TinyDB(os.path.join(this_dir, '../data/db.json'))
+  db = TinyDB(DB_PATH)
 except ValueError:
   print("Couldn't load TinyDB. Things may not work as expected.")
 
@@ -19,10 +43,723 @@ except ValueError:
 # Data loads should clear the entire database first.
 def clear_database():
   db.purge_tables()
+  invalidate()
 
 # convenience
 q = Query()
 
+
+# Reads are served from a read model, a snapshot of one version of the
+# data, instead of from TinyDB searches (which scan every record in a
+# table on every call). There are two kinds, one for each backend (see
+# BACKEND): ReadModel, for db.json, and SqliteReadModel, for db.sqlite.
+#
+# Both are immutable snapshots, safe to share between threads. Records
+# are plain dicts shared between callers and threads, and must be
+# treated as read-only.
+#
+# This base class holds what the two have in common: the agencies and
+# reports (which are small enough to always keep in memory), and caches
+# of values derived from the data.
+class BaseReadModel:
+
+  def __init__(self, agencies, reports, changes=None, generation=None):
+    # Identifies the version of the data file this was read from.
+    self.generation = generation
+
+    self.agencies = tuple(agencies)
+    self.reports = tuple(reports)
+
+    # report name -> what changed since the data before (see Change)
+    self.changes = types.MappingProxyType({change['report']: change for change in (changes or [])})
+
+    agencies_by_slug = {}
+
+    # report name -> [agency, ...]
+    eligible_agencies = {}
+
+    for agency in self.agencies:
+      agencies_by_slug.setdefault(agency.get('slug'), agency)
+
+      for report_name, report in agency.items():
+        if not isinstance(report, collections.abc.Mapping):
+          continue
+
+        eligible = report.get('eligible')
+        if isinstance(eligible, (int, float)) and (eligible > 0):
+          eligible_agencies.setdefault(report_name, []).append(agency)
+
+    self.agencies_by_slug = freeze(agencies_by_slug)
+    self.eligible_agencies = freeze(eligible_agencies)
+
+    # key -> Export, filled in as the read model is loaded (see on_load())
+    # or on first request for each export.
+    self.exports = {}
+    # key -> Lock, held while that export is rendered (see export()).
+    self.export_locks = {}
+    self.exports_lock = threading.Lock()
+
+    # key -> anything else derived from the data and worth keeping,
+    # like the sort orders of listings. See memo().
+    self.memos = {}
+    self.memos_lock = threading.Lock()
+
+  def find_agency(self, slug):
+    return self.agencies_by_slug.get(slug)
+
+  def eligible_agencies_for(self, report_name):
+    return self.eligible_agencies.get(report_name, ())
+
+  def all_agencies(self):
+    return self.agencies
+
+  def latest_report(self):
+    if len(self.reports) > 0:
+      return self.reports[0]
+    else:
+      return None
+
+  def changes_for(self, report_name):
+    return self.changes.get(report_name)
+
+  # Report names that appear anywhere in the data. Exports for other
+  # names are rendered but not kept, so made-up URLs can't fill the cache.
+  def knows_report(self, report_name):
+    return (
+      (report_name in self.domain_reports()) or
+      (report_name in self.eligible_agencies) or
+      any((report_name in report) for report in self.reports)
+    )
+
+  # Serialized responses (the JSON and CSV exports) only change when the
+  # data does, so render each one once and keep it for the life of this
+  # read model. `render` returns the body as a str or bytes, or an
+  # iterable of them.
+  #
+  # With stream=True, only the ETag and compressed variants are kept, and
+  # the uncompressed body is re-rendered as a stream when it's needed.
+  def export(self, key, render, keep=True, stream=False):
+    export = self.exports.get(key)
+    if export is not None:
+      return export
+
+    if not keep:
+      return Export(render(), keep_body=(not stream))
+
+    # Render each export once, even if several requests for it arrive
+    # together. Only requests for the same export wait for it: the shared
+    # lock is only held long enough to find that export's own.
+    with self.exports_lock:
+      lock = self.export_locks.setdefault(key, threading.Lock())
+
+    with lock:
+      export = self.exports.get(key)
+      if export is None:
+        export = self.exports[key] = Export(render(), keep_body=(not stream))
+
+    with self.exports_lock:
+      self.export_locks.pop(key, None)
+    return export
+
+  # Memoizes `build()` under `key` for the life of this read model, for
+  # values that are derived from the data alone (and so never go stale).
+  # Callers must treat the value as read-only.
+  def memo(self, key, build, keep=True):
+    value = self.memos.get(key)
+    if value is not None:
+      return value
+
+    if not keep:
+      return build()
+
+    with self.memos_lock:
+      value = self.memos.get(key)
+      if value is None:
+        value = self.memos[key] = build()
+    return value
+
+
+# The read model for db.json: every record is held in memory, read
+# straight from the file (never through TinyDB, which isn't safe to share
+# between threads).
+#
+# Lookups by hostname, base domain and agency slug are hash lookups, and
+# the per-report eligibility lists are laid out up front, in the orders
+# the listings are served in (see Order), so each read costs O(1) or O(k)
+# in the number of records returned. The lists and indexes are frozen
+# into tuples and read-only mappings once built.
+class ReadModel(BaseReadModel):
+
+  def __init__(self, domains, agencies, reports, orders=None, changes=None, generation=None):
+    super().__init__(agencies, reports, changes=changes, generation=generation)
+
+    # Held for the life of the read model, so keep them compact (see
+    # app/records.py).
+    self.domains = tuple(records.compact_all(domains))
+
+    self.domains_by_name = {}
+    self.hosts_by_base = {}
+
+    # report name -> [domain, ...]
+    self.eligible_domains = {}
+    # report name -> [parent domain, ...]
+    self.eligible_parent_domains = {}
+    # report name -> base domain -> [domain, ...]
+    self.eligible_hosts_by_base = {}
+
+    for domain in self.domains:
+      # TinyDB's get() returns the first match, so keep the first one.
+      self.domains_by_name.setdefault(domain.get('domain'), domain)
+      self.hosts_by_base.setdefault(domain.get('base_domain'), []).append(domain)
+
+    # Data from before orders were stored with it has to be sorted here.
+    if not orders:
+      orders = Order.compute(self.domains)
+
+    for order in orders:
+      report_name = order['report']
+      hosts = [self.domains[position] for position in order['hosts']]
+      self.eligible_domains[report_name] = hosts
+      self.eligible_parent_domains[report_name] = [
+        self.domains[position] for position in order['parents']
+      ]
+
+      # Each base domain's hosts are already together and in order, but
+      # for these listings, its parent domain goes first.
+      by_base = self.eligible_hosts_by_base[report_name] = {}
+      for domain in hosts:
+        by_base.setdefault(domain.get('base_domain'), []).append(domain)
+      for base_domain, base_hosts in by_base.items():
+        by_base[base_domain] = (
+          [domain for domain in base_hosts if domain.get('is_parent')] +
+          [domain for domain in base_hosts if not domain.get('is_parent')]
+        )
+
+    self.domains_by_name = freeze(self.domains_by_name)
+    self.hosts_by_base = freeze(self.hosts_by_base)
+    self.eligible_domains = freeze({
+      name: hosts for name, hosts in self.eligible_domains.items() if hosts
+    })
+    self.eligible_parent_domains = freeze({
+      name: parents for name, parents in self.eligible_parent_domains.items() if parents
+    })
+    self.eligible_hosts_by_base = freeze(self.eligible_hosts_by_base)
+
+  def find_domain(self, domain_name):
+    return self.domains_by_name.get(domain_name)
+
+  def eligible(self, report_name):
+    return self.eligible_domains.get(report_name, ())
+
+  def eligible_parents(self, report_name):
+    return self.eligible_parent_domains.get(report_name, ())
+
+  def eligible_for_domain(self, domain, report_name):
+    hosts_by_base = self.eligible_hosts_by_base.get(report_name)
+    if hosts_by_base is None:
+      return ()
+    return hosts_by_base.get(domain, ())
+
+  def all_domains(self):
+    return self.domains
+
+  def domain_reports(self):
+    return set(self.eligible_domains) | set(self.eligible_parent_domains)
+
+  # Builds a read model from a db.json file. (TinyDB keeps each table
+  # as an object of records keyed by document ID.)
+  #
+  # Raises IOError or ValueError if the file is missing, can't be
+  # parsed, or was changed while it was being read.
+  def read(path=DB_PATH):
+    generation = generation_of(path)
+    with open(path, encoding='utf-8') as f:
+      tables = ujson.load(f)
+    if generation_of(path) != generation:
+      raise IOError("%s changed while being read." % path)
+
+    def table(name):
+      return list(tables.get(name, {}).values())
+
+    # Compact domains one at a time, letting go of each parsed dict as
+    # we go, so the parsed and compact copies aren't all held at once.
+    # They're kept in document ID order, which orders refer to.
+    parsed = tables.pop('domains', {})
+    compactor = records.Compactor()
+    domains = [
+      compactor.compact(parsed.pop(doc_id))
+      for doc_id in sorted(parsed, key=int)
+    ]
+
+    return ReadModel(
+      domains, table('agencies'), table('reports'), orders=table('orders'),
+      changes=table('changes'), generation=generation
+    )
+
+
+# Writes a complete db.json from the given records, in one go, as TinyDB
+# would lay it out (each table an object of records keyed by document ID,
+# counting from 1). Much faster than inserting them through TinyDB, which
+# serializes the whole database again for each call. It's written to a
+# temporary file, one record at a time, then moved into place, so readers
+# only ever see a whole database.
+#
+# `orders` are as stored by Order, and are worked out if not given.
+# `changes` are as stored by Change.
+def tinydb_load(domains, agencies, reports, orders=None, changes=None, path=None):
+  global db
+  path = path or DB_PATH
+  temporary = path + ".tmp"
+
+  if orders is None:
+    orders = Order.compute(domains)
+
+  tables = [
+    ('domains', domains), ('agencies', agencies), ('reports', reports),
+    ('orders', orders), ('changes', changes or [])
+  ]
+
+  with open(temporary, 'w', encoding='utf-8') as f:
+    f.write("{")
+    for i, (name, table) in enumerate(tables):
+      f.write('%s%s:{' % ("," if i else "", ujson.dumps(name)))
+      for doc_id, record in enumerate(table, start=1):
+        f.write('%s"%i":%s' % ("," if (doc_id > 1) else "", doc_id, ujson.dumps(record)))
+      f.write("}")
+    f.write("}")
+
+    # on disk before it's moved into place, so a crash can't leave a
+    # truncated db.json behind
+    f.flush()
+    os.fsync(f.fileno())
+
+  os.replace(temporary, path)
+
+  # TinyDB still has the old file open, so open the new one in its place,
+  # if anything writes through it after all.
+  if path == DB_PATH:
+    db.close()
+    db = Reopened(DB_PATH)
+  invalidate()
+
+
+# Opens TinyDB on first use, for a db.json that was just written. Opening
+# it parses the whole file, so it's put off until something needs it.
+# The default table is one that's always there, or opening the file would
+# write an empty one into it, in place.
+class Reopened:
+
+  def __init__(self, path):
+    self.path = path
+    self.opened = None
+
+  def __getattr__(self, name):
+    if self.opened is None:
+      self.opened = TinyDB(self.path, default_table='domains')
+    return getattr(self.opened, name)
+
+  def close(self):
+    if self.opened is not None:
+      self.opened.close()
+
+
+###
+# SQLite backend.
+#
+# db.sqlite holds the same records as db.json, each stored whole as JSON
+# alongside indexed columns for the fields it's looked up by. Which
+# domains are eligible for which reports is kept in its own table, one
+# row per domain per report, so lookups for any report use an index.
+# Unlike db.json, it doesn't have to be parsed into memory when a process
+# starts; domains are queried as they're needed.
+#
+# It's written all at once by sqlite_load() (during data loads) rather
+# than record by record.
+
+SQLITE_TABLES = """
+  CREATE TABLE domains (
+    id INTEGER PRIMARY KEY,
+    domain TEXT,
+    base_domain TEXT,
+    data TEXT NOT NULL
+  );
+  CREATE TABLE eligibility (
+    report TEXT NOT NULL,
+    domain_id INTEGER NOT NULL,
+    base_domain TEXT,
+    is_parent INTEGER NOT NULL,
+    eligible INTEGER NOT NULL,
+    eligible_parent INTEGER NOT NULL,
+    host_order INTEGER,
+    parent_order INTEGER
+  );
+  CREATE TABLE agencies (
+    id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+  );
+  CREATE TABLE reports (
+    id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+  );
+  CREATE TABLE changes (
+    id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+  );
+"""
+
+SQLITE_INDEXES = """
+  CREATE INDEX domains_domain ON domains (domain);
+  CREATE INDEX eligibility_hosts ON eligibility (report, eligible, host_order);
+  CREATE INDEX eligibility_hosts_by_base ON eligibility (report, eligible, base_domain, is_parent, host_order);
+  CREATE INDEX eligibility_parents ON eligibility (report, eligible_parent, parent_order);
+"""
+
+# Writes a complete db.sqlite from the given records, in one go. It's
+# built in a temporary file, then moved into place, so readers only ever
+# see a whole database.
+#
+# `orders` are as stored by Order, and are worked out if not given.
+# `changes` are as stored by Change.
+def sqlite_load(domains, agencies, reports, orders=None, changes=None, path=None):
+  path = path or SQLITE_PATH
+  temporary = path + ".tmp"
+  if os.path.exists(temporary):
+    os.remove(temporary)
+
+  if orders is None:
+    orders = Order.compute(domains)
+
+  # (report name, position) -> place in that report's listing
+  host_orders = {}
+  parent_orders = {}
+  for order in orders:
+    for rank, position in enumerate(order['hosts']):
+      host_orders[(order['report'], position)] = rank
+    for rank, position in enumerate(order['parents']):
+      parent_orders[(order['report'], position)] = rank
+
+  def eligibility_rows(position, domain):
+    for report_name, report in domain.items():
+      if not isinstance(report, collections.abc.Mapping):
+        continue
+      eligible = (report.get('eligible') == True)
+      is_parent = (domain.get('is_parent') == True)
+      eligible_parent = (report.get('eligible_zone') == True) and is_parent
+      if eligible or eligible_parent:
+        yield (
+          report_name, position + 1, domain.get('base_domain'), is_parent,
+          eligible, eligible_parent,
+          host_orders.get((report_name, position)),
+          parent_orders.get((report_name, position))
+        )
+
+  connection = sqlite3.connect(temporary)
+  try:
+    # Nothing else reads the temporary file, so skip the safety net.
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.executescript(SQLITE_TABLES)
+
+    for position, domain in enumerate(domains):
+      connection.execute(
+        "INSERT INTO domains (id, domain, base_domain, data) VALUES (?, ?, ?, ?)",
+        (position + 1, domain.get('domain'), domain.get('base_domain'), ujson.dumps(domain))
+      )
+      connection.executemany(
+        "INSERT INTO eligibility VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        eligibility_rows(position, domain)
+      )
+    connection.executemany(
+      "INSERT INTO agencies (data) VALUES (?)",
+      ((ujson.dumps(agency),) for agency in agencies)
+    )
+    connection.executemany(
+      "INSERT INTO reports (data) VALUES (?)",
+      ((ujson.dumps(report),) for report in reports)
+    )
+    connection.executemany(
+      "INSERT INTO changes (data) VALUES (?)",
+      ((ujson.dumps(change),) for change in (changes or []))
+    )
+
+    # Cheaper to index once everything's in.
+    connection.executescript(SQLITE_INDEXES)
+    connection.commit()
+  finally:
+    connection.close()
+
+  os.replace(temporary, path)
+
+
+# The read model for db.sqlite. Agencies and reports are read into
+# memory up front; domains are queried (by index) as they're asked for,
+# in the orders stored with them (see Order).
+#
+# Each thread gets its own read-only connection. A connection keeps
+# reading the file it opened even after a new db.sqlite is moved into
+# place, so requests in flight finish against the data they started with.
+class SqliteReadModel(BaseReadModel):
+
+  def __init__(self, path, generation=None):
+    self.path = path
+    self.local = threading.local()
+
+    connection = self.connection()
+    agencies = [ujson.loads(row[0]) for row in connection.execute("SELECT data FROM agencies ORDER BY id")]
+    reports = [ujson.loads(row[0]) for row in connection.execute("SELECT data FROM reports ORDER BY id")]
+    self.reports_with_domains = frozenset(
+      row[0] for row in connection.execute("SELECT DISTINCT report FROM eligibility")
+    )
+
+    # Small enough to keep in memory, like reports.
+    try:
+      changes = [ujson.loads(row[0]) for row in connection.execute("SELECT data FROM changes ORDER BY id")]
+    except sqlite3.OperationalError:
+      # written before changes were kept
+      changes = []
+
+    super().__init__(agencies, reports, changes=changes, generation=generation)
+
+  def connection(self):
+    connection = getattr(self.local, 'connection', None)
+    if connection is None:
+      connection = self.local.connection = sqlite3.connect(
+        "file:%s?mode=ro" % self.path, uri=True
+      )
+    return connection
+
+  def query_domains(self, sql, parameters=()):
+    rows = self.connection().execute(sql, parameters)
+    return tuple(ujson.loads(row[0]) for row in rows)
+
+  def find_domain(self, domain_name):
+    row = self.connection().execute(
+      "SELECT data FROM domains WHERE domain = ? ORDER BY id LIMIT 1", (domain_name,)
+    ).fetchone()
+    return ujson.loads(row[0]) if row else None
+
+  def eligible(self, report_name):
+    return self.query_domains(
+      "SELECT data FROM eligibility JOIN domains ON domains.id = domain_id "
+      "WHERE report = ? AND eligible = 1 ORDER BY host_order",
+      (report_name,)
+    )
+
+  def eligible_parents(self, report_name):
+    return self.query_domains(
+      "SELECT data FROM eligibility JOIN domains ON domains.id = domain_id "
+      "WHERE report = ? AND eligible_parent = 1 ORDER BY parent_order",
+      (report_name,)
+    )
+
+  def eligible_for_domain(self, domain, report_name):
+    return self.query_domains(
+      "SELECT data FROM eligibility JOIN domains ON domains.id = domain_id "
+      "WHERE report = ? AND eligible = 1 AND eligibility.base_domain = ? "
+      "ORDER BY is_parent DESC, host_order",
+      (report_name, domain)
+    )
+
+  def all_domains(self):
+    return self.query_domains("SELECT data FROM domains ORDER BY id")
+
+  def domain_reports(self):
+    return self.reports_with_domains
+
+  # Raises IOError or sqlite3.Error if the file is missing or unreadable.
+  def read(path=None):
+    path = path or SQLITE_PATH
+    generation = generation_of(path)
+    return SqliteReadModel(path, generation=generation)
+
+
+# Reads the data for the configured backend. Raises IOError, ValueError
+# or sqlite3.Error if it can't.
+def read_backend():
+  if BACKEND == "sqlite":
+    return SqliteReadModel.read(SQLITE_PATH)
+  else:
+    return ReadModel.read(DB_PATH)
+
+# The data file for the configured backend.
+def backend_path():
+  return SQLITE_PATH if (BACKEND == "sqlite") else DB_PATH
+
+# Like read_backend(), but falls back to an empty read model.
+def load_backend():
+  try:
+    return read_backend()
+  except (IOError, ValueError, sqlite3.Error):
+    print("Couldn't load %s. Things may not work as expected." % backend_path())
+    return ReadModel([], [], [])
+
+
+# A cheap stand-in for the contents of a data file, to tell when it changes.
+def generation_of(path):
+  stat = os.stat(path)
+  return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+# Shallow-freezes an index: lists become tuples, and the dict (and any
+# dicts nested in it) become read-only views.
+def freeze(index):
+  frozen = {}
+  for key, value in index.items():
+    if isinstance(value, dict):
+      value = freeze(value)
+    elif isinstance(value, list):
+      value = tuple(value)
+    frozen[key] = value
+  return types.MappingProxyType(frozen)
+
+
+# A rendered response body, with a strong ETag derived from its content,
+# and its compressed variants (keyed by Content-Encoding).
+#
+# The body can be given in chunks, which are hashed and compressed as
+# they arrive. Unless keep_body is set, the uncompressed body is then
+# dropped and `body` is None.
+class Export:
+
+  def __init__(self, chunks, keep_body=True):
+    if isinstance(chunks, (str, bytes)):
+      chunks = [chunks]
+
+    digest = hashlib.sha1()
+    compressor = compression.Compressor()
+    body = []
+
+    for chunk in chunks:
+      if isinstance(chunk, str):
+        chunk = chunk.encode('utf-8')
+      digest.update(chunk)
+      compressor.update(chunk)
+      if keep_body:
+        body.append(chunk)
+
+    self.body = b"".join(body) if keep_body else None
+    self.etag = digest.hexdigest()
+    self.variants = compressor.finish()
+
+
+_read_model = None
+_read_model_lock = threading.Lock()
+
+# The read model pinned to the current thread, if any.
+_pinned = threading.local()
+
+# The read model for the current contents of the db, built on first use.
+#
+# Within a request, this is the read model that was current when the
+# request began (see pin()), even if new data has been swapped in since.
+def read_model():
+  global _read_model
+  pinned = getattr(_pinned, 'read_model', None)
+  if pinned is not None:
+    return pinned
+
+  current = _read_model
+  if current is None:
+    with _read_model_lock:
+      if _read_model is None:
+        _read_model = warm_up(load_backend())
+      current = _read_model
+  return current
+
+# Any write through this module has to drop the read model, so that the
+# next read sees the new data.
+def invalidate():
+  global _read_model
+  _read_model = None
+
+# Makes every read_model() call on this thread, until unpin(), see the
+# same read model. Used to keep each web request on one version of the
+# data from start to finish.
+def pin():
+  _pinned.read_model = read_model()
+
+def unpin():
+  _pinned.read_model = None
+
+
+# name -> function to call with each newly loaded read model, before it's
+# put into service. See on_load().
+_warmers = {}
+
+# Has `warm(read_model)` called with each read model as it's loaded, at
+# startup and on each reload, before any request sees it: for building
+# anything that's worth having ready (like the exports every page loads)
+# ahead of the first request that needs it. Registering another function
+# under the same name replaces it.
+def on_load(name, warm):
+  _warmers[name] = warm
+
+# Runs the on_load() functions for `read_model`, with it pinned to this
+# thread, so that anything they read comes from it rather than from the
+# read model in service. One that fails only means what it would have
+# built is built on first use instead.
+def warm_up(read_model):
+  previous = getattr(_pinned, 'read_model', None)
+  _pinned.read_model = read_model
+  try:
+    for name, warm in list(_warmers.items()):
+      try:
+        warm(read_model)
+      except Exception as error:
+        print("Couldn't warm up %s: %s" % (name, error))
+  finally:
+    _pinned.read_model = previous
+  return read_model
+
+
+###
+# Hot reloading.
+#
+# When db.json (or db.sqlite) is replaced (by a data update), a new read model is built
+# in a background thread while requests go on being served from the old
+# one, and is then swapped in. Its indexes, its export cache and the scan
+# date all come with it, so they change over together. Requests already
+# in flight keep the read model they pinned.
+
+_last_check = 0
+_reload_lock = threading.Lock()
+
+# Called at the start of each request. At most every RELOAD_INTERVAL
+# seconds, checks whether the data file has changed, and if so, starts loading
+# it. Cheap, and never waits on the load.
+def check_for_updates():
+  global _last_check
+
+  now = time.monotonic()
+  if (RELOAD_INTERVAL <= 0) or ((now - _last_check) < RELOAD_INTERVAL):
+    return
+  _last_check = now
+
+  current = _read_model
+  if current is None:
+    return
+
+  try:
+    if generation_of(backend_path()) == current.generation:
+      return
+  except OSError:
+    return
+
+  # Only one reload at a time.
+  if _reload_lock.acquire(blocking=False):
+    threading.Thread(target=reload, daemon=True).start()
+
+def reload():
+  global _read_model
+  try:
+    replacement = warm_up(read_backend())
+    _read_model = replacement
+    print("Loaded new data from %s." % backend_path())
+  except (IOError, ValueError, sqlite3.Error) as error:
+    # Likely caught mid-write; try again at the next check.
+    print("Couldn't reload %s, keeping current data: %s" % (backend_path(), error))
+  finally:
+    _reload_lock.release()
+
 class Report:
   # report_date (string, YYYY-MM-DD)
   # https.eligible (number)
@@ -35,6 +772,7 @@ class Report:
 
   # Initialize a report with a given date.
   def create(data):
+    invalidate()
     db.table('reports').insert(data)
 
   def report_time(report_date):
@@ -42,11 +780,161 @@ class Report:
 
   # There's only ever one.
   def latest():
-    reports = db.table('reports').all()
-    if len(reports) > 0:
-      return reports[0]
-    else:
-      return None
+    return read_model().latest_report()
+
+  # The named report's totals for each day in the history, oldest first,
+  # government-wide or for one agency, from `start` to `end` (YYYY-MM-DD,
+  # inclusive) if given.
+  def history(report_name, start=None, end=None, agency=None):
+    return history().report(report_name, start=start, end=end, agency=agency)
+
+
+###
+# Report history.
+#
+# history.jsonl holds one line per day of data, appended by data
+# processing: that day's government-wide totals for each report, and each
+# agency's, as in:
+#
+#   {"report_date": "2018-01-01", "reports": {"https": {...}, ...},
+#    "agencies": {"agency-slug": {"https": {...}, ...}, ...}}
+#
+# Days are never rewritten; if one is processed again, its later line
+# wins. History is read apart from the rest of the data: an index of
+# where each day's line starts is kept, and range queries only read and
+# parse the lines they need.
+
+class History:
+
+  def __init__(self, path, dates, offsets, generation=None):
+    self.path = path
+    self.generation = generation
+    # sorted, and the offset of each one's line in the file
+    self.dates = dates
+    self.offsets = offsets
+
+  # Dates are the first thing on each line, which data processing always
+  # writes the same way, so there's no need to parse the rest to index it.
+  DATE_PREFIX = b'{"report_date":"'
+
+  # Indexes a history file. A missing file is an empty history.
+  def read(path=HISTORY_PATH):
+    try:
+      generation = generation_of(path)
+    except OSError:
+      return History(path, [], [])
+
+    offsets_by_date = {}
+    offset = 0
+    with open(path, 'rb') as f:
+      for line in f:
+        # a line still being appended doesn't count yet
+        if line.endswith(b"\n"):
+          if line.startswith(History.DATE_PREFIX):
+            date = line[len(History.DATE_PREFIX):len(History.DATE_PREFIX) + 10].decode('ascii')
+          else:
+            date = ujson.loads(line)['report_date']
+          offsets_by_date[date] = offset
+        offset += len(line)
+
+    dates = sorted(offsets_by_date)
+    return History(path, dates, [offsets_by_date[date] for date in dates], generation=generation)
+
+  # The days from `start` to `end`, inclusive, oldest first.
+  def entries(self, start=None, end=None):
+    first = 0 if (start is None) else bisect.bisect_left(self.dates, start)
+    last = len(self.dates) if (end is None) else bisect.bisect_right(self.dates, end)
+    if first >= last:
+      return []
+
+    with open(self.path, 'rb') as f:
+      entries = []
+      for offset in self.offsets[first:last]:
+        f.seek(offset)
+        entries.append(ujson.loads(f.readline()))
+      return entries
+
+  def report(self, report_name, start=None, end=None, agency=None):
+    series = []
+    for entry in self.entries(start, end):
+      if agency is None:
+        totals = entry['reports'].get(report_name)
+      else:
+        totals = entry['agencies'].get(agency, {}).get(report_name)
+      if totals is not None:
+        series.append(dict(totals, report_date=entry['report_date']))
+    return series
+
+_history = None
+_history_lock = threading.Lock()
+
+# The history, indexed again whenever history.jsonl has changed.
+def history():
+  global _history
+  current = _history
+  try:
+    generation = generation_of(HISTORY_PATH)
+  except OSError:
+    generation = None
+
+  if (current is None) or (current.path != HISTORY_PATH) or (current.generation != generation):
+    with _history_lock:
+      current = _history = History.read(HISTORY_PATH)
+  return current
+
+
+# The orders that each report's listings of domains are served in,
+# worked out once by data processing, so they never need sorting while
+# serving requests:
+#
+# report (string)
+# hosts (array of positions in the domains table): eligible hostnames,
+#   by base domain, then by hostname.
+# parents (array of positions in the domains table): parent domains in
+#   eligible zones, by hostname.
+#
+# Positions count from 0, in the order domains were created.
+class Order:
+
+  def create_all(iterable):
+    invalidate()
+    return db.table('orders').insert_multiple(iterable)
+
+  # Works out the orders for a list of domains.
+  def compute(domains):
+    hosts = {}
+    parents = {}
+
+    for position, domain in enumerate(domains):
+      for report_name, report in domain.items():
+        if not isinstance(report, collections.abc.Mapping):
+          continue
+
+        if report.get('eligible') == True:
+          hosts.setdefault(report_name, []).append(position)
+
+        if (report.get('eligible_zone') == True) and (domain.get('is_parent') == True):
+          parents.setdefault(report_name, []).append(position)
+
+    def host_key(position):
+      return (domains[position].get('base_domain') or '', domains[position].get('domain') or '')
+
+    def parent_key(position):
+      return domains[position].get('domain') or ''
+
+    return [
+      {
+        'report': report_name,
+        'hosts': sorted(hosts.get(report_name, []), key=host_key),
+        'parents': sorted(parents.get(report_name, []), key=parent_key)
+      }
+      for report_name in sorted(set(hosts) | set(parents))
+    ]
+
+  # Any change to domains can change the orders; drop them, and they'll
+  # be worked out again when the data is read.
+  def drop():
+    db.purge_table('orders')
 
 
 class Domain:
@@ -74,19 +962,27 @@ class Domain:
   #
 
   def create(data):
+    invalidate()
+    Order.drop()
     return db.table('domains').insert(data)
 
   def create_all(iterable):
+    invalidate()
+    Order.drop()
     return db.table('domains').insert_multiple(iterable)
 
 
   def update(domain_name, data):
+    invalidate()
+    Order.drop()
     return db.table('domains').update(
       data,
       where('domain') == domain_name
     )
 
   def add_report(domain_name, report_name, report):
+    invalidate()
+    Order.drop()
     return db.table('domains').update(
       {
         report_name: report
@@ -95,45 +991,52 @@ class Domain:
     )
 
   def find(domain_name):
-    return db.table('domains').get(q.domain == domain_name)
+    return read_model().find_domain(domain_name)
 
   # Useful when you want to pull in all domain entries as peers,
   # such as reports which only look at parent domains, or
   # a flat CSV of all hostnames that match a report.
+  #
+  # Ordered by base domain, then hostname.
   def eligible(report_name):
-    return db.table('domains').search(
-      Query()[report_name]['eligible'] == True
-    )
+    return read_model().eligible(report_name)
 
   # Useful when you have mixed parent/subdomain reporting,
   # used for HTTPS but not yet others.
+  #
+  # Ordered by hostname.
   def eligible_parents(report_name):
-    return db.table('domains').search(
-      (Query()[report_name]['eligible_zone'] == True) &
-      (where("is_parent") == True)
-    )
+    return read_model().eligible_parents(report_name)
 
   # Useful when you want to pull down subdomains of a particular
   # parent domain. Used for HTTPS expanded reports.
+  #
+  # Ordered by hostname, but with the parent domain first.
   def eligible_for_domain(domain, report_name):
-    return db.table('domains').search(
-      (Query()[report_name]['eligible'] == True) &
-      (where("base_domain") == domain)
-    )
+    return read_model().eligible_for_domain(domain, report_name)
 
   def db():
     return db
 
   def all():
-    return db.table('domains').all()
+    return read_model().all_domains()
 
-  def to_csv(domains, report_type):
+  # Yields the CSV export of `domains` for a report, a chunk of rows at
+  # a time, so the whole file never has to be held in memory.
+  def to_csv_rows(domains, report_type):
     output = io.StringIO()
     writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
 
+    # Hand back what's been written so far, and start over.
+    def flush():
+      chunk = output.getvalue()
+      output.seek(0)
+      output.truncate()
+      return chunk
+
     def value_for(value):
       # if it's a list, convert it to a list of strings and join
-      if type(value) is list:
+      if type(value) in (list, tuple):
         value = [str(x) for x in value]
         value = ", ".join(value)
       elif type(value) is bool:
@@ -176,7 +1079,77 @@ class Domain:
 
       writer.writerow(row)
 
-    return output.getvalue()
+      if output.tell() >= CSV_CHUNK_SIZE:
+        yield flush()
+
+    yield flush()
+
+  def to_csv(domains, report_type):
+    return "".join(Domain.to_csv_rows(domains, report_type))
+
+
+# What changed for each host since the data before this one, for a
+# report, as worked out by data processing:
+#
+# report (string)
+# report_date (string, YYYY-MM-DD)
+# since (string, YYYY-MM-DD): the report date of the data before
+# rows (array of [hostname, agency slug, field, code before, code after,
+#   change]), where field is one of the report's CSV fields, or
+#   "eligible", and change is one of KINDS.
+class Change:
+
+  COLUMNS = ['domain', 'agency_slug', 'field', 'before', 'after', 'change']
+  KINDS = ['added', 'removed', 'improved', 'regressed', 'changed']
+
+  def latest(report_name):
+    return read_model().changes_for(report_name)
+
+  # The rows as dicts, just for one agency or one kind of change if given.
+  def rows(change, agency=None, kind=None):
+    return [
+      dict(zip(Change.COLUMNS, row)) for row in change['rows']
+      if ((agency is None) or (row[1] == agency)) and ((kind is None) or (row[5] == kind))
+    ]
+
+  # The rows are yielded as the response is streamed, after the request's
+  # read model has been unpinned, so agencies are looked up in the read
+  # model of the request that asked for them, taken up front.
+  def to_csv_rows(rows, report_type):
+    find_agency = read_model().find_agency
+
+    def value_for(field, value):
+      mapping = FIELD_MAPPING.get(report_type, {}).get(field, {})
+      if mapping.get(value) is not None:
+        return mapping[value]
+      elif type(value) is bool:
+        return {True: 'Yes', False: 'No'}[value]
+      return value
+
+    def generate():
+      output = io.StringIO()
+      writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
+
+      writer.writerow(['Domain', 'Agency', 'Field', 'Before', 'After', 'Change'])
+      for row in rows:
+        agency = find_agency(row['agency_slug'])
+        writer.writerow([
+          row['domain'],
+          (agency or {}).get('name') or row['agency_slug'],
+          LABELS.get(report_type, {}).get(row['field'], row['field'].capitalize()),
+          value_for(row['field'], row['before']),
+          value_for(row['field'], row['after']),
+          row['change']
+        ])
+
+        if output.tell() >= CSV_CHUNK_SIZE:
+          yield output.getvalue()
+          output.seek(0)
+          output.truncate()
+
+      yield output.getvalue()
+
+    return generate()
 
 
 class Agency:
@@ -201,19 +1174,20 @@ class Agency:
 
   # An agency which had at least 1 eligible domain.
   def eligible(report_name):
-    return db.table('agencies').search(
-      Query()[report_name]['eligible'] > 0
-    )
+    return read_model().eligible_agencies_for(report_name)
 
   # Create a new Agency record with a given name, slug, and total domain count.
   def create(data):
+    invalidate()
     return db.table('agencies').insert(data)
 
   def create_all(iterable):
+    invalidate()
     return db.table('agencies').insert_multiple(iterable)
 
   # For a given agency, add a report.
   def add_report(slug, report_name, report):
+    invalidate()
     return db.table('agencies').update(
       {
         report_name: report
@@ -222,11 +1196,7 @@ class Agency:
     )
 
   def find(slug):
-    agencies = db.table('agencies').search(where('slug') == slug)
-    if len(agencies) > 0:
-      return agencies[0]
-    else:
-      return None
+    return read_model().find_agency(slug)
 
   def all():
-    return db.table('agencies').all()
+    return read_model().all_agencies()
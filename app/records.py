@@ -0,0 +1,163 @@
+import collections.abc
+import os
+import sys
+import ujson
+
+# Compact, read-only domain records for the read model.
+#
+# Domain and subdomain records read from db.json are nested dicts with
+# the same handful of keys over and over. As dicts, every record carries
+# its own hash table and its own copy of every key string, which at our
+# subdomain counts adds up to most of the app's resident memory.
+#
+# A Record keeps only a tuple of values, and points at a Shape that's
+# shared by every record with the same keys in the same order. Repeated
+# strings (agency names, branches, sources) are shared too. Small ints
+# and booleans are already shared by Python.
+#
+# Records are read-only Mappings, so templates, CSV exports and anything
+# else that reads them with [], get() or items() works unchanged. ujson
+# serializes them to the same JSON as the dicts they came from (via
+# toDict()). Use plain() to get the dicts back.
+
+
+# The keys of a record, in order, and where each one's value lives.
+class Shape:
+  __slots__ = ('keys', 'index')
+
+  def __init__(self, keys):
+    self.keys = keys
+    self.index = {key: i for i, key in enumerate(keys)}
+
+class Record(collections.abc.Mapping):
+  __slots__ = ('shape', '_values')
+
+  def __init__(self, shape, values):
+    self.shape = shape
+    self._values = values
+
+  def __getitem__(self, key):
+    i = self.shape.index.get(key)
+    if i is None:
+      raise KeyError(key)
+    return self._values[i]
+
+  # Hot path, so skip Mapping's version (which goes by way of KeyError).
+  def get(self, key, default=None):
+    i = self.shape.index.get(key)
+    if i is None:
+      return default
+    return self._values[i]
+
+  def __contains__(self, key):
+    return key in self.shape.index
+
+  def __iter__(self):
+    return iter(self.shape.keys)
+
+  def __len__(self):
+    return len(self._values)
+
+  def __repr__(self):
+    return "Record(%r)" % self.toDict()
+
+  # Used by ujson when serializing. Shallow: ujson handles nested records.
+  def toDict(self):
+    return dict(zip(self.shape.keys, self._values))
+
+
+# Builds compact records. Shapes and repeated strings are shared between
+# all the records made by the same Compactor.
+class Compactor:
+
+  def __init__(self):
+    self.shapes = {}
+    self.strings = {}
+
+  def compact(self, value):
+    if isinstance(value, dict):
+      keys = tuple(self.string(key) for key in value.keys())
+      shape = self.shapes.get(keys)
+      if shape is None:
+        shape = self.shapes[keys] = Shape(keys)
+      return Record(shape, tuple(self.compact(item) for item in value.values()))
+    elif isinstance(value, list):
+      return tuple(self.compact(item) for item in value)
+    elif isinstance(value, str):
+      return self.string(value)
+    else:
+      return value
+
+  def string(self, value):
+    return self.strings.setdefault(value, value)
+
+# Compacts a list of records, sharing shapes and strings between them.
+def compact_all(values):
+  compactor = Compactor()
+  return [compactor.compact(value) for value in values]
+
+# The inverse of compaction: plain dicts and lists again.
+def plain(value):
+  if isinstance(value, Record):
+    return {key: plain(item) for key, item in zip(value.shape.keys, value._values)}
+  elif isinstance(value, (list, tuple)):
+    return [plain(item) for item in value]
+  else:
+    return value
+
+
+###
+# Memory report.
+
+# Bytes used by `value` and everything it holds, not counting anything
+# already in `seen` (so that shared objects are only counted once).
+def deep_size(value, seen):
+  if id(value) in seen:
+    return 0
+  seen.add(id(value))
+
+  size = sys.getsizeof(value)
+  if isinstance(value, Record):
+    size += deep_size(value.shape, seen) + deep_size(value._values, seen)
+  elif isinstance(value, Shape):
+    size += deep_size(value.keys, seen) + deep_size(value.index, seen)
+  elif isinstance(value, dict):
+    for key, item in value.items():
+      size += deep_size(key, seen) + deep_size(item, seen)
+  elif isinstance(value, (list, tuple)):
+    for item in value:
+      size += deep_size(item, seen)
+  return size
+
+# Average bytes per domain record in the given db.json, as parsed dicts
+# and as compact records.
+def memory_report(path):
+  with open(path, encoding='utf-8') as f:
+    domains = list(ujson.load(f).get('domains', {}).values())
+
+  # None, True, False and small ints are shared by every object anyway.
+  shared = {id(None), id(True), id(False)} | {id(i) for i in range(-5, 257)}
+
+  count = max(len(domains), 1)
+  as_dicts = deep_size(domains, set(shared)) / count
+  as_records = deep_size(compact_all(domains), set(shared)) / count
+
+  return {
+    'records': len(domains),
+    'dict_bytes': as_dicts,
+    'record_bytes': as_records
+  }
+
+
+### Run when executed.
+#
+# Run with:
+#   python -m app.records [path/to/db.json]
+
+if __name__ == '__main__':
+  path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), '../data/db.json')
+  report = memory_report(path)
+  print("%i domain records" % report['records'])
+  print("  as dicts:           %7.0f bytes/record" % report['dict_bytes'])
+  print("  as compact records: %7.0f bytes/record" % report['record_bytes'])
+  print("  saving:             %7.0f%%" % (100 * (1 - (report['record_bytes'] / max(report['dict_bytes'], 1)))))
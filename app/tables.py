@@ -0,0 +1,141 @@
+# Server-side paging, searching and sorting of domain and host listings,
+# for tables too large to hand to the browser in one go.
+#
+# Speaks DataTables' server-side protocol:
+# https://datatables.net/manual/server-side
+#
+# Only the first ordering column is honored. Sorting is by the raw value
+# of the column's data field (e.g. a count, not a rendered percentage).
+#
+# Each sort order the site's tables use (SORT_FIELDS) is computed once
+# per read model and then reused, so without a search, a page costs
+# O(page size). Any other field is sorted on for that request alone, so
+# that clients can't fill memory with made-up ones. Searching has to look
+# at every record, so a search costs O(listing size).
+
+import collections.abc
+
+# Searched when the request doesn't say which columns are searchable.
+SEARCH_FIELDS = ['domain', 'base_domain', 'agency_name', 'canonical']
+
+# Fields the domain and host tables sort by, whose sort orders are kept.
+SORT_FIELDS = frozenset([
+  'domain', 'base_domain', 'canonical', 'agency_name',
+  'https.eligible', 'https.compliant', 'https.enforces', 'https.hsts',
+  'https.bod_crypto', 'https.preloaded',
+  'totals.https.compliant', 'totals.https.enforces', 'totals.https.hsts',
+  'totals.crypto.bod_crypto',
+  'analytics.participating',
+])
+
+# Upper limit on the page size, to keep "show all" from being abused.
+MAX_LENGTH = 1000
+
+
+# Pulls the query out of DataTables' request parameters.
+# Raises ValueError if they don't make sense.
+def query_for(args):
+  query = {
+    'draw': int(args.get('draw', 0)),
+    'start': int(args.get('start', 0)),
+    'length': int(args.get('length', 100)),
+    'search': args.get('search[value]', '').strip().lower().split(),
+    'order': None,
+    'descending': False,
+    'fields': []
+  }
+
+  if query['start'] < 0:
+    raise ValueError("start must be 0 or more")
+  if (query['length'] < 0) or (query['length'] > MAX_LENGTH):
+    query['length'] = MAX_LENGTH
+
+  columns = []
+  while ('columns[%i][data]' % len(columns)) in args:
+    i = len(columns)
+    columns.append({
+      'data': args.get('columns[%i][data]' % i),
+      'searchable': args.get('columns[%i][searchable]' % i, 'true') == 'true',
+      'orderable': args.get('columns[%i][orderable]' % i, 'true') == 'true'
+    })
+
+  query['fields'] = [
+    column['data'] for column in columns
+    if column['searchable'] and column['data']
+  ] or SEARCH_FIELDS
+
+  if 'order[0][column]' in args:
+    column = int(args.get('order[0][column]'))
+    if (column < 0) or (column >= len(columns)):
+      raise ValueError("order[0][column] isn't one of the columns")
+    if columns[column]['orderable'] and columns[column]['data']:
+      query['order'] = columns[column]['data']
+      query['descending'] = (args.get('order[0][dir]', 'asc') == 'desc')
+
+  return query
+
+# Answers `query` from `records`, which are in the listing's natural
+# order. Sort orders by SORT_FIELDS are memoized on `read_model` under
+# `key`.
+def page(read_model, key, records, query, keep=True):
+  ordered = records
+  if query['order']:
+    field, descending = query['order'], query['descending']
+    ordered = read_model.memo(
+      key + ('order', field, descending),
+      lambda: tuple(sorted(
+        records,
+        key=lambda record: sort_key(value_at(record, field)),
+        reverse=descending
+      )),
+      keep=(keep and (field in SORT_FIELDS))
+    )
+
+  start, end = query['start'], query['start'] + query['length']
+  if query['search']:
+    matches = [
+      record for record in ordered
+      if matches_search(record, query['fields'], query['search'])
+    ]
+    filtered, data = len(matches), matches[start:end]
+  else:
+    filtered, data = len(ordered), ordered[start:end]
+
+  return {
+    'draw': query['draw'],
+    'recordsTotal': len(records),
+    'recordsFiltered': filtered,
+    'data': list(data)
+  }
+
+# Looks up a dotted field name, like "totals.https.hsts", in a record.
+def value_at(record, field):
+  value = record
+  for part in field.split('.'):
+    if not isinstance(value, collections.abc.Mapping):
+      return None
+    value = value.get(part)
+  return value
+
+# Sort key that tolerates missing values and mixed types: missing values
+# first, then numbers (and booleans), then text, then anything else.
+def sort_key(value):
+  if value is None:
+    return (0, 0)
+  elif isinstance(value, (bool, int, float)):
+    return (1, value)
+  elif isinstance(value, str):
+    return (2, value.lower())
+  else:
+    return (3, str(value).lower())
+
+# Like DataTables' own search: every term has to appear in at least one
+# of the fields. Missing values and booleans aren't text anyone would
+# search for ("none", "true"), so they're left out.
+def matches_search(record, fields, terms):
+  values = [value_at(record, field) for field in fields]
+  text = " ".join(
+    str(value).lower() for value in values
+    if (value is not None) and (not isinstance(value, bool))
+  )
+  return all((term in text) for term in terms)
@@ -1,12 +1,25 @@
 
-from flask import render_template, Response
+from flask import render_template, Response, request, abort
 from app import models
+from app import compression
+from app import tables
 from app.data import FIELD_MAPPING
 import os
 import ujson
 
 def register(app):
 
+    # Each request sees one version of the data from start to finish,
+    # even if new data is loaded in the meantime.
+    @app.before_request
+    def pin_data():
+        models.check_for_updates()
+        models.pin()
+
+    @app.teardown_request
+    def unpin_data(exception):
+        models.unpin()
+
     @app.route("/data/")
     def data():
         return render_template("data.html")
@@ -22,67 +35,210 @@ def register(app):
     ##
     # Data endpoints.
 
+    # Serve an export from the read model's cache, rendering it on first
+    # use, precompressed if the client accepts it. Clients that already
+    # have the current version get a 304, without anything being rendered.
+    #
+    # With stream=True, `render` returns an iterable of chunks, and the
+    # uncompressed body is streamed to clients rather than kept around.
+    def export_response(key, content_type, render, keep=True, stream=False):
+        # Nothing worth caching: just stream it.
+        if stream and not keep:
+          response = Response(render())
+          response.headers['Content-Type'] = content_type
+          return response
+
+        export = models.read_model().export(key, render, keep=keep, stream=stream)
+
+        # each encoding is a different representation, with its own ETag
+        encoding = compression.best_encoding(export.variants)
+        etag = export.etag if encoding is None else "%s-%s" % (export.etag, encoding)
+
+        if request.if_none_match.contains(etag):
+          response = Response(status=304)
+        elif encoding is not None:
+          response = Response(export.variants[encoding])
+          response.headers['Content-Encoding'] = encoding
+        elif export.body is not None:
+          response = Response(export.body)
+        else:
+          # Streamed as it's rendered. (make_conditional would read the
+          # whole body in to work out its length.)
+          response = Response(render())
+
+        response.set_etag(etag)
+        response.headers['Content-Type'] = content_type
+        response.vary.add('Accept-Encoding')
+        return response
+
+    # How a listing of domains is exported, by extension, as
+    # (content type, render, stream), or None for an unknown extension.
+    def domains_export(domains, report_name, ext):
+        if ext == "json":
+          return 'application/json', lambda: ujson.dumps({'data': domains()}), False
+        elif ext == "csv":
+          return 'text/csv', lambda: models.Domain.to_csv_rows(domains(), report_name), True
+        return None
+
+    def domains_response(key, domains, report_name, ext, keep):
+        export = domains_export(domains, report_name, ext)
+        if export is None:
+          abort(404)
+        content_type, render, stream = export
+        return export_response(key, content_type, render, keep=keep, stream=stream)
+
+    def render_report(report_name):
+        return lambda: ujson.dumps(models.Report.latest().get(report_name, {}))
+
+    def render_agencies(report_name):
+        return lambda: ujson.dumps({'data': models.Agency.eligible(report_name)})
+
+    # Renders and compresses the exports the site's pages load (each
+    # report's totals, agencies, parent domains and hosts) for each newly
+    # loaded read model, before it's put into service, so that no request
+    # has to wait on them. Anything else is rendered on first request.
+    def warm_exports(read_model):
+        for report_name in sorted(read_model.domain_reports() | set(read_model.eligible_agencies)):
+          read_model.export(('reports', report_name), render_report(report_name))
+          read_model.export(('agencies', report_name), render_agencies(report_name))
+
+          listings = [
+            ('domains', lambda: models.Domain.eligible_parents(report_name)),
+            ('hosts', lambda: models.Domain.eligible(report_name)),
+          ]
+          for kind, domains in listings:
+            for ext in ["json", "csv"]:
+              content_type, render, stream = domains_export(domains, report_name, ext)
+              read_model.export((kind, report_name, ext), render, stream=stream)
+
+    models.on_load('exports', warm_exports)
+
+    # One page of a listing, for DataTables' server-side mode, or any
+    # other client that asks for one with ?start=&length= (see app/tables.py).
+    def wants_page():
+        return any((arg in request.args) for arg in ['draw', 'start', 'length'])
+
+    def page_response(key, records, keep):
+        try:
+          query = tables.query_for(request.args)
+        except ValueError:
+          abort(400)
+
+        page = tables.page(models.read_model(), key, records, query, keep=keep)
+        response = Response(ujson.dumps(page))
+        response.headers['Content-Type'] = 'application/json'
+        return response
+
     # High-level %'s, used to power the donuts.
     @app.route("/data/reports/<report_name>.json")
     def report(report_name):
-        response = Response(ujson.dumps(models.Report.latest().get(report_name, {})))
+        return export_response(
+          ('reports', report_name), 'application/json', render_report(report_name),
+          keep=models.read_model().knows_report(report_name)
+        )
+
+    # A report's daily totals over time, government-wide or for one
+    # agency (?agency=<slug>), for every day in the history or just those
+    # from ?from= to ?to= (YYYY-MM-DD, inclusive).
+    @app.route("/data/reports/history/<report_name>.json")
+    def report_history(report_name):
+        start, end = request.args.get('from'), request.args.get('to')
+        for date in (start, end):
+          if date is not None:
+            try:
+              models.Report.report_time(date)
+            except ValueError:
+              abort(400)
+
+        series = models.Report.history(
+          report_name, start=start, end=end, agency=request.args.get('agency')
+        )
+
+        response = Response(ujson.dumps({'data': series}))
         response.headers['Content-Type'] = 'application/json'
-        return response
+        response.add_etag()
+        return response.make_conditional(request)
+
+    # Hosts whose codes for a report changed since the data before,
+    # optionally just for one agency (?agency=<slug>), or one kind of
+    # change (?change=regressed, improved, added, removed or changed).
+    @app.route("/data/changes/<report_name>.<ext>")
+    def changes(report_name, ext):
+        agency, kind = request.args.get('agency'), request.args.get('change')
+        if (kind is not None) and (kind not in models.Change.KINDS):
+          abort(400)
+
+        change = models.Change.latest(report_name)
+        keep = (change is not None) and (
+          (agency is None) or (models.Agency.find(agency) is not None)
+        )
+
+        def rows():
+          return [] if change is None else models.Change.rows(change, agency=agency, kind=kind)
+
+        key = ('changes', report_name, ext, agency, kind)
+        if ext == "json":
+          return export_response(key, 'application/json', lambda: ujson.dumps({
+            'report_date': change and change['report_date'],
+            'since': change and change['since'],
+            'data': rows()
+          }), keep=keep)
+        elif ext == "csv":
+          return export_response(key, 'text/csv',
+            lambda: models.Change.to_csv_rows(rows(), report_name),
+            keep=keep, stream=True)
+        abort(404)
 
     # Detailed data per-parent-domain.
     @app.route("/data/domains/<report_name>.<ext>")
     def domain_report(report_name, ext):
-        domains = models.Domain.eligible_parents(report_name)
-        domains = sorted(domains, key=lambda k: k['domain'])
+        keep = models.read_model().knows_report(report_name)
 
-        if ext == "json":
-          response = Response(ujson.dumps({'data': domains}))
-          response.headers['Content-Type'] = 'application/json'
-        elif ext == "csv":
-          response = Response(models.Domain.to_csv(domains, report_name))
-          response.headers['Content-Type'] = 'text/csv'
-        return response
+        # already sorted by domain
+        def domains():
+          return models.Domain.eligible_parents(report_name)
+
+        if (ext == "json") and wants_page():
+          return page_response(('domains', report_name), domains(), keep)
+
+        return domains_response(
+          ('domains', report_name, ext), domains, report_name, ext, keep
+        )
 
     # Detailed data per-host for a given report.
     @app.route("/data/hosts/<report_name>.<ext>")
     def hostname_report(report_name, ext):
-        domains = models.Domain.eligible(report_name)
+        keep = models.read_model().knows_report(report_name)
 
-        # sort by base domain, but subdomain within them
-        domains = sorted(domains, key=lambda k: k['domain'])
-        domains = sorted(domains, key=lambda k: k['base_domain'])
+        # already sorted by base domain, but subdomain within them
+        def domains():
+          return models.Domain.eligible(report_name)
 
-        if ext == "json":
-          response = Response(ujson.dumps({'data': domains}))
-          response.headers['Content-Type'] = 'application/json'
-        elif ext == "csv":
-          response = Response(models.Domain.to_csv(domains, report_name))
-          response.headers['Content-Type'] = 'text/csv'
-        return response
+        if (ext == "json") and wants_page():
+          return page_response(('hosts', report_name), domains(), keep)
+
+        return domains_response(
+          ('hosts', report_name, ext), domains, report_name, ext, keep
+        )
 
     # Detailed data for all subdomains of a given parent domain, for a given report.
     @app.route("/data/hosts/<domain>/<report_name>.<ext>")
     def hostname_report_for_domain(domain, report_name, ext):
-        domains = models.Domain.eligible_for_domain(domain, report_name)
+        # already sorted by hostname, with the parent at the top if it exists
+        def domains():
+          return models.Domain.eligible_for_domain(domain, report_name)
 
-        # sort by hostname, but put the parent at the top if it exist
-        domains = sorted(domains, key=lambda k: k['domain'])
-        domains = sorted(domains, key=lambda k: k['is_parent'], reverse=True)
-
-        if ext == "json":
-            response = Response(ujson.dumps({'data': domains}))
-            response.headers['Content-Type'] = 'application/json'
-        elif ext == "csv":
-            response = Response(models.Domain.to_csv(domains, report_name))
-            response.headers['Content-Type'] = 'text/csv'
-        return response
+        return domains_response(
+          ('hosts', domain, report_name, ext), domains, report_name, ext,
+          keep=(len(models.Domain.eligible_for_domain(domain, report_name)) > 0)
+        )
 
     @app.route("/data/agencies/<report_name>.json")
     def agency_report(report_name):
-        domains = models.Agency.eligible(report_name)
-        response = Response(ujson.dumps({'data': domains}))
-        response.headers['Content-Type'] = 'application/json'
-        return response
+        return export_response(
+          ('agencies', report_name), 'application/json', render_agencies(report_name),
+          keep=models.read_model().knows_report(report_name)
+        )
 
     @app.route("/https/domains/")
     def https_domains():
@@ -0,0 +1,461 @@
+###
+#
+# Benchmarks for data processing.
+#
+# * https: works out the HTTPS report and per-domain totals for every
+#   scanned host in data/output (see data/processing.py for what's
+#   expected there), with the scalar engine and with the numpy engine,
+#   and checks that they agree.
+#
+# * pipeline: generates synthetic domain and scan CSVs at some multiple
+#   of production's size, runs all of data/processing.py over them, and
+#   compares each stage's time and memory use (see data/metrics.py), and
+#   the db.json it writes, with a stored baseline.
+#
+###
+
+import os
+import sys
+import csv
+import time
+import shutil
+import random
+import hashlib
+import subprocess
+import ujson
+
+from data import processing
+from data.env import DATA_DIR, GATHERER_NAMES, options
+from data.processing import HttpsBatch, https_behavior_for, total_https_report, total_crypto_report
+
+
+# Every scanned parent domain and subdomain, as arguments for
+# https_behavior_for(), with the index of the parent domain each one is
+# totalled under.
+def https_hosts():
+  domains, agencies, gathered_subdomains = processing.load_domain_data()
+  parent_scan_data = processing.load_parent_scan_data(domains)
+  subdomains, subdomain_scan_data = processing.load_subdomain_scan_data(domains, parent_scan_data, gathered_subdomains)
+
+  hosts, groups = [], []
+  for i, domain_name in enumerate(parent_scan_data.keys()):
+    parent_scan = parent_scan_data[domain_name]
+    if parent_scan.get('pshtt') is None:
+      continue
+    parent_preloaded = processing.preloaded_or_not(parent_scan['pshtt'])
+
+    for subdomain_name in parent_scan.get('subdomains', []):
+      scan = subdomain_scan_data[subdomain_name]
+      hosts.append((subdomain_name, scan['pshtt'], scan.get('sslyze', None), parent_preloaded))
+      groups.append(i)
+
+    hosts.append((domain_name, parent_scan['pshtt'], parent_scan.get('sslyze', None), None))
+    groups.append(i)
+
+  return hosts, groups, len(parent_scan_data)
+
+def scalar_https(hosts, groups, n_groups):
+  reports = [https_behavior_for(*host) for host in hosts]
+
+  by_group = [[] for i in range(n_groups)]
+  for group, report in zip(groups, reports):
+    by_group[group].append(report)
+
+  https = [total_https_report(group) for group in by_group]
+  crypto = [
+    total_crypto_report([report for report in group if report.get('rc4') is not None])
+    for group in by_group
+  ]
+  return reports, https, crypto
+
+def numpy_https(hosts, groups, n_groups):
+  batch = HttpsBatch(hosts, groups, n_groups)
+  return batch.reports(), batch.total_https(), batch.total_crypto()
+
+# Best of `repeat` runs, in seconds, and the result.
+def timed(function, args, repeat):
+  best, result = None, None
+  for i in range(repeat):
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    if (best is None) or (elapsed < best):
+      best = elapsed
+  return best, result
+
+def benchmark_https(repeat=3):
+  args = https_hosts()
+  scalar_time, scalar = timed(scalar_https, args, repeat)
+  numpy_time, vectorized = timed(numpy_https, args, repeat)
+
+  return {
+    'hosts': len(args[0]),
+    'scalar': scalar_time,
+    'numpy': numpy_time,
+    'same': (scalar == vectorized)
+  }
+
+
+### Synthetic data.
+#
+# Generated from a seeded random number generator, so the same scale and
+# seed always write the same CSVs, byte for byte. They're written sorted
+# by hostname, as domain-gather and domain-scan write them with --sort.
+
+# Roughly the size of production's data at 1x: parent domains in
+# domains.csv, and hostnames gathered for them.
+PARENTS = 1300
+GATHERED = 40000
+AGENCIES = 130
+
+BENCHMARK_DATA = os.path.join(DATA_DIR, "./output/benchmark")
+
+# Bump whenever the generator changes what it writes, so data generated
+# before isn't reused (or compared with a baseline) as if it were the same.
+GENERATOR_VERSION = 1
+
+PREFIXES = ["www", "api", "app", "mail", "portal", "search", "data", "test", "dev", "apps"]
+
+DOMAIN_TYPES = (
+  ["Federal Agency - Executive"] * 17 +
+  ["Federal Agency - Legislative", "Federal Agency - Judicial", "City"]
+)
+
+PSHTT_COLUMNS = [
+  "Domain", "Base Domain", "Canonical URL", "Live", "Redirect", "Redirect To",
+  "Valid HTTPS", "Defaults to HTTPS", "Downgrades HTTPS",
+  "Strictly Forces HTTPS", "HTTPS Bad Chain", "HTTPS Bad Hostname",
+  "HTTPS Expired Cert", "HSTS", "HSTS Header", "HSTS Max Age",
+  "HSTS Entire Domain", "HSTS Preload Ready", "HSTS Preload Pending",
+  "HSTS Preloaded", "Base Domain HSTS Preloaded", "Domain Supports HTTPS",
+  "Unknown Error"
+]
+
+SSLYZE_COLUMNS = [
+  "Domain", "Base Domain", "Scanned Hostname", "SSLv2", "SSLv3", "TLSv1.0",
+  "Any RC4", "Any 3DES", "Errors"
+]
+
+# Where generate() writes a given scale and seed's data, laid out the way
+# data/output is.
+def data_path(scale, seed=0):
+  return os.path.join(BENCHMARK_DATA, "%sx-seed%i-v%i" % (scale, seed, GENERATOR_VERSION))
+
+# Writes synthetic data at `scale` times production's size, unless it's
+# already been written, and returns where it is.
+def generate(scale, seed=0):
+  path = data_path(scale, seed)
+  if os.path.isdir(path):
+    return path
+
+  # written aside and moved into place, so it's never half there
+  partial = path + ".partial"
+  shutil.rmtree(partial, ignore_errors=True)
+  write_synthetic_data(partial, scale, seed)
+  os.replace(partial, path)
+  return path
+
+def write_synthetic_data(path, scale, seed):
+  r = random.Random(seed)
+
+  n_parents = max(1, round(PARENTS * scale))
+  n_gathered = round(GATHERED * scale)
+  agencies = ["Department of Synthetic Agency %i" % i for i in range(min(AGENCIES, n_parents))]
+
+  parents = ["domain%07i.gov" % i for i in range(n_parents)]
+  write_csv(
+    os.path.join(path, "parents/cache/domains.csv"),
+    ["Domain Name", "Domain Type", "Agency", "Organization", "City", "State", "Security Contact Email"],
+    ([
+      # domains.csv isn't always lowercase
+      parent.upper() if (r.random() < 0.05) else parent,
+      r.choice(DOMAIN_TYPES), r.choice(agencies), "", "Washington", "DC", ""
+    ] for parent in parents)
+  )
+
+  # A few parent domains have most of the subdomains.
+  weights = [r.paretovariate(1.0) for parent in parents]
+  counts = [0] * n_parents
+  for i in r.choices(range(n_parents), weights=weights, k=n_gathered):
+    counts[i] += 1
+
+  gathered = []
+  for parent, count in zip(parents, counts):
+    for i in range(count):
+      prefix = PREFIXES[i % len(PREFIXES)] + (str(i // len(PREFIXES)) if i >= len(PREFIXES) else "")
+      gathered.append((prefix + "." + parent, parent))
+  gathered.sort()
+
+  write_csv(
+    os.path.join(path, "subdomains/gather/results/gathered.csv"),
+    ["Domain", "Base Domain"] + GATHERER_NAMES,
+    ([name, parent] + [boolean(r, 0.4) for gatherer in GATHERER_NAMES] for name, parent in gathered)
+  )
+
+  # Not every domain gets scanned, and not every scan works.
+  scanned = [parent for parent in parents if r.random() < 0.97]
+  write_csv(
+    os.path.join(path, "parents/results/pshtt.csv"), PSHTT_COLUMNS,
+    (pshtt_row(r, parent, parent, live=0.9) for parent in scanned)
+  )
+  write_csv(
+    os.path.join(path, "parents/results/sslyze.csv"), SSLYZE_COLUMNS,
+    (sslyze_row(r, parent, parent) for parent in scanned if r.random() < 0.9)
+  )
+  write_csv(
+    os.path.join(path, "parents/results/analytics.csv"),
+    ["Domain", "Base Domain", "Participates in Analytics"],
+    ([parent, parent, boolean(r, 0.5)] for parent in parents)
+  )
+
+  scanned = [host for host in gathered if r.random() < 0.95]
+  write_csv(
+    os.path.join(path, "subdomains/scan/results/pshtt.csv"), PSHTT_COLUMNS,
+    (pshtt_row(r, name, parent, live=0.5) for name, parent in scanned)
+  )
+  write_csv(
+    os.path.join(path, "subdomains/scan/results/sslyze.csv"), SSLYZE_COLUMNS,
+    (sslyze_row(r, name, parent) for name, parent in scanned if r.random() < 0.6)
+  )
+
+def pshtt_row(r, name, parent, live):
+  return [
+    name, parent, "https://%s" % name, boolean(r, live), boolean(r, 0.2), "",
+    boolean(r, 0.7), boolean(r, 0.6), boolean(r, 0.05),
+    boolean(r, 0.5), boolean(r, 0.1), boolean(r, 0.1),
+    "False", boolean(r, 0.5), "", r.choice(["", "0", "300", "31536000", "63072000"]),
+    boolean(r, 0.3), boolean(r, 0.2), "False",
+    boolean(r, 0.15), "False", "True",
+    "False"
+  ]
+
+def sslyze_row(r, name, parent):
+  # invalid scans have these left empty
+  if r.random() < 0.05:
+    return [name, parent, name, "", "", "", "", "", "Timed out"]
+  return [
+    name, parent, name, boolean(r, 0.02), boolean(r, 0.1), "True",
+    boolean(r, 0.1), boolean(r, 0.2), ""
+  ]
+
+def boolean(r, probability):
+  return "True" if (r.random() < probability) else "False"
+
+def write_csv(path, header, rows):
+  processing.mkdir_p(os.path.dirname(path))
+  with open(path, 'w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(header)
+    writer.writerows(rows)
+
+
+### Pipeline benchmark.
+#
+# Each run is a separate `python -m data.benchmark --process=<data>`
+# process, so runs don't share memory (and peak RSS means something),
+# pointed at the synthetic data and writing everything it makes
+# (db.json, metrics.json, caches) next to it rather than in data/.
+
+BASELINE = os.path.join(BENCHMARK_DATA, "baseline.json")
+
+# Processing options passed on to each run.
+PROCESSING_OPTIONS = ["workers", "engine", "join", "backend", "incremental", "history", "trace-memory"]
+
+# Stages have to be this much slower than the baseline (as a fraction of
+# it, and in seconds, to rule out noise) to count as a regression.
+TOLERANCE = 0.2
+NOISE = 0.05
+
+# A fixed report date, so db.json comes out the same every time.
+REPORT_DATE = "2018-01-01"
+
+def run_path(data):
+  return os.path.join(data, "run")
+
+# Runs processing over the data in `data`, in this process.
+def process(data, options):
+  from tinydb import TinyDB
+  from app import models
+
+  out = run_path(data)
+  processing.mkdir_p(out)
+
+  processing.PARENT_CACHE = os.path.join(data, "parents/cache")
+  processing.PARENT_DOMAINS_CSV = os.path.join(data, "parents/cache/domains.csv")
+  processing.PARENT_RESULTS = os.path.join(data, "parents/results")
+  processing.SUBDOMAIN_DOMAINS_CSV = os.path.join(data, "subdomains/gather/results/gathered.csv")
+  processing.SUBDOMAIN_DATA_SCANNED = os.path.join(data, "subdomains/scan")
+  processing.PARSED_CACHE = os.path.join(out, "cache")
+  processing.PROCESSING_STATE = os.path.join(out, "state.json")
+  processing.PROCESSING_METRICS = os.path.join(out, "metrics.json")
+  processing.HISTORY_DATA = os.path.join(out, "history.jsonl")
+
+  models.DB_PATH = os.path.join(out, "db.json")
+  models.SQLITE_PATH = os.path.join(out, "db.sqlite")
+  models.db = TinyDB(models.DB_PATH)
+
+  processing.run(REPORT_DATE, dict(options, cache=False))
+
+# Runs processing over `scale`'s data in a new process, and returns its
+# metrics, with a digest of the db.json it wrote.
+def benchmark_scale(scale, seed, options):
+  data = generate(scale, seed)
+  out = run_path(data)
+  shutil.rmtree(out, ignore_errors=True)
+
+  command = [sys.executable, "-m", "data.benchmark", "--process=%s" % os.path.basename(data)]
+  command += ["--%s=%s" % (name, value) for name, value in options.items()]
+  result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+  if result.returncode != 0:
+    sys.stdout.write(result.stdout.decode('utf-8', 'replace'))
+    raise RuntimeError("Processing %sx data failed." % scale)
+
+  with open(os.path.join(out, "metrics.json"), encoding='utf-8') as f:
+    metrics = ujson.load(f)
+
+  db_json = os.path.join(out, "db.json")
+  if os.path.exists(db_json):
+    with open(db_json, 'rb') as f:
+      metrics['output'] = hashlib.sha1(f.read()).hexdigest()
+  else:
+    metrics['output'] = None
+
+  return metrics
+
+# Best of `repeat` runs, by wall-clock time.
+def benchmark_pipeline(scales, seed=0, repeat=1, options=None):
+  results = {}
+  for scale in scales:
+    runs = [benchmark_scale(scale, seed, options or {}) for i in range(repeat)]
+    results[str(scale)] = min(runs, key=lambda run: run['wall'])
+  return {'seed': seed, 'generator': GENERATOR_VERSION, 'options': options or {}, 'scales': results}
+
+def load_baseline(path=BASELINE):
+  try:
+    with open(path, encoding='utf-8') as f:
+      return ujson.load(f)
+  except (OSError, ValueError):
+    return None
+
+def save_baseline(results, path=BASELINE):
+  processing.mkdir_p(os.path.dirname(path))
+  with open(path + ".tmp", 'w', encoding='utf-8') as f:
+    ujson.dump(results, f, indent=2)
+  os.replace(path + ".tmp", path)
+
+# Lines comparing `results` with `baseline`, stage by stage, and whether
+# anything got slower, used more memory, or wrote different output.
+def compare(results, baseline, tolerance=TOLERANCE):
+  lines, regressed = [], False
+
+  if (baseline['seed'], baseline['generator']) != (results['seed'], results['generator']):
+    return ["The baseline was run on different synthetic data; save a new one."], False
+  if baseline['options'] != results['options']:
+    lines.append("Note: the baseline was run with %s." % (baseline['options'] or "no options"))
+
+  for scale, result in results['scales'].items():
+    before = baseline['scales'].get(scale)
+    if before is None:
+      lines.append("%sx: not in the baseline." % scale)
+      continue
+
+    lines.append("%sx:" % scale)
+    stages_before = {stage['name']: stage for stage in before['stages']}
+    for stage in result['stages'] + [dict(result, name="total")]:
+      old = before if (stage['name'] == "total") else stages_before.get(stage['name'])
+      if old is None:
+        lines.append("  %-16s (new)" % stage['name'])
+        continue
+
+      slower = (stage['wall'] > old['wall'] * (1 + tolerance)) and (stage['wall'] - old['wall'] > NOISE)
+      bigger = (stage['peak_rss'] > old['peak_rss'] * (1 + tolerance))
+      regressed = regressed or slower or bigger
+      lines.append("  %-16s %8.2fs (%s) %9.1fMB (%s)%s" % (
+        stage['name'],
+        stage['wall'], ratio(stage['wall'], old['wall']),
+        stage['peak_rss'] / (1024 * 1024), ratio(stage['peak_rss'], old['peak_rss']),
+        "  REGRESSED" if (slower or bigger) else ""
+      ))
+
+    if result['output'] != before['output']:
+      regressed = True
+      lines.append("  db.json is DIFFERENT from the baseline's.")
+
+  return lines, regressed
+
+def ratio(now, before):
+  return "%.2fx" % (now / before) if before else "-"
+
+
+### Run when executed.
+#
+# Run with:
+#   python -m data.benchmark
+#
+# to compare the HTTPS engines on data/output, or:
+#
+#   python -m data.benchmark --scale=1,10 [--repeat=3] [--seed=0] [--save-baseline]
+#
+# to benchmark processing on synthetic data, 1x and 10x production's
+# size, and compare it with the saved baseline (exiting with 1 if
+# anything regressed), or save it as the new baseline. Processing options
+# like --workers=N or --engine=scalar are passed on. --generate only
+# writes the synthetic data, to data/output/benchmark.
+
+def main(options):
+  if options.get("process"):
+    process(os.path.join(BENCHMARK_DATA, options["process"]), {
+      name: value for name, value in options.items() if name in PROCESSING_OPTIONS
+    })
+    return 0
+
+  if not options.get("scale"):
+    result = benchmark_https()
+    print("https: %i hosts" % result['hosts'])
+    print("  scalar: %7.3fs" % result['scalar'])
+    print("  numpy:  %7.3fs (%.1fx)" % (result['numpy'], result['scalar'] / max(result['numpy'], 1e-9)))
+    print("  same results: %s" % ("yes" if result['same'] else "NO"))
+    return 0
+
+  try:
+    scales = [float(scale) if ("." in scale) else int(scale) for scale in str(options["scale"]).split(",")]
+    seed = int(options.get("seed", 0))
+    repeat = int(options.get("repeat", 1))
+  except ValueError:
+    print("--scale must be a list of numbers, --seed and --repeat numbers.")
+    return 1
+
+  if options.get("generate"):
+    for scale in scales:
+      print(generate(scale, seed))
+    return 0
+
+  results = benchmark_pipeline(scales, seed=seed, repeat=repeat, options={
+    name: value for name, value in options.items() if name in PROCESSING_OPTIONS
+  })
+
+  for scale, result in results['scales'].items():
+    print("%sx: %.2fs, %.1fMB peak RSS" % (scale, result['wall'], result['peak_rss'] / (1024 * 1024)))
+    for stage in result['stages']:
+      print("  %-16s %8.2fs %9.1fMB %9s rows" % (
+        stage['name'], stage['wall'], stage['peak_rss'] / (1024 * 1024), stage['rows_out']
+      ))
+
+  if options.get("save-baseline"):
+    save_baseline(results)
+    print("Saved as the baseline, in %s." % BASELINE)
+    return 0
+
+  baseline = load_baseline()
+  if baseline is None:
+    print("No baseline to compare with yet; save one with --save-baseline.")
+    return 0
+
+  lines, regressed = compare(results, baseline)
+  print("Compared with the baseline:")
+  for line in lines:
+    print(line)
+  return 1 if regressed else 0
+
+if __name__ == '__main__':
+  sys.exit(main(options()))
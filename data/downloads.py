@@ -0,0 +1,190 @@
+###
+#
+# Downloads published data over HTTP, for data/update.py.
+#
+# Files are downloaded by a pool of threads. Each is written to
+# `<path>.partial` and moved into place once it's complete, so nothing
+# ever reads a file that's half downloaded. What the server said about
+# each file (its ETag and Last-Modified) is kept in DOWNLOAD_STATE, so
+# that next time:
+#
+# * files that are already current are asked for conditionally
+#   (If-None-Match, If-Modified-Since), and not downloaded again, and
+# * downloads that were cut off part way are picked up where they left
+#   off (Range), as long as the file hasn't changed since (If-Range).
+#
+# It's plain HTTP, so it can be pointed at any server, like a local one
+# for testing.
+#
+###
+
+import os
+import time
+import threading
+import urllib.error
+import urllib.request
+import concurrent.futures
+import ujson
+
+from data import logger
+
+
+LOGGER = logger.get_logger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+# What happened to each file.
+DOWNLOADED = "downloaded"
+RESUMED = "resumed"
+CURRENT = "current"
+MISSING = "missing"
+
+
+class Downloader:
+
+  # Downloads from `base_url` (with a trailing "/"), `workers` files at a
+  # time, keeping what it knows about each file in `state_path`.
+  def __init__(self, base_url, state_path, workers=8, timeout=60):
+    self.base_url = base_url
+    self.state_path = state_path
+    self.workers = workers
+    self.timeout = timeout
+
+    self.state = load_state(state_path)
+    self.state_lock = threading.Lock()
+
+  # Downloads each of `files`, a list of (remote path, relative to the
+  # base URL, local path, whether it has to be there), and returns
+  # {local path: (what happened, bytes downloaded)}. A file that isn't
+  # required and isn't there comes back as MISSING; anything else that
+  # goes wrong is raised, once all the others are done.
+  def download(self, files):
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+      futures = [
+        (path, pool.submit(self.fetch, src, path, required))
+        for src, path, required in files
+      ]
+      concurrent.futures.wait([future for path, future in futures])
+
+    results = {path: future.result() for path, future in futures}
+
+    total = sum(size for outcome, size in results.values())
+    outcomes = [outcome for outcome, size in results.values()]
+    LOGGER.info("[download] %i files in %.2fs: %s, %.1fMB" % (
+      len(files), time.perf_counter() - started,
+      ", ".join("%i %s" % (outcomes.count(outcome), outcome) for outcome in (DOWNLOADED, RESUMED, CURRENT, MISSING)),
+      total / (1024 * 1024)
+    ))
+    return results
+
+  def fetch(self, src, path, required=True):
+    url = self.base_url + src
+    partial = path + ".partial"
+    known = self.state.get(path, {})
+
+    # Pick up a partial download if we know which version of the file it
+    # was, otherwise start over.
+    offset = 0
+    headers = {}
+    resuming = known.get('partial')
+    if os.path.exists(partial) and resuming and validator(resuming):
+      offset = os.path.getsize(partial)
+      headers['Range'] = "bytes=%i-" % offset
+      headers['If-Range'] = validator(resuming)
+    elif os.path.exists(path) and validator(known):
+      if known.get('etag'):
+        headers['If-None-Match'] = known['etag']
+      if known.get('last_modified'):
+        headers['If-Modified-Since'] = known['last_modified']
+
+    try:
+      response = urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=self.timeout)
+    except urllib.error.HTTPError as error:
+      if error.code == 304:
+        LOGGER.info("[download] %s is current." % src)
+        return CURRENT, 0
+      if error.code == 416:
+        # the partial download is no good, so start over
+        self.discard(path, partial)
+        return self.fetch(src, path, required)
+      if (error.code == 404) and (not required):
+        LOGGER.info("[download] %s isn't there." % src)
+        return MISSING, 0
+      raise
+
+    with response:
+      found = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+      }
+
+      # The server sends the whole file instead if it's changed, or it
+      # doesn't do ranges.
+      resumed = (response.status == 206)
+
+      # Any part of the file but the one asked for is no use, so start
+      # over without a range (and give up if that's what was sent).
+      if resumed and ((not offset) or (content_range_start(response) != offset)):
+        if not offset:
+          raise urllib.error.URLError("%s sent part of the file, without being asked for it" % url)
+        self.discard(path, partial)
+        return self.fetch(src, path, required)
+
+      # Remember which version the partial download is of, in case this
+      # one's cut off too.
+      self.save_state(path, dict(known, partial=found))
+
+      size = 0
+      with open(partial, 'ab' if resumed else 'wb') as f:
+        while True:
+          chunk = response.read(CHUNK_SIZE)
+          if not chunk:
+            break
+          f.write(chunk)
+          size += len(chunk)
+
+    os.replace(partial, path)
+    self.save_state(path, found)
+
+    LOGGER.info("[download] %s: %i bytes%s." % (src, size, (" (from byte %i)" % offset) if resumed else ""))
+    return (RESUMED if resumed else DOWNLOADED), size
+
+  # Throws away a partial download, and what's known about it.
+  def discard(self, path, partial):
+    if os.path.exists(partial):
+      os.remove(partial)
+    self.save_state(path, dict(self.state.get(path, {}), partial=None))
+
+  # Updates what's known about one file, and saves it all.
+  def save_state(self, path, known):
+    with self.state_lock:
+      self.state[path] = known
+
+      directory = os.path.dirname(self.state_path)
+      if directory and (not os.path.isdir(directory)):
+        os.makedirs(directory)
+      with open(self.state_path + ".tmp", 'w', encoding='utf-8') as f:
+        ujson.dump(self.state, f, indent=2)
+      os.replace(self.state_path + ".tmp", self.state_path)
+
+
+def load_state(path):
+  try:
+    with open(path, encoding='utf-8') as f:
+      return ujson.load(f)
+  except (OSError, ValueError):
+    return {}
+
+# What to tell the server we have: an ETag if there is one (it's more
+# precise), otherwise the date it was last modified.
+def validator(known):
+  return known.get('etag') or known.get('last_modified')
+
+# Where the part of the file in a 206 response starts, from its
+# "Content-Range: bytes <start>-<end>/<size>" header.
+def content_range_start(response):
+  try:
+    return int(response.headers.get('Content-Range', '').split()[1].split('-')[0])
+  except (IndexError, ValueError):
+    return None
@@ -21,6 +21,25 @@ SUBDOMAIN_DATA_GATHERED = os.path.join(DATA_DIR, "./output/subdomains/gather")
 SUBDOMAIN_DATA_SCANNED = os.path.join(DATA_DIR, "./output/subdomains/scan")
 
 DB_DATA = os.path.join(DATA_DIR, "./db.json")
+
+# each day's government-wide and agency totals, appended to by processing
+HISTORY_DATA = os.path.join(DATA_DIR, "./history.jsonl")
+
+# how long each stage of processing took, and how much memory it used
+PROCESSING_METRICS = os.path.join(DATA_DIR, "./metrics.json")
+
+# parsed domain and scan CSVs, cached between processing runs
+PARSED_CACHE = os.path.join(DATA_DIR, "./output/cache")
+
+# what --incremental processing saves for the next run
+PROCESSING_STATE = os.path.join(DATA_DIR, "./output/processing/state.json")
+
+# what data.update last downloaded, so it's only downloaded again if changed
+DOWNLOAD_STATE = os.path.join(DATA_DIR, "./output/downloads.json")
+
+# which steps of data.update are done, and how long they took, to --resume from
+UPDATE_CHECKPOINT = os.path.join(DATA_DIR, "./output/update/checkpoint.json")
+
 BUCKET_NAME = META['bucket']
 AWS_REGION = META['aws_region']
 
@@ -66,16 +85,17 @@ def options():
     if arg.startswith("--"):
 
       if "=" in arg:
-        key, value = arg.split('=')
+        key, value = arg.split('=', 1)
       else:
         key, value = arg, "true"
 
       key = key.split("--")[1]
       key = key.lower()
-      value = value.lower()
 
-      if value == 'true': value = True
-      elif value == 'false': value = False
+      # Values are kept as given (URLs, paths and the like are
+      # case-sensitive), except for true and false, in any case.
+      if value.lower() == 'true': value = True
+      elif value.lower() == 'false': value = False
       options[key] = value
 
   return options
@@ -0,0 +1,148 @@
+###
+#
+# Per-stage metrics for data processing: for each stage of
+# processing.run(), how long it took in wall-clock and CPU time, how high
+# memory use peaked while it ran, and how many rows went in and came out.
+#
+# They're saved as JSON to PROCESSING_METRICS, next to db.json, so slow
+# runs can be compared with earlier ones, and logged as a table at the end
+# of the run.
+#
+###
+
+import os
+import time
+import resource
+import tracemalloc
+import contextlib
+import ujson
+
+from data import logger
+
+
+LOGGER = logger.get_logger(__name__)
+
+METRICS_VERSION = 1
+
+
+class Stages:
+
+  # With trace_memory=True, tracemalloc also records how much memory
+  # Python allocated during each stage. That's more precise than RSS, but
+  # makes everything several times slower, so it's off by default.
+  def __init__(self, trace_memory=False):
+    self.stages = []
+    self.trace_memory = trace_memory
+    self.started = time.perf_counter()
+
+    if trace_memory and (not tracemalloc.is_tracing()):
+      tracemalloc.start()
+
+  # Measures the body of the `with`, which can fill in how many rows went
+  # in and came out on the stage it's given, e.g.:
+  #
+  #   with stages.stage("load") as stage:
+  #     domains = load()
+  #     stage['rows_out'] = len(domains)
+  @contextlib.contextmanager
+  def stage(self, name, rows_in=None):
+    stage = {'name': name, 'rows_in': rows_in, 'rows_out': None}
+
+    reset_peak_rss()
+    if self.trace_memory:
+      # also resets the peak, so it only counts this stage's allocations
+      tracemalloc.clear_traces()
+    wall, cpu = time.perf_counter(), cpu_time()
+
+    yield stage
+
+    stage['wall'] = time.perf_counter() - wall
+    stage['cpu'] = cpu_time() - cpu
+    stage['peak_rss'] = peak_rss()
+    if self.trace_memory:
+      stage['peak_traced'] = tracemalloc.get_traced_memory()[1]
+    self.stages.append(stage)
+
+  def report(self, date=None):
+    return {
+      'version': METRICS_VERSION,
+      'report_date': date,
+      'wall': time.perf_counter() - self.started,
+      'cpu': sum(stage['cpu'] for stage in self.stages),
+      'peak_rss': max([stage['peak_rss'] for stage in self.stages] or [None]),
+      'stages': self.stages
+    }
+
+  def save(self, path, date=None):
+    directory = os.path.dirname(path)
+    if directory and (not os.path.isdir(directory)):
+      os.makedirs(directory)
+
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+      ujson.dump(self.report(date), f, indent=2)
+    os.replace(path + ".tmp", path)
+
+  def log(self):
+    report = self.report()
+    trace = self.trace_memory
+
+    LOGGER.info("[stages]")
+    LOGGER.info(table_row("stage", "wall", "cpu", "peak RSS", "traced", "rows in", "rows out", trace))
+    for stage in report['stages']:
+      LOGGER.info(table_row(
+        stage['name'], seconds(stage['wall']), seconds(stage['cpu']),
+        megabytes(stage['peak_rss']), megabytes(stage.get('peak_traced')),
+        count(stage['rows_in']), count(stage['rows_out']), trace
+      ))
+    LOGGER.info(table_row(
+      "total", seconds(report['wall']), seconds(report['cpu']),
+      megabytes(report['peak_rss']), "", "", "", trace
+    ))
+
+
+# CPU time for this process, plus any worker processes that have finished
+# (a --workers pool's are, by the time its stage is over).
+def cpu_time():
+  times = os.times()
+  return times.user + times.system + times.children_user + times.children_system
+
+# The most memory this process has had resident since the last
+# reset_peak_rss(), in bytes. Linux keeps that as VmHWM; elsewhere, fall
+# back to the peak for the whole process so far.
+def peak_rss():
+  try:
+    with open("/proc/self/status") as f:
+      for line in f:
+        if line.startswith("VmHWM:"):
+          return int(line.split()[1]) * 1024
+  except OSError:
+    pass
+
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # kilobytes on Linux, bytes on macOS
+  return peak if (os.uname().sysname == "Darwin") else peak * 1024
+
+def reset_peak_rss():
+  try:
+    with open("/proc/self/clear_refs", 'w') as f:
+      f.write("5")
+  except OSError:
+    pass
+
+
+### Formatting the table.
+
+def table_row(name, wall, cpu, rss, traced, rows_in, rows_out, trace):
+  row = "%-16s %9s %9s %10s" % (name, wall, cpu, rss)
+  if trace:
+    row += " %10s" % traced
+  return (row + " %9s %9s" % (rows_in, rows_out)).rstrip()
+
+def seconds(value):
+  return "%.2fs" % value
+
+def megabytes(value):
+  return "-" if value is None else "%.1fMB" % (value / (1024 * 1024))
+
+def count(value):
+  return "-" if value is None else "%i" % value
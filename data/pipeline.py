@@ -0,0 +1,167 @@
+###
+#
+# Runs the stages of data/update.py as a graph: each stage starts as soon
+# as the stages it comes after are done, so independent ones (like
+# scanning parent domains and subdomains) run at the same time.
+#
+# Each stage's status, start time, duration and return value are saved to
+# a checkpoint file as it finishes. If a run fails, the next one can be
+# told to resume it, and will skip the stages that already finished and
+# pick up their return values from the checkpoint, as long as it was
+# started with the same options.
+#
+###
+
+import os
+import time
+import datetime
+import collections
+import concurrent.futures
+import ujson
+
+from data import logger
+
+
+LOGGER = logger.get_logger(__name__)
+
+CHECKPOINT_VERSION = 1
+
+DONE = "done"
+FAILED = "failed"
+RUNNING = "running"
+
+
+class Pipeline:
+
+  # With resume=True, picks up an unfinished run from the checkpoint at
+  # `path`, if there is one. `options` are whatever decides what the
+  # stages do (JSON-serializable): a run can only be resumed with the same
+  # ones, and raises a ValueError otherwise.
+  def __init__(self, path, resume=False, options=None):
+    self.path = path
+    # name -> (function, names of the stages it comes after)
+    self.stages = collections.OrderedDict()
+
+    previous = load_checkpoint(path) if resume else None
+    if previous and (previous.get('finished') is None):
+      if previous.get('options') != options:
+        raise ValueError("Can't resume the run started %s, which had different options (%s)." % (
+          previous['started'], ujson.dumps(previous.get('options'))
+        ))
+      LOGGER.info("[pipeline] Resuming the run started %s." % previous['started'])
+      self.checkpoint = previous
+      self.checkpoint['stages'] = {
+        name: stage for name, stage in previous['stages'].items()
+        if stage['status'] == DONE
+      }
+    else:
+      if resume:
+        LOGGER.info("[pipeline] Nothing to resume, starting a new run.")
+      self.checkpoint = {
+        'version': CHECKPOINT_VERSION,
+        'started': now(), 'finished': None,
+        'options': options,
+        'stages': {}
+      }
+
+  # Adds a stage, to run `function` with the results of the stages before
+  # it ({name: return value}) once all the stages in `after` are done.
+  # Stages can only come after ones already added, so there are no cycles.
+  def stage(self, name, function, after=()):
+    for before in after:
+      if before not in self.stages:
+        raise ValueError("Stage %s comes after %s, which hasn't been added." % (name, before))
+    self.stages[name] = (function, list(after))
+
+  def results(self):
+    return {name: stage.get('result') for name, stage in self.checkpoint['stages'].items() if stage['status'] == DONE}
+
+  def done(self, name):
+    stage = self.checkpoint['stages'].get(name)
+    return (stage is not None) and (stage['status'] == DONE)
+
+  # Runs every stage that isn't done yet, and raises what the first one
+  # to fail raised, once the others already running are over.
+  def run(self):
+    pending = [name for name in self.stages if not self.done(name)]
+    for name in self.stages:
+      if self.done(name):
+        LOGGER.info("[pipeline] %s already done, skipping." % name)
+
+    running = {}
+    failure = None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(pending), 1)) as pool:
+      while True:
+        if failure is None:
+          for name in list(pending):
+            function, after = self.stages[name]
+            if all(self.done(before) for before in after):
+              pending.remove(name)
+              self.start(name)
+              running[pool.submit(function, self.results())] = (name, time.perf_counter())
+
+        if not running:
+          break
+
+        finished, _ = concurrent.futures.wait(list(running), return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in finished:
+          name, started = running.pop(future)
+          seconds = time.perf_counter() - started
+          try:
+            result = future.result()
+          except BaseException as error:
+            self.finish(name, FAILED, seconds)
+            LOGGER.critical("[pipeline] %s failed." % name)
+            if failure is None:
+              failure = error
+          else:
+            self.finish(name, DONE, seconds, result)
+
+    if failure is None:
+      self.checkpoint['finished'] = now()
+      self.save()
+    self.log()
+
+    if failure is not None:
+      raise failure
+
+  def start(self, name):
+    LOGGER.info("[pipeline] Starting %s." % name)
+    self.checkpoint['stages'][name] = {'status': RUNNING, 'started': now(), 'seconds': None}
+    self.save()
+
+  def finish(self, name, status, seconds, result=None):
+    self.checkpoint['stages'][name].update(status=status, seconds=seconds, result=result)
+    self.save()
+
+  def save(self):
+    directory = os.path.dirname(self.path)
+    if directory and (not os.path.isdir(directory)):
+      os.makedirs(directory)
+    with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+      ujson.dump(self.checkpoint, f, indent=2)
+    os.replace(self.path + ".tmp", self.path)
+
+  def log(self):
+    LOGGER.info("[pipeline]")
+    for name in self.stages:
+      stage = self.checkpoint['stages'].get(name)
+      if stage is None:
+        LOGGER.info("%-20s %8s" % (name, "-"))
+      else:
+        seconds = "-" if stage['seconds'] is None else "%.1fs" % stage['seconds']
+        LOGGER.info("%-20s %8s %10s" % (name, stage['status'], seconds))
+
+
+def load_checkpoint(path):
+  try:
+    with open(path, encoding='utf-8') as f:
+      checkpoint = ujson.load(f)
+  except (OSError, ValueError):
+    return None
+  if checkpoint.get('version') != CHECKPOINT_VERSION:
+    return None
+  return checkpoint
+
+def now():
+  return datetime.datetime.now().isoformat()
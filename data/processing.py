@@ -20,9 +20,20 @@ import errno
 import logging
 import csv
 import json
+import pickle
+import sqlite3
+import gc
+import ujson
 import yaml
 import os
 import glob
+import math
+import hashlib
+import functools
+import operator
+import itertools
+import concurrent.futures
+import multiprocessing
 import slugify
 import datetime
 import subprocess
@@ -30,9 +41,16 @@ import subprocess
 # Import all the constants from data/env.py.
 from data.env import *
 from data import logger
+from data import metrics
 
 from statistics import mean
 
+# Optional: only needed for --engine=numpy.
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
 
 LOGGER = logger.get_logger(__name__)
 
@@ -88,8 +106,8 @@ CUSTOMER_SATISFACTION_URLS = {
 # Main task flow.
 
 from app import models
-from app.models import Report, Domain, Agency
-from app.data import LABELS
+from app.models import Order
+from app.data import LABELS, CSV_FIELDS
 
 
 # Read in data from domains.csv, and scan data from domain-scan.
@@ -103,53 +121,71 @@ def run(date, options):
   if date is None:
     date = datetime.datetime.strftime(datetime.datetime.now(), "%Y-%m-%d")
 
-  # Read in domains and agencies from domains.csv.
+  # Each stage's time, memory use and row counts are saved to
+  # PROCESSING_METRICS and logged at the end. --trace-memory adds what
+  # tracemalloc sees, at the cost of a much slower run.
+  stages = metrics.Stages(trace_memory=options.get("trace-memory", False))
+
+  # Read in domains and agencies from domains.csv, and domain-scan CSV data.
   # Returns dicts of values ready for saving as Domain and Agency objects.
   #
-  # Also returns gathered subdomains, which need more filtering to be useful.
-  domains, agencies, gathered_subdomains = load_domain_data()
+  # What's read is cached, and read from the cache next time if none of
+  # the CSVs have changed. --cache=false reads the CSVs regardless.
+  #
+  # --join=merge reads subdomains from the sorted gathered and scan CSVs
+  # side by side, using less memory (see merge_subdomain_scan_data()).
+  join = options.get("join", "hash")
+  if join not in ("hash", "merge"):
+    LOGGER.critical("--join must be one of hash, merge.")
+    exit(1)
 
-  # Read in domain-scan CSV data.
-  parent_scan_data = load_parent_scan_data(domains)
-  subdomains, subdomain_scan_data = load_subdomain_scan_data(domains, parent_scan_data, gathered_subdomains)
-
-  # Load in some manual exclusion data.
-  analytics_ineligible = yaml.safe_load(open(os.path.join(this_dir, "ineligible/analytics.yml")))
-  analytics_ineligible_map = {}
-  for domain in analytics_ineligible:
-    analytics_ineligible_map[domain] = True
-
-  # Capture manual exclusions and pull out some high-level data from pshtt.
-  for domain_name in parent_scan_data.keys():
-
-    # mark manual ineligiblity for analytics if present
-    analytics = parent_scan_data[domain_name].get('analytics', None)
-    if analytics:
-      ineligible = analytics_ineligible_map.get(domain_name, False)
-      domains[domain_name]['exclude']['analytics'] = ineligible
-
-    # Pull out a few pshtt.csv fields as general domain-level metadata.
-    pshtt = parent_scan_data[domain_name].get('pshtt', None)
-    if pshtt is None:
-      # generally means scan was on different domains.csv, but
-      # invalid domains can hit this.
-      LOGGER.warning("[%s] No pshtt data for domain!" % domain_name)
-
-      # Remove the domain from further consideration.
-      # Destructive, so have this done last.
-      del domains[domain_name]
-    else:
-      # LOGGER.info("[%s] Updating with pshtt metadata." % domain_name)
-      domains[domain_name]['live'] = boolean_for(pshtt['Live'])
-      domains[domain_name]['redirect'] = boolean_for(pshtt['Redirect'])
-      domains[domain_name]['canonical'] = pshtt['Canonical URL']
-
-  # Prepare subdomains the same way
-  for subdomain_name in subdomain_scan_data.keys():
-    pshtt = subdomain_scan_data[subdomain_name].get('pshtt')
-    subdomains[subdomain_name]['live'] = boolean_for(pshtt['Live'])
-    subdomains[subdomain_name]['redirect'] = boolean_for(pshtt['Redirect'])
-    subdomains[subdomain_name]['canonical'] = pshtt['Canonical URL']
+  with stages.stage("load") as stage:
+    domains, agencies, parent_scan_data, subdomains, subdomain_scan_data = load_data(
+      use_cache=(options.get("cache", True) is not False), join=join
+    )
+    stage['rows_out'] = len(domains) + len(subdomains)
+
+  with stages.stage("prepare", rows_in=(len(parent_scan_data) + len(subdomain_scan_data))) as stage:
+    # Load in some manual exclusion data.
+    analytics_ineligible = yaml.safe_load(open(os.path.join(this_dir, "ineligible/analytics.yml")))
+    analytics_ineligible_map = {}
+    for domain in analytics_ineligible:
+      analytics_ineligible_map[domain] = True
+
+    # Capture manual exclusions and pull out some high-level data from pshtt.
+    for domain_name in parent_scan_data.keys():
+
+      # mark manual ineligiblity for analytics if present
+      analytics = parent_scan_data[domain_name].get('analytics', None)
+      if analytics:
+        ineligible = analytics_ineligible_map.get(domain_name, False)
+        domains[domain_name]['exclude']['analytics'] = ineligible
+
+      # Pull out a few pshtt.csv fields as general domain-level metadata.
+      pshtt = parent_scan_data[domain_name].get('pshtt', None)
+      if pshtt is None:
+        # generally means scan was on different domains.csv, but
+        # invalid domains can hit this.
+        LOGGER.warning("[%s] No pshtt data for domain!" % domain_name)
+
+        # Remove the domain from further consideration.
+        # Destructive, so have this done last.
+        del domains[domain_name]
+      else:
+        # LOGGER.info("[%s] Updating with pshtt metadata." % domain_name)
+        domains[domain_name]['live'] = boolean_for(pshtt['Live'])
+        domains[domain_name]['redirect'] = boolean_for(pshtt['Redirect'])
+        domains[domain_name]['canonical'] = pshtt['Canonical URL']
+
+    # Prepare subdomains the same way
+    for subdomain_name in subdomain_scan_data.keys():
+      pshtt = subdomain_scan_data[subdomain_name].get('pshtt')
+      subdomains[subdomain_name]['live'] = boolean_for(pshtt['Live'])
+      subdomains[subdomain_name]['redirect'] = boolean_for(pshtt['Redirect'])
+      subdomains[subdomain_name]['canonical'] = pshtt['Canonical URL']
+
+    hosts = len(domains) + len(subdomains)
+    stage['rows_out'] = hosts
 
   # Save what we've got to the database so far.
 
@@ -162,40 +198,253 @@ def run(date, options):
 
   # Calculate high-level per-domain conclusions for each report.
   # Overwrites `domains` and `subdomains` in-place.
-  process_domains(domains, agencies, subdomains, parent_scan_data, subdomain_scan_data)
+  #
+  # --workers=N spreads this over N processes (default: 1, no pool).
+  try:
+    workers = int(options.get("workers", 1))
+  except ValueError:
+    LOGGER.critical("--workers must be a number.")
+    exit(1)
+
+  # --engine=scalar|numpy picks how HTTPS reports are worked out
+  # (default: numpy, if it's installed).
+  engine = options.get("engine", "scalar" if numpy is None else "numpy")
+  if engine not in ("scalar", "numpy"):
+    LOGGER.critical("--engine must be one of scalar, numpy.")
+    exit(1)
+  if (engine == "numpy") and (numpy is None):
+    LOGGER.critical("--engine=numpy needs numpy installed.")
+    exit(1)
 
-  # Reset the database.
-  LOGGER.info("Clearing the database.")
-  models.clear_database()
+  # --incremental reuses the last --incremental run's results for parent
+  # domains whose inputs haven't changed, and only processes the rest.
+  # (See "Incremental processing", below.)
+  incremental = options.get("incremental", False)
 
-  # Calculate agency-level summaries. Updates `agencies` in-place.
-  update_agency_totals(agencies, domains, subdomains)
+  # Which store(s) to write: tinydb (db.json), sqlite (db.sqlite) or both.
+  backend = options.get("backend", models.BACKEND)
+  if backend not in ("tinydb", "sqlite", "both"):
+    LOGGER.critical("--backend must be one of tinydb, sqlite, both.")
+    exit(1)
 
-  # Calculate government-wide summaries.
-  report = full_report(domains, subdomains)
-  report['report_date'] = date
+  with stages.stage("process", rows_in=hosts) as stage:
+    if incremental:
+      fingerprints = zone_fingerprints(domains, subdomains, parent_scan_data, subdomain_scan_data)
+      state = load_state(PROCESSING_STATE)
+      changed = restore_zones(domains, subdomains, state, fingerprints)
+    else:
+      changed = None
+
+    process_domains(domains, agencies, subdomains, parent_scan_data, subdomain_scan_data, workers=workers, engine=engine, names=changed)
+    stage['rows_out'] = hosts
+
+  # Calculate agency-level and government-wide summaries.
+  # Updates `agencies` in-place.
+  with stages.stage("totals", rows_in=hosts) as stage:
+    if incremental:
+      zones = {
+        domain_name: zone_results(domain_name, domains, subdomains, parent_scan_data, fingerprints, state)
+        for domain_name in domains.keys()
+      }
+      totals = update_totals_incrementally(agencies, zones, state)
+    else:
+      totals = update_totals(agencies, domains, subdomains)
 
-  LOGGER.info("Creating all domains.")
-  Domain.create_all(domains[domain_name] for domain_name in sorted_domains)
-  LOGGER.info("Creating all subdomains.")
-  Domain.create_all(subdomains[subdomain_name] for subdomain_name in sorted_subdomains)
-  LOGGER.info("Creating all agencies.")
-  Agency.create_all(agencies[agency_name] for agency_name in sorted_agencies)
+    report = dict(totals, report_date=date)
+    stage['rows_out'] = len(agencies) + 1
 
-  # Create top-level summaries.
-  LOGGER.info("Creating government-wide totals.")
-  Report.create(report)
+  # Work out the order each report's listings are served in, so the
+  # app never has to sort them.
+  with stages.stage("orders", rows_in=hosts) as stage:
+    all_domains = (
+      [domains[domain_name] for domain_name in sorted_domains] +
+      [subdomains[subdomain_name] for subdomain_name in sorted_subdomains]
+    )
+    orders = Order.compute(all_domains)
+    stage['rows_out'] = len(orders)
+
+  # Compare each host with how it was in the data being replaced, for
+  # lists of which hosts changed how since then.
+  with stages.stage("changes", rows_in=hosts) as stage:
+    since, previous = previous_generation(backend)
+    changes = compute_changes(previous, since, all_domains, date)
+    stage['rows_out'] = sum(len(change['rows']) for change in changes)
+
+  # domains and subdomains, agencies, the government-wide report, orders
+  # and changes
+  records = hosts + len(agencies) + 1 + len(orders) + len(changes)
+
+  if backend in ("tinydb", "both"):
+    with stages.stage("write tinydb", rows_in=records) as stage:
+      # Domains, then subdomains, agencies, the government-wide report
+      # and listing orders. db.json is replaced whole, so the web app
+      # never sees it half written.
+      LOGGER.info("Writing everything to db.json.")
+      models.tinydb_load(
+        all_domains,
+        [agencies[agency_name] for agency_name in sorted_agencies],
+        [report],
+        orders=orders,
+        changes=changes
+      )
+      stage['rows_out'] = records
+
+  if backend in ("sqlite", "both"):
+    with stages.stage("write sqlite", rows_in=records) as stage:
+      LOGGER.info("Loading everything into SQLite.")
+      models.sqlite_load(
+        all_domains,
+        [agencies[agency_name] for agency_name in sorted_agencies],
+        [report],
+        orders=orders,
+        changes=changes
+      )
+      stage['rows_out'] = records
+
+  # Add today's totals to the history, only once the new data has been
+  # written, so a run that fails part way never leaves a day in the
+  # history that the app has no data for. (If this fails instead, the
+  # data's there without its day in the history, until the next run
+  # adds it.) --history=false leaves the history alone, as when trying
+  # things out on old data.
+  if options.get("history", True) is not False:
+    with stages.stage("history", rows_in=(len(agencies) + 1)) as stage:
+      append_history(HISTORY_DATA, date, totals, agencies)
+      stage['rows_out'] = 1
+
+  # Keep what this run worked out, for the next --incremental run.
+  if incremental:
+    with stages.stage("save state", rows_in=len(zones)) as stage:
+      save_state(PROCESSING_STATE, zones, agencies, totals)
+      stage['rows_out'] = len(zones)
+
+  stages.save(PROCESSING_METRICS, date=date)
 
   # Print and exit
   print_report(report)
+  stages.log()
+
+
+### Parsed data cache.
+#
+# When the CSVs haven't changed since the last run, as with repeated
+# development and staging runs, parsing them again is wasted time. So
+# what load_data() makes of them is pickled to PARSED_CACHE, under a key
+# hashed from the contents of every CSV it reads and of the code that
+# reads them (this file and data/env.py). A later run that comes up with
+# the same key unpickles that instead of parsing anything.
+
+# Reads in domains.csv, gathered subdomains, and domain-scan CSV data,
+# from the cache if possible.
+#
+# `join` is how subdomains are matched up across gathered.csv and the
+# subdomain scans: "hash" reads gathered.csv into memory first, "merge"
+# reads them all side by side (see merge_subdomain_scan_data()), and
+# falls back to "hash" if they aren't sorted. The results are the same.
+def load_data(use_cache=True, join="hash"):
+  # domains.csv may need downloading first, so there's no key without it.
+  if use_cache and os.path.exists(PARENT_DOMAINS_CSV):
+    key = parsed_cache_key()
+    data = read_parsed_cache(key)
+    if data is not None:
+      return data
+
+  # Also returns gathered subdomains (unless they're to be merged in),
+  # which need more filtering to be useful.
+  domains, agencies, gathered_subdomains = load_domain_data(gathered=(join != "merge"))
+
+  parent_scan_data = load_parent_scan_data(domains)
+
+  if join == "merge":
+    try:
+      subdomains, subdomain_scan_data = merge_subdomain_scan_data(domains, parent_scan_data)
+    except UnsortedInput as error:
+      LOGGER.warning("%s Reading subdomains with --join=hash instead." % error)
+      for scan in parent_scan_data.values():
+        scan.pop('subdomains', None)
+      join = "hash"
+      gathered_subdomains = gathered_subdomain_map()
+
+  if join != "merge":
+    subdomains, subdomain_scan_data = load_subdomain_scan_data(domains, parent_scan_data, gathered_subdomains)
+
+  data = (domains, agencies, parent_scan_data, subdomains, subdomain_scan_data)
+
+  if use_cache:
+    write_parsed_cache(parsed_cache_key(), data)
+  return data
+
+# Every file that what load_data() makes depends on.
+def parsed_cache_inputs():
+  return [
+    PARENT_DOMAINS_CSV,
+    SUBDOMAIN_DOMAINS_CSV,
+    os.path.join(PARENT_RESULTS, "pshtt.csv"),
+    os.path.join(PARENT_RESULTS, "sslyze.csv"),
+    os.path.join(PARENT_RESULTS, "analytics.csv"),
+    os.path.join(SUBDOMAIN_DATA_SCANNED, "results", "pshtt.csv"),
+    os.path.join(SUBDOMAIN_DATA_SCANNED, "results", "sslyze.csv"),
+    os.path.abspath(__file__),
+    os.path.join(DATA_DIR, "env.py")
+  ]
+
+def parsed_cache_key():
+  digest = hashlib.sha1()
+  for path in parsed_cache_inputs():
+    digest.update(path.encode('utf-8'))
+    if not os.path.isfile(path):
+      digest.update(b"\0missing")
+      continue
+
+    with open(path, 'rb') as f:
+      for chunk in iter(lambda: f.read(1 << 20), b''):
+        digest.update(chunk)
+  return digest.hexdigest()
+
+def parsed_cache_path(key):
+  return os.path.join(PARSED_CACHE, "parsed-%s.pickle" % key)
+
+def read_parsed_cache(key):
+  # Everything unpickled lives on, so the garbage collector would only
+  # keep stopping to look it all over.
+  collecting = gc.isenabled()
+  gc.disable()
+  try:
+    with open(parsed_cache_path(key), 'rb') as f:
+      data = pickle.load(f)
+  except FileNotFoundError:
+    return None
+  except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) as error:
+    LOGGER.warning("Couldn't read parsed data cache, reading CSVs instead: %s" % error)
+    return None
+  finally:
+    if collecting:
+      gc.enable()
+
+  LOGGER.info("Read parsed CSV data from cache (%s)." % key[:12])
+  return data
+
+# Replaces whatever's in the cache with `data`.
+def write_parsed_cache(key, data):
+  mkdir_p(PARSED_CACHE)
+  path = parsed_cache_path(key)
+  with open(path + ".tmp", 'wb') as f:
+    pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+  os.replace(path + ".tmp", path)
+
+  for stale in glob.glob(os.path.join(PARSED_CACHE, "parsed-*.pickle")):
+    if stale != path:
+      os.remove(stale)
 
 
 # Reads in input CSVs (domain list).
-def load_domain_data():
+#
+# With gathered=False, gathered subdomains are left for
+# merge_subdomain_scan_data() to read, and None is returned for them.
+def load_domain_data(gathered=True):
 
   domain_map = {}
   agency_map = {}
-  gathered_subdomain_map = {}
 
   # if domains.csv wasn't cached, download it anew
 
@@ -272,25 +521,37 @@ def load_domain_data():
       else:
         agency_map[agency_slug]['total_domains'] += 1
 
+  if gathered:
+    gathered_subdomains = gathered_subdomain_map()
+  else:
+    gathered_subdomains = None
+
+  return domain_map, agency_map, gathered_subdomains
+
+# Gathered subdomains, and the sources each was gathered from.
+def gathered_subdomain_map():
+  gathered_subdomains = {}
+  for subdomain_name, row in gathered_rows():
+    if subdomain_name not in gathered_subdomains:
+      gathered_subdomains[subdomain_name] = gathered_sources(row)
+  return gathered_subdomains
+
+# Gathered subdomains, as (hostname, row), in gathered.csv's order.
+def gathered_rows():
   with open(SUBDOMAIN_DOMAINS_CSV, newline='') as csvfile:
     for row in csv.reader(csvfile):
       if row[0].lower() == "domain":
         continue
 
-      subdomain_name = row[0].lower().strip()
-      base_domain = row[1].lower().strip()
-
-      if subdomain_name not in gathered_subdomain_map:
-        # check each source
-        sources = []
-        for i, source in enumerate(GATHERER_NAMES):
-          if boolean_for(row[i+2]):
-            sources.append(source)
+      yield row[0].lower().strip(), row
 
-        gathered_subdomain_map[subdomain_name] = sources
-
-
-  return domain_map, agency_map, gathered_subdomain_map
+# The sources a gathered.csv row says a subdomain was gathered from.
+def gathered_sources(row):
+  sources = []
+  for i, source in enumerate(GATHERER_NAMES):
+    if boolean_for(row[i+2]):
+      sources.append(source)
+  return sources
 
 
 # Load in data from the CSVs produced by domain-scan.
@@ -301,48 +562,42 @@ def load_parent_scan_data(domains):
   for domain_name in domains.keys():
     parent_scan_data[domain_name] = {}
 
-  headers = []
-  with open(os.path.join(PARENT_RESULTS, "pshtt.csv"), newline='') as csvfile:
-    for dict_row in csv.DictReader(csvfile):
-      domain = dict_row['Domain'].lower()
-      if not domains.get(domain):
-        # LOGGER.info("[pshtt] Skipping %s, not a federal domain from domains.csv." % domain)
-        continue
+  for row in scan_rows(os.path.join(PARENT_RESULTS, "pshtt.csv"), PshttRow):
+    domain = row['Domain'].lower()
+    if not domains.get(domain):
+      # LOGGER.info("[pshtt] Skipping %s, not a federal domain from domains.csv." % domain)
+      continue
 
-      parent_scan_data[domain]['pshtt'] = dict_row
+    parent_scan_data[domain]['pshtt'] = row
 
-  headers = []
-  with open(os.path.join(PARENT_RESULTS, "sslyze.csv"), newline='') as csvfile:
-    for dict_row in csv.DictReader(csvfile):
-      domain = dict_row['Domain'].lower()
-      if not domains.get(domain):
-        # LOGGER.info("[sslyze] Skipping %s, not a federal domain from domains.csv." % domain)
-        continue
+  for row in scan_rows(os.path.join(PARENT_RESULTS, "sslyze.csv"), SslyzeRow):
+    domain = row['Domain'].lower()
+    if not domains.get(domain):
+      # LOGGER.info("[sslyze] Skipping %s, not a federal domain from domains.csv." % domain)
+      continue
 
-      # If the scan was invalid, most fields will be empty strings.
-      # It'd be nice to make this more semantic on the domain-scan side.
-      if dict_row["SSLv2"] == "":
-        # LOGGER.info("[%s] Skipping, scan data was invalid." % subdomain)
-        continue
+    # If the scan was invalid, most fields will be empty strings.
+    # It'd be nice to make this more semantic on the domain-scan side.
+    if row["SSLv2"] == "":
+      # LOGGER.info("[%s] Skipping, scan data was invalid." % subdomain)
+      continue
 
-      parent_scan_data[domain]['sslyze'] = dict_row
+    parent_scan_data[domain]['sslyze'] = row
 
   # Now, analytics measurement.
   if os.path.isfile(os.path.join(PARENT_RESULTS, "analytics.csv")):
-    headers = []
-    with open(os.path.join(PARENT_RESULTS, "analytics.csv"), newline='') as csvfile:
-      for dict_row in csv.DictReader(csvfile):
-        domain = dict_row['Domain'].lower()
-        if not domains.get(domain):
-        # LOGGER.info("[analytics] Skipping %s, not a federal domain from domains.csv." % domain)
-          continue
+    for row in scan_rows(os.path.join(PARENT_RESULTS, "analytics.csv"), AnalyticsRow):
+      domain = row['Domain'].lower()
+      if not domains.get(domain):
+      # LOGGER.info("[analytics] Skipping %s, not a federal domain from domains.csv." % domain)
+        continue
 
-        # If it didn't appear in the pshtt data, skip it, we need this.
-        # if not domains[domain].get('pshtt'):
-        #   LOGGER.info("[analytics] Skipping %s, did not appear in pshtt.csv." % domain)
-        #   continue
+      # If it didn't appear in the pshtt data, skip it, we need this.
+      # if not domains[domain].get('pshtt'):
+      #   LOGGER.info("[analytics] Skipping %s, did not appear in pshtt.csv." % domain)
+      #   continue
 
-        parent_scan_data[domain]['analytics'] = dict_row
+      parent_scan_data[domain]['analytics'] = row
 
   # And a11y! Only try to load it if it exists, since scan is not yet automated.
   # if os.path.isfile(os.path.join(PARENT_RESULTS, "a11y.csv")):
@@ -399,275 +654,590 @@ def load_subdomain_scan_data(domains, parent_scan_data, gathered_subdomains):
   # for sslyze, pshtt is the data backbone for subdomains.
   pshtt_subdomains_csv = os.path.join(SUBDOMAIN_DATA_SCANNED, "results", "pshtt.csv")
 
-  headers = []
-  with open(pshtt_subdomains_csv, newline='') as csvfile:
-    for dict_row in csv.DictReader(csvfile):
-      subdomain = dict_row['Domain'].lower()
-      parent_domain = dict_row['Base Domain'].lower()
+  for row in scan_rows(pshtt_subdomains_csv, PshttRow):
+    subdomain = row['Domain'].lower()
 
-      if subdomain not in gathered_subdomains:
-        # LOGGER.info("[%s] Skipping, not a gathered subdomain." % subdomain)
-        continue
+    if subdomain not in gathered_subdomains:
+      # LOGGER.info("[%s] Skipping, not a gathered subdomain." % subdomain)
+      continue
 
-      if not domains.get(parent_domain):
-        # LOGGER.info("[%s] Skipping, not a subdomain of a tracked domain." % (subdomain))
-        continue
+    add_subdomain_pshtt(row, gathered_subdomains[subdomain], domains, parent_scan_data, subdomains, subdomain_scan_data)
 
-      if domains[parent_domain]['branch'] != 'executive':
-        # LOGGER.info("[%s] Skipping, not displaying data on subdomains of legislative or judicial domains." % (subdomain))
-        continue
+  # Load in sslyze subdomain data.
+  # Note: if we ever add more subdomain scanners, this loop
+  # could be genericized and iterated over really easily.
+  sslyze_subdomains_csv = os.path.join(SUBDOMAIN_DATA_SCANNED, "results", "sslyze.csv")
 
-      # Optimization: only bother storing in memory if Live is True.
-      if boolean_for(dict_row['Live']):
+  for row in scan_rows(sslyze_subdomains_csv, SslyzeRow):
+    add_subdomain_sslyze(row, subdomain_scan_data)
 
-        # Initialize subdomains obj if this is its first one.
-        parent_scan_data[parent_domain].setdefault('subdomains', []).append(subdomain)
 
-        # if there are dupes for some reason, they'll be overwritten
-        subdomain_scan_data[subdomain] = {'pshtt': dict_row}
+  return subdomains, subdomain_scan_data
 
-        subdomains[subdomain] = {
-          'domain': subdomain,
-          'base_domain': parent_domain,
-          'agency_slug': domains[parent_domain]['agency_slug'],
-          'agency_name': domains[parent_domain]['agency_name'],
-          'branch': domains[parent_domain]['branch'],
-          'is_parent': False,
-          'sources': gathered_subdomains[subdomain]
-        }
+# Keeps a gathered subdomain's pshtt row, if it's live and under a
+# tracked executive branch domain.
+def add_subdomain_pshtt(row, sources, domains, parent_scan_data, subdomains, subdomain_scan_data):
+  subdomain = row['Domain'].lower()
+  parent_domain = row['Base Domain'].lower()
+
+  if not domains.get(parent_domain):
+    # LOGGER.info("[%s] Skipping, not a subdomain of a tracked domain." % (subdomain))
+    return
+
+  if domains[parent_domain]['branch'] != 'executive':
+    # LOGGER.info("[%s] Skipping, not displaying data on subdomains of legislative or judicial domains." % (subdomain))
+    return
+
+  # Optimization: only bother storing in memory if Live is True.
+  if boolean_for(row['Live']):
+
+    # Initialize subdomains obj if this is its first one.
+    parent_scan_data[parent_domain].setdefault('subdomains', []).append(subdomain)
+
+    # if there are dupes for some reason, they'll be overwritten
+    subdomain_scan_data[subdomain] = {'pshtt': row}
+
+    subdomains[subdomain] = {
+      'domain': subdomain,
+      'base_domain': parent_domain,
+      'agency_slug': domains[parent_domain]['agency_slug'],
+      'agency_name': domains[parent_domain]['agency_name'],
+      'branch': domains[parent_domain]['branch'],
+      'is_parent': False,
+      'sources': sources
+    }
 
-  # Load in sslyze subdomain data.
-  # Note: if we ever add more subdomain scanners, this loop
-  # could be genericized and iterated over really easily.
+# Adds a subdomain's sslyze row to its kept pshtt data, if it's valid.
+def add_subdomain_sslyze(row, subdomain_scan_data):
+  subdomain = row['Domain'].lower()
+
+  if not subdomain_scan_data.get(subdomain):
+    # LOGGER.info("[%s] Skipping, we didn't save pshtt data for this." % (subdomain))
+    return
+
+  # If the scan was invalid, most fields will be empty strings.
+  # It'd be nice to make this more semantic on the domain-scan side.
+  if row["SSLv2"] == "":
+    # LOGGER.info("[%s] Skipping, scan data was invalid." % subdomain)
+    return
+
+  # if there are dupes for some reason, they'll be overwritten
+  subdomain_scan_data[subdomain]['sslyze'] = row
+
+
+# The same as load_subdomain_scan_data(), for when gathered.csv and the
+# subdomain pshtt.csv and sslyze.csv are sorted by hostname, as
+# domain-gather and domain-scan write them with --sort.
+#
+# The three are read side by side, one hostname at a time, rather than
+# reading all of gathered.csv into memory first. So memory only grows
+# with the subdomains that are kept, and not with everything gathered.
+#
+# Raises UnsortedInput if any of them turns out not to be sorted, after
+# which `parent_scan_data` needs its 'subdomains' taking back out.
+def merge_subdomain_scan_data(domains, parent_scan_data):
+  subdomain_scan_data = {}
+  subdomains = {}
+
+  pshtt_subdomains_csv = os.path.join(SUBDOMAIN_DATA_SCANNED, "results", "pshtt.csv")
   sslyze_subdomains_csv = os.path.join(SUBDOMAIN_DATA_SCANNED, "results", "sslyze.csv")
 
-  headers = []
-  with open(sslyze_subdomains_csv, newline='') as csvfile:
-    for dict_row in csv.DictReader(csvfile):
-      subdomain = dict_row['Domain'].lower()
+  gathered = sorted_groups(gathered_rows(), SUBDOMAIN_DOMAINS_CSV)
+  sslyze = sorted_groups(
+    ((row['Domain'].lower(), row) for row in scan_rows(sslyze_subdomains_csv, SslyzeRow)),
+    sslyze_subdomains_csv
+  )
+  pshtt = sorted_groups(
+    ((row['Domain'].lower(), row) for row in scan_rows(pshtt_subdomains_csv, PshttRow)),
+    pshtt_subdomains_csv
+  )
 
-      if not subdomain_scan_data.get(subdomain):
-        # LOGGER.info("[%s] Skipping, we didn't save pshtt data for this." % (subdomain))
-        continue
+  gathered_group = next(gathered, None)
+  sslyze_group = next(sslyze, None)
 
-      # If the scan was invalid, most fields will be empty strings.
-      # It'd be nice to make this more semantic on the domain-scan side.
-      if dict_row["SSLv2"] == "":
-        # LOGGER.info("[%s] Skipping, scan data was invalid." % subdomain)
-        continue
+  for subdomain, rows in pshtt:
+    gathered_group = seek_group(gathered, gathered_group, subdomain)
+    if (gathered_group is None) or (gathered_group[0] != subdomain):
+      # LOGGER.info("[%s] Skipping, not a gathered subdomain." % subdomain)
+      continue
+
+    # the first gathered.csv row for a subdomain is the one that counts
+    sources = gathered_sources(gathered_group[1][0])
+    for row in rows:
+      add_subdomain_pshtt(row, sources, domains, parent_scan_data, subdomains, subdomain_scan_data)
 
-      # if there are dupes for some reason, they'll be overwritten
-      subdomain_scan_data[subdomain]['sslyze'] = dict_row
+    sslyze_group = seek_group(sslyze, sslyze_group, subdomain)
+    if (sslyze_group is not None) and (sslyze_group[0] == subdomain):
+      for row in sslyze_group[1]:
+        add_subdomain_sslyze(row, subdomain_scan_data)
 
+  # Read to the end, to check the rest are in order too.
+  for group in itertools.chain(gathered, sslyze):
+    pass
 
   return subdomains, subdomain_scan_data
 
+class UnsortedInput(Exception):
+  pass
+
+# Groups (key, row) pairs that are sorted by key into (key, [rows]).
+# Raises UnsortedInput, naming `path`, if they aren't sorted.
+def sorted_groups(pairs, path):
+  last, group = None, []
+  for key, row in pairs:
+    if (last is not None) and (key < last):
+      raise UnsortedInput("%s isn't sorted by hostname (%s comes after %s)." % (path, key, last))
+
+    if (key != last) and group:
+      yield last, group
+      group = []
+    last = key
+    group.append(row)
+
+  if group:
+    yield last, group
+
+# Moves along sorted_groups() to the first group at or past `key`.
+def seek_group(groups, group, key):
+  while (group is not None) and (group[0] < key):
+    group = next(groups, None)
+  return group
+
 # Given the domain data loaded in from CSVs, draw conclusions,
 # and filter/transform data into form needed for display.
-def process_domains(domains, agencies, subdomains, parent_scan_data, subdomain_scan_data):
+#
+# With workers > 1, parent domains (with their subdomains) are split into
+# shards and evaluated in that many processes. Each parent domain's work
+# only reads its own scan data, so the results are merged back in the
+# order the serial loop makes them, and come out exactly the same.
+#
+# `engine` picks how HTTPS reports are worked out: "scalar" (one host at
+# a time, with https_behavior_for) or "numpy" (see HttpsBatch). They give
+# the same results.
+#
+# `names`, if given, limits processing to those parent domains.
+def process_domains(domains, agencies, subdomains, parent_scan_data, subdomain_scan_data, workers=1, engine="scalar", names=None):
+  if names is None:
+    names = list(domains.keys())
+
+  if workers <= 1:
+    works = (
+      (domain_name, domains[domain_name], parent_scan_data[domain_name], subdomains, subdomain_scan_data)
+      for domain_name in names
+    )
+    for result in process_works(works, engine):
+      merge_domain_results(domains, subdomains, result)
+    return
+
+  # Several shards per worker, to even out the load.
+  domain_names = names
+  shard_size = max(1, math.ceil(len(domain_names) / (workers * 4)))
+  shards = [
+    domain_names[i:i + shard_size]
+    for i in range(0, len(domain_names), shard_size)
+  ]
+
+  # Forked workers inherit the data from this process, so they only need
+  # sending the names of the domains in each shard. Otherwise, each shard
+  # has to carry its own copy of the data.
+  global _shared_data
+  if multiprocessing.get_start_method() == 'fork':
+    _shared_data = (domains, subdomains, parent_scan_data, subdomain_scan_data)
+  else:
+    shards = [
+      [domain_work(name, domains, subdomains, parent_scan_data, subdomain_scan_data) for name in shard]
+      for shard in shards
+    ]
 
-  # For each domain, determine eligibility and, if eligible,
-  # use the scan data to draw conclusions.
-  for domain_name in domains.keys():
+  LOGGER.info("Processing %i domains in %i shards across %i workers." % (len(domain_names), len(shards), workers))
+  try:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+      for results in executor.map(functools.partial(process_shard, engine=engine), shards):
+        for result in results:
+          merge_domain_results(domains, subdomains, result)
+  finally:
+    _shared_data = None
+
+# The data a forked worker reads its shards from. See process_domains().
+_shared_data = None
+
+# The arguments to process_domain() for one parent domain: just its own
+# records and scan data, and those of its subdomains.
+def domain_work(domain_name, domains, subdomains, parent_scan_data, subdomain_scan_data):
+  subdomain_names = parent_scan_data[domain_name].get('subdomains', [])
+  return (
+    domain_name, domains[domain_name], parent_scan_data[domain_name],
+    {name: subdomains[name] for name in subdomain_names},
+    {name: subdomain_scan_data[name] for name in subdomain_names}
+  )
 
-    ### HTTPS
-    #
-    # For HTTPS, we calculate individual reports for every subdomain.
+# Run in a worker process: evaluates a shard of parent domains, given
+# either as names (to look up in _shared_data) or as domain_work().
+def process_shard(shard, engine="scalar"):
+  works = []
+  for work in shard:
+    if isinstance(work, str):
+      domains, subdomains, parent_scan_data, subdomain_scan_data = _shared_data
+      work = (work, domains[work], parent_scan_data[work], subdomains, subdomain_scan_data)
+    works.append(work)
+  return list(process_works(works, engine))
+
+# Evaluates process_domain() arguments, in order. With the numpy engine,
+# the HTTPS reports and totals for all of their hosts are worked out in
+# one batch first.
+def process_works(works, engine="scalar"):
+  if engine != "numpy":
+    return (process_domain(*work) for work in works)
+
+  works = list(works)
+  groups = [https_hosts(*work) for work in works]
+  batch = HttpsBatch(
+    [host for group in groups for host in group],
+    [i for i, group in enumerate(groups) for host in group],
+    len(groups)
+  )
+  reports = batch.reports()
+  totals = zip(batch.total_https(), batch.total_crypto())
+
+  results = []
+  start = 0
+  for work, group, group_totals in zip(works, groups, totals):
+    end = start + len(group)
+    results.append(process_domain(*work, reports=reports[start:end], totals=group_totals))
+    start = end
+  return results
+
+# Applies the results of process_domain() to the domain records.
+def merge_domain_results(domains, subdomains, results):
+  domain_name, domain_updates, subdomain_updates = results
+  for subdomain_name, https in subdomain_updates:
+    subdomains[subdomain_name]['https'] = https
+  domains[domain_name].update(domain_updates)
+
+# The hosts under a parent domain that get an HTTPS report, as arguments
+# for https_behavior_for(): each eligible subdomain, then the parent
+# domain itself, if it's eligible.
+def https_hosts(domain_name, domain, parent_scan, subdomains, subdomain_scan_data):
+  hosts = []
+
+  parent_preloaded = preloaded_or_not(parent_scan['pshtt'])
+  for subdomain_name in parent_scan.get('subdomains', []):
+    if eligible_for_https(subdomains[subdomain_name]):
+      hosts.append((
+        subdomain_name,
+        subdomain_scan_data[subdomain_name]['pshtt'],
+        subdomain_scan_data[subdomain_name].get('sslyze', None),
+        parent_preloaded
+      ))
+
+  if eligible_for_https(domain):
+    hosts.append((
+      domain_name,
+      parent_scan['pshtt'],
+      parent_scan.get('sslyze', None),
+      None
+    ))
+
+  return hosts
+
+# Evaluates one parent domain and its subdomains. Reads, but doesn't
+# change, the records it's given, and returns:
+#
+# * the parent domain's name
+# * fields to set on the parent domain (https, totals, and analytics if
+#   eligible), in the order they're set
+# * (subdomain name, https report) for each eligible subdomain
+#
+# `reports` are the HTTPS reports for https_hosts(), in order, and
+# `totals`, if given, are the domain's already-totalled (https, crypto)
+# reports. Both are worked out here if not given.
+def process_domain(domain_name, domain, parent_scan, subdomains, subdomain_scan_data, reports=None, totals=None):
+
+  if reports is None:
+    reports = [
+      https_behavior_for(*host)
+      for host in https_hosts(domain_name, domain, parent_scan, subdomains, subdomain_scan_data)
+    ]
+
+  ### HTTPS
+  #
+  # For HTTPS, we calculate individual reports for every subdomain.
 
-    https_parent = {
-      'eligible': False, # domain eligible itself (is it live?)
-      'eligible_zone': False, # zone eligible (itself or any live subdomains?)
-    }
-    eligible_children = []
-    eligible_zone = False
+  https_parent = {
+    'eligible': False, # domain eligible itself (is it live?)
+    'eligible_zone': False, # zone eligible (itself or any live subdomains?)
+  }
 
-    # No matter what, put the preloaded state onto the parent,
-    # since even an unused domain can always be preloaded.
-    https_parent['preloaded'] = preloaded_or_not(
-      parent_scan_data[domain_name]['pshtt']
-    )
+  # No matter what, put the preloaded state onto the parent,
+  # since even an unused domain can always be preloaded.
+  https_parent['preloaded'] = preloaded_or_not(
+    parent_scan['pshtt']
+  )
 
-    # Tally subdomains first, so we know if the parent zone is
-    # definitely eligible as a zone even if not as a website
-    for subdomain_name in parent_scan_data[domain_name].get('subdomains', []):
-
-      if eligible_for_https(subdomains[subdomain_name]):
-        eligible_children.append(subdomain_name)
-        subdomains[subdomain_name]['https'] = https_behavior_for(
-          subdomain_name,
-          subdomain_scan_data[subdomain_name]['pshtt'],
-          subdomain_scan_data[subdomain_name].get('sslyze', None),
-          parent_preloaded=https_parent['preloaded']
-        )
-
-    # ** syntax merges dicts, available in 3.5+
-    if eligible_for_https(domains[domain_name]):
-      https_parent = {**https_parent, **https_behavior_for(
-        domain_name,
-        parent_scan_data[domain_name]['pshtt'],
-        parent_scan_data[domain_name].get('sslyze', None)
-      )}
-      https_parent['eligible_zone'] = True
+  # Subdomains come first, so we know if the parent zone is
+  # definitely eligible as a zone even if not as a website
+  if eligible_for_https(domain):
+    children_reports = reports[:-1]
+  else:
+    children_reports = reports
 
-    # even if not eligible directly, can be eligible via subdomains
-    elif len(eligible_children) > 0:
-        https_parent['eligible_zone'] = True
+  # ** syntax merges dicts, available in 3.5+
+  if eligible_for_https(domain):
+    https_parent = {**https_parent, **reports[-1]}
+    https_parent['eligible_zone'] = True
 
-    # If the parent zone is preloaded, make sure that each subdomain
-    # is considered to have HSTS in place. If HSTS is yes on its own,
-    # leave it, but if not, then grant it the minimum level.
-    # TODO:
+  # even if not eligible directly, can be eligible via subdomains
+  elif len(children_reports) > 0:
+      https_parent['eligible_zone'] = True
 
-    domains[domain_name]['https'] = https_parent
+  # If the parent zone is preloaded, make sure that each subdomain
+  # is considered to have HSTS in place. If HSTS is yes on its own,
+  # leave it, but if not, then grant it the minimum level.
+  # TODO:
 
-    # Totals based on summing up eligible reports within this domain.
-    totals = {}
+  updates = {'https': https_parent}
 
+  # Totals based on summing up eligible reports within this domain.
+  if totals is None:
     # For HTTPS/HSTS, pshtt-eligible parent + subdomains.
-    eligible_reports = [subdomains[name]['https'] for name in eligible_children]
+    eligible_reports = list(children_reports)
     if https_parent['eligible']:
       eligible_reports = [https_parent] + eligible_reports
-    totals['https'] = total_https_report(eligible_reports)
+    https_totals = total_https_report(eligible_reports)
 
     # For SSLv2/SSLv3/RC4/3DES, sslyze-eligible parent + subdomains.
-    subdomain_names = parent_scan_data[domain_name].get('subdomains', [])
-    eligible_reports = [subdomains[name]['https'] for name in subdomain_names if subdomains[name].get('https') and subdomains[name]['https'].get('rc4') is not None]
+    eligible_reports = [report for report in children_reports if report.get('rc4') is not None]
     if https_parent and https_parent.get('rc4') is not None:
       eligible_reports = [https_parent] + eligible_reports
-    totals['crypto'] = total_crypto_report(eligible_reports)
+    crypto_totals = total_crypto_report(eligible_reports)
 
-    domains[domain_name]['totals'] = totals
+    totals = (https_totals, crypto_totals)
 
-    ### Everything else
-    #
-    # For other reports, we still focus only on parent domains.
-    if eligible_for_analytics(domains[domain_name]):
-      domains[domain_name]['analytics'] = analytics_report_for(
-        domain_name, domains[domain_name], parent_scan_data
-      )
+  updates['totals'] = {
+    'https': totals[0],
+    'crypto': totals[1]
+  }
 
-    # if eligible_for_a11y(domains[domain_name]):
-    #   domains[domain_name]['a11y'] = a11y_report_for(
-    #     domain_name, domains[domain_name], parent_scan_data
-    #   )
+  ### Everything else
+  #
+  # For other reports, we still focus only on parent domains.
+  if eligible_for_analytics(domain):
+    updates['analytics'] = analytics_report_for(
+      domain_name, domain, {domain_name: parent_scan}
+    )
 
-    # if eligible_for_cust_sat(domains[domain_name]):
-    #   domains[domain_name]['cust_sat'] = cust_sat_report_for(
-    #     domain_name, domains[domain_name], parent_scan_data
-    #   )
+  # if eligible_for_a11y(domain):
+  #   updates['a11y'] = a11y_report_for(
+  #     domain_name, domain, {domain_name: parent_scan}
+  #   )
 
-# Given a list of domains or subdomains, quick filter to which
-# are eligible for this report, optionally for an agency.
-def eligible_for(report, hosts, agency=None):
-  return [host[report] for hostname, host in hosts.items() if (host.get(report) and host[report]['eligible'] and ((agency is None) or (host['agency_slug'] == agency['slug'])))]
+  # if eligible_for_cust_sat(domain):
+  #   updates['cust_sat'] = cust_sat_report_for(
+  #     domain_name, domain, {domain_name: parent_scan}
+  #   )
+
+  subdomain_updates = [(report['hostname'], report) for report in children_reports]
+  return domain_name, updates, subdomain_updates
+
+### Incremental processing.
+#
+# With --incremental, each run saves what it worked out for each parent
+# domain's zone (the parent domain and its subdomains) to
+# PROCESSING_STATE, along with a fingerprint of its hosts' inputs: their
+# domain records and scan rows. The next --incremental run only processes
+# zones that are new or where any host's inputs have changed, and reuses
+# the saved results for the rest. Agency and government-wide totals are
+# brought up to date from the saved ones, by taking out what changed and
+# removed zones counted before and adding what they count now.
+#
+# The saved state is ignored, and everything processed, if it's missing
+# or from another STATE_VERSION. Bump STATE_VERSION whenever a change to
+# processing would change the results for the same inputs.
+
+STATE_VERSION = 1
+
+# A fingerprint for each parent domain's zone: of the domain records and
+# scan rows of the parent domain and each of its subdomains.
+def zone_fingerprints(domains, subdomains, parent_scan_data, subdomain_scan_data):
+  zones = {}
+  for domain_name, domain in domains.items():
+    parent_scan = parent_scan_data[domain_name]
+    hosts = [(domain, parent_scan)] + [
+      (subdomains[subdomain_name], subdomain_scan_data[subdomain_name])
+      for subdomain_name in parent_scan.get('subdomains', [])
+    ]
+    zones[domain_name] = hashlib.sha1(ujson.dumps(hosts).encode('utf-8')).hexdigest()
+  return zones
+
+def load_state(path):
+  try:
+    with open(path, encoding='utf-8') as f:
+      state = ujson.load(f)
+  except (OSError, ValueError):
+    state = None
 
-# Go through each report type and add agency totals for each type.
-def update_agency_totals(agencies, domains, subdomains):
+  if (state is None) or (state.get('version') != STATE_VERSION):
+    LOGGER.info("No usable state from an earlier run, processing everything.")
+    return None
+  return state
+
+def save_state(path, zones, agencies, totals):
+  state = {
+    'version': STATE_VERSION,
+    'zones': zones,
+    'totals': totals,
+    'agencies': {
+      agency_slug: {name: agency[name] for name in totals.keys()}
+      for agency_slug, agency in agencies.items()
+    }
+  }
 
-  # For each agency, update their report counts for every domain they have.
-  for agency_slug in agencies.keys():
-    agency = agencies[agency_slug]
+  mkdir_p(os.path.dirname(path))
+  with open(path + ".tmp", 'w', encoding='utf-8') as f:
+    ujson.dump(state, f)
+  os.replace(path + ".tmp", path)
 
-    # HTTPS. Parent and subdomains.
-    # LOGGER.info("[%s][%s] Totalling report." % (agency['slug'], 'https'))
-    eligible = eligible_for('https', domains, agency) + eligible_for('https', subdomains, agency)
-    agency['https'] = total_https_report(eligible)
+# Applies the saved results of each zone whose fingerprint hasn't changed,
+# and returns the names of the parent domains that still need processing.
+def restore_zones(domains, subdomains, state, fingerprints):
+  saved = state['zones'] if state else {}
 
-    # Separate report for crypto, for sslyze-scanned domains.
-    # LOGGER.info("[%s][%s] Totalling report." % (agency['slug'], 'crypto'))
-    eligible = [domain['https'] for name, domain in domains.items() if (domain['agency_slug'] == agency['slug']) and domain.get('https') and (domain['https'].get('rc4') is not None)]
-    eligible = eligible + [subdomain['https'] for name, subdomain in subdomains.items() if (subdomain['agency_slug'] == agency['slug']) and subdomain.get('https') and (subdomain['https'].get('rc4') is not None)]
-    agency['crypto'] = total_crypto_report(eligible)
+  changed = []
+  for domain_name in domains.keys():
+    zone = saved.get(domain_name)
+    if (zone is not None) and (zone['fingerprint'] == fingerprints[domain_name]):
+      merge_domain_results(domains, subdomains, (domain_name, zone['updates'], zone['subdomains']))
+    else:
+      changed.append(domain_name)
 
-    # Special separate report for preloaded parent domains.
-    # All parent domains, whether they use HTTP or not, are eligible.
-    # LOGGER.info("[%s][%s] Totalling report." % (agency['slug'], 'preloading'))
-    eligible = [host['https'] for hostname, host in domains.items() if host['agency_slug'] == agency_slug]
-    agency['preloading'] = total_preloading_report(eligible)
+  LOGGER.info("%i of %i parent domains have changed." % (len(changed), len(domains)))
+  return changed
 
+# What processing worked out for a zone, to save: the saved results if
+# the zone was restored from them, or the ones just made.
+def zone_results(domain_name, domains, subdomains, parent_scan_data, fingerprints, state):
+  zone = (state['zones'] if state else {}).get(domain_name)
+  if (zone is not None) and (zone['fingerprint'] == fingerprints[domain_name]):
+    return zone
 
-    # Analytics. Parent domains.
-    # LOGGER.info("[%s][%s] Totalling report." % (agency['slug'], 'analytics'))
-    eligible = eligible_for('analytics', domains, agency)
-    totals = {
-      'eligible': len(eligible),
-      'participating': 0
-    }
-    for report in eligible:
-      if report['participating'] == True:
-        totals['participating'] += 1
-    agency['analytics'] = totals
-
-
-    # Accessibility. Parent domains.
-    # LOGGER.info("[%s][%s] Totalling report." % (agency['slug'], 'a11y'))
-    # eligible = eligible_for('a11y', domains, agency)
-    # pages_count = len(eligible)
-    # errors = {e:0 for e in A11Y_ERRORS.values()}
-    # for a11y in eligible:
-    #   for error in a11y['errorlist']:
-    #     errors[error] += a11y['errorlist'][error]
-    # total_errors = sum(errors.values())
-    # avg_errors_per_page = (
-    #   'n/a' if pages_count == 0 else round(float(total_errors) / pages_count, 2)
-    # )
-    # totals = {
-    #   'eligible': pages_count,
-    #   'pages_count': pages_count,
-    #   'Average Errors per Page': avg_errors_per_page
-    # }
-    # if pages_count:
-    #   averages = ({
-    #     e: round(mean([report['errorlist'][e] for report in eligible]), 2)
-    #     for e in A11Y_ERRORS.values()
-    #   })
-    # else:
-    #   averages = {e: 'n/a' for e in A11Y_ERRORS.values()}
-    # totals.update(averages)
-    # agency['a11y'] = totals
-
-
-    # Customer satisfaction. Parent domains.
-    # LOGGER.info("[%s][%s] Totalling report." % (agency['slug'], 'cust_sat'))
-    # eligible = eligible_for('cust_sat', domains, agency)
-    # agency['cust_sat'] = {
-    #   'eligible': len(eligible),
-    #   'participating': len([report for report in eligible if report['participating']])
-    # }
-
-# Create a Report about each tracked stat.
-def full_report(domains, subdomains):
-
-  full = {}
-
-  # HTTPS. Parent and subdomains.
-  LOGGER.info("[https] Totalling full report.")
-  eligible = eligible_for('https', domains) + eligible_for('https', subdomains)
-  full['https'] = total_https_report(eligible)
-
-  LOGGER.info("[crypto] Totalling full report.")
-  eligible = [domain['https'] for name, domain in domains.items() if domain.get('https') and (domain['https'].get('rc4') is not None)]
-  eligible = eligible + [subdomain['https'] for name, subdomain in subdomains.items() if subdomain.get('https') and (subdomain['https'].get('rc4') is not None)]
-  full['crypto'] = total_crypto_report(eligible)
-
-  # Special separate report for preloaded parent domains.
-  # All parent domains, whether they use HTTP or not, are eligible.
-  LOGGER.info("[preloading] Totalling full report.")
-  eligible = [host['https'] for hostname, host in domains.items()]
-  full['preloading'] = total_preloading_report(eligible)
-
-  # Analytics. Parent domains only.
-  LOGGER.info("[analytics] Totalling full report.")
-  eligible = eligible_for('analytics', domains)
-  participating = 0
-  for report in eligible:
-    if report['participating'] == True:
-      participating += 1
-  full['analytics'] = {
-    'eligible': len(eligible),
-    'participating': participating
+  domain = domains[domain_name]
+  subdomain_names = dict.fromkeys(parent_scan_data[domain_name].get('subdomains', []))
+  return {
+    'fingerprint': fingerprints[domain_name],
+    'agency_slug': domain['agency_slug'],
+    'updates': {
+      field: domain[field] for field in ('https', 'totals', 'analytics')
+      if field in domain
+    },
+    'subdomains': [
+      (subdomain_name, subdomains[subdomain_name]['https'])
+      for subdomain_name in subdomain_names
+      if 'https' in subdomains[subdomain_name]
+    ]
   }
 
+# Hosts in a saved zone, as update_totals() counts them: (host, parent).
+def zone_hosts(zone):
+  yield {
+    'agency_slug': zone['agency_slug'],
+    'https': zone['updates']['https'],
+    'analytics': zone['updates'].get('analytics')
+  }, True
+  for subdomain_name, https in zone['subdomains']:
+    yield {'agency_slug': zone['agency_slug'], 'https': https}, False
+
+# The same as update_totals(), starting from the totals saved in `state`,
+# and only counting the zones that differ from the saved ones.
+def update_totals_incrementally(agencies, zones, state):
+  saved = state['zones'] if state else {}
+  full = Totals.restore(state['totals'] if state else None)
+  agency_totals = {
+    agency_slug: Totals.restore(state['agencies'].get(agency_slug) if state else None)
+    for agency_slug in agencies.keys()
+  }
+
+  def count(zone, step):
+    for host, parent in zone_hosts(zone):
+      full.add_host(host, parent, step)
+
+      totals = agency_totals.get(host['agency_slug'])
+      if totals is not None:
+        totals.add_host(host, parent, step)
+
+  LOGGER.info("Totalling agency and government-wide reports, for changed domains.")
+  for domain_name, zone in saved.items():
+    if zones.get(domain_name) is not zone:
+      count(zone, -1)
+  for domain_name, zone in zones.items():
+    if saved.get(domain_name) is not zone:
+      count(zone, 1)
+
+  for agency_slug, agency in agencies.items():
+    agency.update(agency_totals[agency_slug].reports())
+
+  return full.reports()
+
+
+# Given a list of domains or subdomains, quick filter to which
+# are eligible for this report, optionally for an agency.
+def eligible_for(report, hosts, agency=None):
+  return [host[report] for hostname, host in hosts.items() if (host.get(report) and host[report]['eligible'] and ((agency is None) or (host['agency_slug'] == agency['slug'])))]
+
+# Totals up each agency's reports, and the government-wide ones, in a
+# single pass over every host. Updates `agencies` in-place, and returns
+# the government-wide report.
+def update_totals(agencies, domains, subdomains):
+  full = Totals()
+  agency_totals = {agency_slug: Totals() for agency_slug in agencies.keys()}
+
+  LOGGER.info("Totalling agency and government-wide reports.")
+  for hosts, parent in [(domains, True), (subdomains, False)]:
+    for hostname, host in hosts.items():
+      full.add_host(host, parent)
+
+      totals = agency_totals.get(host['agency_slug'])
+      if totals is not None:
+        totals.add_host(host, parent)
+
+  for agency_slug, agency in agencies.items():
+    agency.update(agency_totals[agency_slug].reports())
+
+  # Accessibility. Parent domains.
+  # LOGGER.info("[%s][%s] Totalling report." % (agency['slug'], 'a11y'))
+  # eligible = eligible_for('a11y', domains, agency)
+  # pages_count = len(eligible)
+  # errors = {e:0 for e in A11Y_ERRORS.values()}
+  # for a11y in eligible:
+  #   for error in a11y['errorlist']:
+  #     errors[error] += a11y['errorlist'][error]
+  # total_errors = sum(errors.values())
+  # avg_errors_per_page = (
+  #   'n/a' if pages_count == 0 else round(float(total_errors) / pages_count, 2)
+  # )
+  # totals = {
+  #   'eligible': pages_count,
+  #   'pages_count': pages_count,
+  #   'Average Errors per Page': avg_errors_per_page
+  # }
+  # if pages_count:
+  #   averages = ({
+  #     e: round(mean([report['errorlist'][e] for report in eligible]), 2)
+  #     for e in A11Y_ERRORS.values()
+  #   })
+  # else:
+  #   averages = {e: 'n/a' for e in A11Y_ERRORS.values()}
+  # totals.update(averages)
+  # agency['a11y'] = totals
+
+
+  # Customer satisfaction. Parent domains.
+  # LOGGER.info("[%s][%s] Totalling report." % (agency['slug'], 'cust_sat'))
+  # eligible = eligible_for('cust_sat', domains, agency)
+  # agency['cust_sat'] = {
+  #   'eligible': len(eligible),
+  #   'participating': len([report for report in eligible if report['participating']])
+  # }
+
 
   # a11y report. Parent domains.
   # Constructed very differently.
@@ -691,7 +1261,7 @@ def full_report(domains, subdomains):
   #   'participating': participating
   # }
 
-  return full
+  return full.reports()
 
 
 def eligible_for_https(domain):
@@ -956,6 +1526,192 @@ def https_behavior_for(name, pshtt, sslyze, parent_preloaded=None):
 
   return report
 
+# The same reports as https_behavior_for(), for a batch of hosts at once.
+#
+# The pshtt and sslyze columns the decisions rest on are read into NumPy
+# arrays once, and each decision is made for every host in the batch with
+# array operations rather than host by host. Reports come out exactly as
+# https_behavior_for() makes them: same keys, same order, plain Python
+# bools, ints and Nones.
+#
+# `hosts` are https_behavior_for() arguments, as made by https_hosts().
+# `groups` gives the group (0 to n_groups - 1) each host is totalled in,
+# which for process_domains() is its parent domain.
+class HttpsBatch:
+
+  PSHTT_COLUMNS = [
+    "Downgrades HTTPS", "Valid HTTPS", "HTTPS Bad Chain", "HTTPS Bad Hostname",
+    "Strictly Forces HTTPS", "Defaults to HTTPS", "Redirect",
+    "HSTS", "HSTS Max Age", "HSTS Preloaded", "HSTS Preload Ready"
+  ]
+  SSLYZE_COLUMNS = ["Any RC4", "Any 3DES", "SSLv2", "SSLv3"]
+
+  def __init__(self, hosts, groups, n_groups):
+    self.names = [host[0] for host in hosts]
+    self.groups = numpy.array(groups, dtype=numpy.intp)
+    self.n_groups = n_groups
+
+    pshtt = scan_columns([host[1] for host in hosts], self.PSHTT_COLUMNS)
+    parent_preloaded = numpy.array([bool(host[3]) for host in hosts], dtype=bool)
+
+    # Hosts without sslyze data get None for everything, read as unknown.
+    scanned = numpy.array([host[2] is not None for host in hosts], dtype=bool)
+    sslyze = {column: numpy.full(len(hosts), None, dtype=object) for column in self.SSLYZE_COLUMNS}
+    if scanned.any():
+      for column, values in scan_columns([host[2] for host in hosts if host[2] is not None], self.SSLYZE_COLUMNS).items():
+        sslyze[column][scanned] = values
+
+    def true(column):
+      return pshtt[column] == "True"
+
+    def false(column):
+      return pshtt[column] == "False"
+
+    # Uses HTTPS?
+    self.uses = numpy.select(
+      [true("Downgrades HTTPS"), true("Valid HTTPS"), true("HTTPS Bad Chain") & false("HTTPS Bad Hostname")],
+      [0, 2, 1],
+      -1
+    )
+    https = self.uses > 0
+
+    # Enforces HTTPS?
+    self.enforces = numpy.select(
+      [
+        ~https,
+        true("Strictly Forces HTTPS") & (true("Defaults to HTTPS") | true("Redirect")),
+        false("Strictly Forces HTTPS") & true("Defaults to HTTPS")
+      ],
+      [0, 3, 2],
+      1
+    )
+
+    # HSTS. Blank max-ages are None; a max-age of 0 is no HSTS.
+    max_age = pshtt["HSTS Max Age"]
+    has_age = (max_age != "") & numpy.not_equal(max_age, None)
+    age = numpy.zeros(len(hosts), dtype=numpy.int64)
+    age[has_age] = max_age[has_age].astype(numpy.int64)
+    self.hsts_age = numpy.where(has_age, age, None)
+
+    hsts = true("HSTS") & has_age & (age != 0)
+    self.hsts = numpy.select(
+      [parent_preloaded, ~https, hsts & (age >= 31536000), hsts],
+      [3, -1, 2, 1],
+      0
+    )
+
+    self.preloaded = numpy.select(
+      [true("HSTS Preloaded"), true("HSTS Preload Ready")],
+      [2, 1],
+      0
+    )
+
+    # Ciphers and protocols, for hosts with HTTPS and sslyze data.
+    scanned = scanned & https
+    self.crypto = {}
+    for column in self.SSLYZE_COLUMNS:
+      self.crypto[column] = (
+        scanned & (sslyze[column] == "True"),
+        scanned & (sslyze[column] == "False")
+      )
+
+    weak = numpy.zeros(len(hosts), dtype=bool)
+    for yes, no in self.crypto.values():
+      weak |= yes
+    self.bod_crypto = numpy.select([~scanned, weak], [-1, 0], 1)
+
+    self.m1513 = (self.enforces >= 2) & (self.hsts >= 2)
+    self.compliant = self.m1513 & (self.bod_crypto != 0)
+
+  # True, False or None (neither, or not scanned) for an sslyze column.
+  def tristate(self, column):
+    yes, no = self.crypto[column]
+    values = numpy.full(len(self.names), None, dtype=object)
+    values[yes] = True
+    values[no] = False
+    return values.tolist()
+
+  def reports(self):
+    columns = zip(
+      self.names, self.uses.tolist(), self.enforces.tolist(),
+      self.hsts.tolist(), self.hsts_age.tolist(), self.preloaded.tolist(),
+      self.bod_crypto.tolist(), self.tristate("Any RC4"), self.tristate("Any 3DES"),
+      self.tristate("SSLv2"), self.tristate("SSLv3"),
+      self.m1513.tolist(), self.compliant.tolist()
+    )
+    return [
+      {
+        'hostname': name,
+        'eligible': True,
+        'uses': uses,
+        'enforces': enforces,
+        'hsts': hsts,
+        'hsts_age': hsts_age,
+        'preloaded': preloaded,
+        'bod_crypto': bod_crypto,
+        'rc4': rc4,
+        '3des': des,
+        'sslv2': sslv2,
+        'sslv3': sslv3,
+        'm1513': m1513,
+        'compliant': compliant
+      }
+      for (
+        name, uses, enforces, hsts, hsts_age, preloaded, bod_crypto,
+        rc4, des, sslv2, sslv3, m1513, compliant
+      ) in columns
+    ]
+
+  # Each group's total_https_report(), for all of its hosts.
+  def total_https(self):
+    everyone = numpy.ones(len(self.names), dtype=bool)
+    return self.totals(Totals().https, {
+      'eligible': everyone,
+      'uses': self.uses >= 1,
+      'enforces': self.enforces >= 2,
+      'hsts': self.hsts >= 2,
+      'm1513': self.m1513,
+      'compliant': self.compliant
+    })
+
+  # Each group's total_crypto_report(), for its hosts with RC4 data.
+  def total_crypto(self):
+    rc4, no_rc4 = self.crypto["Any RC4"]
+    eligible = rc4 | no_rc4
+    return self.totals(Totals().crypto, {
+      'eligible': eligible,
+      'bod_crypto': eligible & (self.bod_crypto == 1),
+      'rc4': rc4,
+      '3des': eligible & self.crypto["Any 3DES"][0],
+      'sslv2': eligible & self.crypto["SSLv2"][0],
+      'sslv3': eligible & self.crypto["SSLv3"][0]
+    })
+
+  # Counts the hosts in each group where each of `masks` is true, as a
+  # report per group with the keys of `report`.
+  def totals(self, report, masks):
+    counts = {
+      key: numpy.bincount(self.groups[mask], minlength=self.n_groups).tolist()
+      for key, mask in masks.items()
+    }
+    return [{key: counts[key][i] for key in report} for i in range(self.n_groups)]
+
+# The given columns of a list of scan rows, as arrays of the values read
+# from the CSVs (strings, or None). Rows read from the scan CSVs go into
+# one array in one go; anything else is read column by column.
+def scan_columns(rows, columns):
+  row_classes = set(map(type, rows))
+  row_class = row_classes.pop() if len(row_classes) == 1 else None
+  if (row_class is not None) and issubclass(row_class, ScanRow):
+    table = numpy.array(list(itertools.chain.from_iterable(rows)), dtype=object)
+    table = table.reshape(len(rows), len(row_class.COLUMNS))
+    return {column: table[:, row_class.INDEX[column]] for column in columns}
+
+  return {
+    column: numpy.array([row.get(column) for row in rows], dtype=object)
+    for column in columns
+  }
+
 # Just returns a 0 or 2 for inactive (not live) zones, where
 # we still may care about preloaded state.
 def preloaded_or_not(pshtt):
@@ -964,91 +1720,271 @@ def preloaded_or_not(pshtt):
   else:
     return 0 # No
 
-# 'eligible' should be a list of dicts with https report data.
-def total_https_report(eligible):
-  total_report = {
-    'eligible': len(eligible),
-    'uses': 0,
-    'enforces': 0,
-    'hsts': 0,
-
-    # compliance roll-ups
-    'm1513': 0,
-    'compliant': 0
-  }
+# Running totals of the https, crypto, preloading and analytics reports
+# for a group of hosts (government-wide, an agency, or a parent domain
+# and its subdomains). Hosts are added one at a time, so any number of
+# groups can be totalled in a single pass over the hosts.
+class Totals:
+
+  def __init__(self):
+    self.https = {
+      'eligible': 0,
+      'uses': 0,
+      'enforces': 0,
+      'hsts': 0,
+
+      # compliance roll-ups
+      'm1513': 0,
+      'compliant': 0
+    }
+    self.crypto = {
+      'eligible': 0,
+      'bod_crypto': 0,
+      'rc4': 0,
+      '3des': 0,
+      'sslv2': 0,
+      'sslv3': 0
+    }
+    self.preloading = {
+      'eligible': 0,
+      'preloaded': 0,
+      'preload_ready': 0
+    }
+    self.analytics = {
+      'eligible': 0,
+      'participating': 0
+    }
 
-  for report in eligible:
+  # Totals picking up from reports() saved earlier.
+  @classmethod
+  def restore(cls, reports):
+    totals = cls()
+    for name, report in (reports or {}).items():
+      getattr(totals, name).update(report)
+    return totals
+
+  # Adds a host to whichever reports it's eligible for. Preloading and
+  # analytics only look at parent domains.
+  #
+  # A step of -1 takes back a host added before.
+  def add_host(self, host, parent, step=1):
+    https = host.get('https')
+    if https and https['eligible']:
+      self.count_https(https, step)
+
+    # For SSLv2/SSLv3/RC4/3DES, sslyze-scanned hosts.
+    if https and (https.get('rc4') is not None):
+      self.count_crypto(https, step)
+
+    if parent:
+      # All parent domains, whether they use HTTP or not, are eligible.
+      self.count_preloading(host['https'], step)
+
+      analytics = host.get('analytics')
+      if analytics and analytics['eligible']:
+        self.count_analytics(analytics, step)
+
+  # The finished reports, by report name.
+  def reports(self):
+    return {
+      'https': self.https,
+      'crypto': self.crypto,
+      'preloading': self.preloading,
+      'analytics': self.analytics
+    }
+
+  # 'report' should be a dict with https report data.
+  def count_https(self, report, step=1):
+    self.https['eligible'] += step
 
     # Needs to be enabled, with issues is allowed
     if report['uses'] >= 1:
-      total_report['uses'] += 1
+      self.https['uses'] += step
 
     # Needs to be Default or Strict to be 'Yes'
     if report['enforces'] >= 2:
-      total_report['enforces'] += 1
+      self.https['enforces'] += step
 
     # Needs to be present with >= 1 year max-age for canonical endpoint,
     # or preloaded via its parent zone.
     if report['hsts'] >= 2:
-      total_report['hsts'] += 1
+      self.https['hsts'] += step
 
     # Factors in crypto score, but treats ineligible services as passing.
     for field in ['m1513', 'compliant']:
       if report[field]:
-        total_report[field] += 1
-
-  return total_report
+        self.https[field] += step
 
-def total_crypto_report(eligible):
-  total_report = {
-    'eligible': len(eligible),
-    'bod_crypto': 0,
-    'rc4': 0,
-    '3des': 0,
-    'sslv2': 0,
-    'sslv3': 0
-  }
+  def count_crypto(self, report, step=1):
+    self.crypto['eligible'] += step
 
-  for report in eligible:
     if report.get('bod_crypto') is None:
-      continue
+      return
 
     # Needs to be a Yes
     if report['bod_crypto'] == 1:
-      total_report['bod_crypto'] += 1
+      self.crypto['bod_crypto'] += step
 
     # Tracking separately, may not display separately
     if report['rc4']:
-      total_report['rc4'] += 1
+      self.crypto['rc4'] += step
     if report['3des']:
-      total_report['3des'] += 1
+      self.crypto['3des'] += step
     if report['sslv2']:
-      total_report['sslv2'] += 1
+      self.crypto['sslv2'] += step
     if report['sslv3']:
-      total_report['sslv3'] += 1
-
-  return total_report
+      self.crypto['sslv3'] += step
 
-def total_preloading_report(eligible):
-  total_report = {
-    'eligible': len(eligible),
-    'preloaded': 0,
-    'preload_ready': 0
-  }
+  def count_preloading(self, report, step=1):
+    self.preloading['eligible'] += step
 
-  # Tally preloaded and preload-ready
-  for report in eligible:
     # We consider *every* domain eligible for preloading,
     # so there may be no pshtt data for some.
     if report.get('preloaded') is None:
-      continue
+      return
 
     if report['preloaded'] == 1:
-      total_report['preload_ready'] += 1
+      self.preloading['preload_ready'] += step
     elif report['preloaded'] == 2:
-      total_report['preloaded'] += 1
+      self.preloading['preloaded'] += step
+
+  def count_analytics(self, report, step=1):
+    self.analytics['eligible'] += step
+    if report['participating'] == True:
+      self.analytics['participating'] += step
+
+# 'eligible' should be a list of dicts with https report data.
+def total_https_report(eligible):
+  totals = Totals()
+  for report in eligible:
+    totals.count_https(report)
+  return totals.https
+
+def total_crypto_report(eligible):
+  totals = Totals()
+  for report in eligible:
+    totals.count_crypto(report)
+  return totals.crypto
+
+def total_preloading_report(eligible):
+  totals = Totals()
+  for report in eligible:
+    totals.count_preloading(report)
+  return totals.preloading
+
+### Changes since the last run.
+#
+# Before the database is replaced, each host's codes for the reports it's
+# eligible for are read from it, and compared with the new ones. Each
+# report gets a list of the hosts that changed, as rows of:
+#
+#   [hostname, agency slug, field, code before, code after, change]
+#
+# where the field is one shown in the report's CSV export, or "eligible"
+# for hosts that are new to the report ("added") or have left it
+# ("removed"), and other changes are "improved" or "regressed".
+
+CHANGE_REPORTS = ['https', 'analytics']
+
+# For these, a higher code (or True) is worse: it means weak crypto is in use.
+WORSE_WHEN_HIGHER = ['3des', 'rc4', 'sslv2', 'sslv3']
+
+# The report date of the data about to be replaced, and each of its hosts'
+# codes: {hostname: (agency slug, {report name: {field: code}})}. (None, {})
+# if there's no earlier data to compare with.
+def previous_generation(backend):
+  try:
+    if backend == "sqlite":
+      connection = sqlite3.connect("file:%s?mode=ro" % models.SQLITE_PATH, uri=True)
+      try:
+        reports = [ujson.loads(row[0]) for row in connection.execute("SELECT data FROM reports ORDER BY id")]
+        hosts = (ujson.loads(row[0]) for row in connection.execute("SELECT data FROM domains ORDER BY id"))
+        previous = {host['domain']: host_codes(host) for host in hosts}
+      finally:
+        connection.close()
+    else:
+      with open(models.DB_PATH, encoding='utf-8') as f:
+        tables = ujson.load(f)
+      reports = list(tables.get('reports', {}).values())
+      previous = {host['domain']: host_codes(host) for host in tables.get('domains', {}).values()}
+  except (OSError, ValueError, KeyError, sqlite3.Error):
+    LOGGER.info("No earlier data to compare with.")
+    return None, {}
+
+  if not reports:
+    return None, {}
+  return reports[0].get('report_date'), previous
+
+def host_codes(host):
+  return host.get('agency_slug'), {
+    report_name: {field: host[report_name].get(field) for field in CSV_FIELDS[report_name]}
+    for report_name in CHANGE_REPORTS
+    if isinstance(host.get(report_name), dict) and (host[report_name].get('eligible') == True)
+  }
+
+# One record per report, for the changes table, or none if there was no
+# earlier data.
+def compute_changes(previous, since, hosts, date):
+  if since is None:
+    return []
+
+  current = {host['domain']: host_codes(host) for host in hosts}
+  hostnames = sorted(set(previous) | set(current))
+
+  changes = []
+  for report_name in CHANGE_REPORTS:
+    rows = []
+    for hostname in hostnames:
+      agency_slug, before = previous.get(hostname, (None, {}))
+      agency_slug, after = current.get(hostname, (agency_slug, {}))
+      before, after = before.get(report_name), after.get(report_name)
+
+      # most hosts don't change from one run to the next
+      if before == after:
+        continue
+      elif before is None:
+        rows.append([hostname, agency_slug, 'eligible', False, True, 'added'])
+      elif after is None:
+        rows.append([hostname, agency_slug, 'eligible', True, False, 'removed'])
+      else:
+        for field in CSV_FIELDS[report_name]:
+          if before[field] != after[field]:
+            rows.append([hostname, agency_slug, field, before[field], after[field], change_for(field, before[field], after[field])])
+
+    changes.append({'report': report_name, 'report_date': date, 'since': since, 'rows': rows})
+  return changes
+
+def change_for(field, before, after):
+  # codes that went missing (or appeared) can't be said to be better or worse
+  if (before is None) or (after is None):
+    return 'changed'
+  worse = (after < before) if (field not in WORSE_WHEN_HIGHER) else (after > before)
+  return 'regressed' if worse else 'improved'
+
+
+### Report history.
+#
+# Each run appends a line to HISTORY_DATA with the day's government-wide
+# totals and each agency's (see History in app/models.py), so trends can
+# be served without keeping every day's db.json around. It's only ever
+# appended to; if a day is processed again, its later line wins.
+
+def append_history(path, date, totals, agencies):
+  entry = ujson.dumps({
+    # first, so the app can index lines by date without parsing them
+    'report_date': date,
+    'reports': totals,
+    'agencies': {
+      agency_slug: {name: agencies[agency_slug][name] for name in totals.keys()}
+      for agency_slug in sorted(agencies.keys())
+    }
+  })
+
+  mkdir_p(os.path.dirname(path))
+  # one write, so a reader sees all of the line or none of it
+  with open(path, 'a', encoding='utf-8') as f:
+    f.write(entry + "\n")
 
-  return total_report
 
 # Hacky helper - print out the %'s after the command finishes.
 def print_report(report):
@@ -1067,6 +2003,85 @@ def print_report(report):
         LOGGER.info("%s: %i%% (%i)" % (key, percent(report[report_type][key], eligible), report[report_type][key]))
 
 
+### Scan data rows.
+#
+# domain-scan's CSVs have dozens of columns, but processing only looks at
+# a few of them. Each scan's rows are read into tuples holding just the
+# columns it needs, listed below, and read back by column name like the
+# csv.DictReader rows they replace (row["Live"], row.get("Any 3DES")).
+
+class ScanRow(tuple):
+  __slots__ = ()
+
+  # Columns to keep, which the scan's CSV must have...
+  COLUMNS = []
+  # ...apart from these, which read as None when missing.
+  OPTIONAL = []
+
+  def __init_subclass__(cls):
+    cls.INDEX = {column: i for i, column in enumerate(cls.COLUMNS)}
+
+  def __getitem__(self, column):
+    return tuple.__getitem__(self, self.INDEX[column])
+
+  def get(self, column, default=None):
+    i = self.INDEX.get(column)
+    if i is None:
+      return default
+    value = tuple.__getitem__(self, i)
+    return default if value is None else value
+
+class PshttRow(ScanRow):
+  __slots__ = ()
+  COLUMNS = [
+    "Domain", "Base Domain", "Live", "Redirect", "Canonical URL",
+    "Valid HTTPS", "Defaults to HTTPS", "Downgrades HTTPS",
+    "Strictly Forces HTTPS", "HTTPS Bad Chain", "HTTPS Bad Hostname",
+    "HSTS", "HSTS Max Age", "HSTS Preload Ready", "HSTS Preloaded"
+  ]
+
+class SslyzeRow(ScanRow):
+  __slots__ = ()
+  COLUMNS = ["Domain", "SSLv2", "SSLv3", "Any RC4", "Any 3DES"]
+  # Not in older scans.
+  OPTIONAL = ["Any 3DES"]
+
+class AnalyticsRow(ScanRow):
+  __slots__ = ()
+  COLUMNS = ["Domain", "Participates in Analytics"]
+
+# Reads the rows of a domain-scan CSV as `row_class` rows. Exits if the
+# CSV is missing any of the columns they need.
+def scan_rows(path, row_class):
+  with open(path, newline='') as csvfile:
+    reader = csv.reader(csvfile)
+    headers = next(reader, [])
+
+    missing = [
+      column for column in row_class.COLUMNS
+      if (column not in headers) and (column not in row_class.OPTIONAL)
+    ]
+    if missing:
+      LOGGER.critical("%s is missing columns: %s" % (path, ", ".join(missing)))
+      exit(1)
+
+    # Missing optional columns are read from a None tacked onto each row.
+    # Like csv.DictReader, a column named twice is read from the last one.
+    width = len(headers) + 1
+    index = {column: i for i, column in enumerate(headers)}
+    pick = operator.itemgetter(*[
+      index.get(column, len(headers)) for column in row_class.COLUMNS
+    ])
+
+    for row in reader:
+      # and, also like csv.DictReader, blank lines are skipped
+      if not row:
+        continue
+      if len(row) < width:
+        row.extend([None] * (width - len(row)))
+      yield row_class(pick(row))
+
+
 ### utilities
 
 def shell_out(command, env=None):
@@ -6,7 +6,6 @@
 #   python -m data.update
 
 import subprocess
-import datetime
 import os
 import ujson
 import logging
@@ -17,6 +16,9 @@ from data.env import *
 # Import processing just for the function call.
 import data.processing
 from data import logger
+from data import uploads
+from data import downloads
+from data import pipeline
 
 LOGGER = logger.get_logger(__name__)
 
@@ -37,8 +39,12 @@ LOGGER = logger.get_logger(__name__)
 # 2. Run processing.py to generate front-end-ready data as data/db.json.
 #
 # 3. Upload data to S3.
-#    - Depends on the AWS CLI and access credentials already being configured.
-#    - TODO: Consider moving from aws CLI to Python library.
+#    - Depends on boto3 (pip install -e .[upload]) and AWS credentials
+#      already being configured, as for the AWS CLI.
+#
+# Parent domains are scanned at the same time as subdomains are gathered
+# and scanned. How long each step took, and whether it finished, is saved
+# to data/output/update/checkpoint.json as it goes.
 
 
 
@@ -49,18 +55,50 @@ LOGGER = logger.get_logger(__name__)
 #     download: download scan data from S3
 #     here: run the default full scan
 # --upload: upload scan data and resulting db.json anything to S3
+# --download-workers=N: files to download at once, with --scan=download
+#     or --just-download (default 8)
+# --download-url=URL: download from somewhere other than the bucket's
+#     public URL, e.g. a local server to try things out against
+# --upload-workers=N: files to upload at once (default 8)
+# --s3-endpoint=URL: upload to another S3-compatible server, e.g. a local
+#     MinIO to try things out against
 # --gather=[skip,here]
 #     skip: skip gathering, assume CSVs are locally cached
 #     here: run the default full gather
+# --workers=N: processes to use for processing.py's per-domain
+#     conclusions (default 1)
+# --engine=scalar|numpy: how processing.py works out HTTPS reports
+#     (default numpy, if installed)
+# --join=hash|merge: how processing.py matches up subdomains across the
+#     gathered and scanned CSVs (default hash; merge needs sorted CSVs)
+# --cache=false: have processing.py read the CSVs, not its cache of them
+# --incremental: have processing.py only reprocess parent domains whose
+#     inputs changed since the last --incremental run
+# --history=false: don't add this run's totals to data/history.jsonl
+# --resume: pick up where the last run left off, if it didn't finish,
+#     skipping the steps it got done (it has to have had the same --scan,
+#     --gather, --date and --upload)
+# --trace-memory: have processing.py's per-stage metrics (data/metrics.json)
+#     include tracemalloc's peaks, at the cost of a much slower run
 
 def run(options):
   # If this is just being used to download production data, do that.
   if options.get("just-download", False):
-    download_s3()
+    download_s3(options)
     return
 
-  # Definitive scan date for the run.
-  today = datetime.datetime.strftime(datetime.datetime.now(), "%Y-%m-%d")
+  # Each step is a stage in a pipeline, which starts once the stages it
+  # depends on are done, alongside any others that can also start then.
+  # A run can only be resumed with the same options that decide what
+  # each stage does.
+  checkpointed = {
+    flag: options.get(flag) for flag in ["scan", "gather", "date", "upload"]
+  }
+  try:
+    update = pipeline.Pipeline(UPDATE_CHECKPOINT, resume=options.get("resume", False), options=checkpointed)
+  except ValueError as error:
+    LOGGER.critical(str(error))
+    exit(1)
 
   # 1. Download scan data, do a new scan, or skip altogether.
   scan_mode = options.get("scan", "skip")
@@ -71,96 +109,128 @@ def run(options):
   if scan_mode == "here":
     # 1a. Gather .gov federal subdomains.
     if gather_mode == "here":
-      LOGGER.info("Gathering subdomains.")
-      gather_subdomains(options)
-      LOGGER.info("Subdomain gathering complete.")
+      def gather(results):
+        LOGGER.info("Gathering subdomains.")
+        gather_subdomains(options)
+        LOGGER.info("Subdomain gathering complete.")
+      update.stage("gather", gather)
     elif gather_mode == "skip":
       LOGGER.info("Skipping subdomain gathering.")
 
     # 1b. Scan subdomains for some types of things.
-    LOGGER.info("Scanning subdomains.")
-    scan_subdomains(options)
-    LOGGER.info("Subdomain scanning complete")
+    def scan_subdomains_stage(results):
+      LOGGER.info("Scanning subdomains.")
+      scan_subdomains(options)
+      LOGGER.info("Subdomain scanning complete")
+    update.stage("scan_subdomains", scan_subdomains_stage, after=(["gather"] if gather_mode == "here" else []))
 
     # 1c. Scan parent domains for all types of things.
-    LOGGER.info("Scanning parent domains.")
-    scan_parents(options)
-    LOGGER.info("Scan of parent domains complete.")
+    # They don't depend on the subdomains, so this starts right away.
+    def scan_parents_stage(results):
+      LOGGER.info("Scanning parent domains.")
+      scan_parents(options)
+      LOGGER.info("Scan of parent domains complete.")
+    update.stage("scan_parents", scan_parents_stage)
   elif scan_mode == "download":
-    LOGGER.info("Downloading latest production scan data from S3.")
-    download_s3()
-    LOGGER.info("Download complete.")
-
-  # Sanity check to make sure we have what we need.
-  if not os.path.exists(os.path.join(PARENTS_RESULTS, "meta.json")):
-    LOGGER.info("No scan metadata downloaded, aborting.")
-    exit()
+    def download(results):
+      LOGGER.info("Downloading latest production scan data from S3.")
+      download_s3(options)
+      LOGGER.info("Download complete.")
+    update.stage("download", download)
 
-  # Date can be overridden if need be, but defaults to meta.json.
-  if options.get("date", None) is not None:
-    the_date = options.get("date")
-  else:
-    # depends on YYYY-MM-DD coming first in meta.json time format
-    scan_meta = ujson.load(open("data/output/parents/results/meta.json"))
-    the_date = scan_meta['start_time'][0:10]
+  scans = list(update.stages)
 
+  # The history is only ever added to, so start from production's if
+  # there's none here yet, or the upload would replace it with one day's.
+  if options.get("upload", False):
+    def history(results):
+      if not os.path.exists(HISTORY_DATA):
+        download_history(options)
+    update.stage("history", history, after=scans)
 
   # 2. Process and load data into Pulse's database.
-  LOGGER.info("[%s] Loading data into Pulse." % the_date)
-  data.processing.run(the_date, options)
-  LOGGER.info("[%s] Data now loaded into Pulse." % the_date)
+  def process(results):
+    # Sanity check to make sure we have what we need.
+    if not os.path.exists(os.path.join(PARENTS_RESULTS, "meta.json")):
+      LOGGER.info("No scan metadata downloaded, aborting.")
+      exit()
+
+    # Date can be overridden if need be, but defaults to meta.json.
+    if options.get("date", None) is not None:
+      the_date = options.get("date")
+    else:
+      # depends on YYYY-MM-DD coming first in meta.json time format
+      scan_meta = ujson.load(open("data/output/parents/results/meta.json"))
+      the_date = scan_meta['start_time'][0:10]
+
+    LOGGER.info("[%s] Loading data into Pulse." % the_date)
+    data.processing.run(the_date, options)
+    LOGGER.info("[%s] Data now loaded into Pulse." % the_date)
+
+    # Passed on to the upload, even if it's resumed on its own.
+    return the_date
+  update.stage("process", process, after=list(update.stages))
 
   # 3. Upload data to S3 (if requested).
   if options.get("upload", False):
-    LOGGER.info("[%s] Syncing scan data and database to S3." % the_date)
-    upload_s3(the_date)
-    LOGGER.info("[%s] Scan data and database now in S3." % the_date)
+    def upload(results):
+      the_date = results["process"]
+      LOGGER.info("[%s] Syncing scan data and database to S3." % the_date)
+      upload_s3(the_date, options)
+      LOGGER.info("[%s] Scan data and database now in S3." % the_date)
+    update.stage("upload", upload, after=["process"])
 
-  LOGGER.info("[%s] All done." % the_date)
+  update.run()
+  LOGGER.info("[%s] All done." % update.results()["process"])
 
 
 # Upload the scan + processed data to /live/ and /archive/ locations by date.
-def upload_s3(date):
-  # Used for all operations.
-  acl = "--acl=public-read"
-
-  # Used when uploading to the live/ dir.
-  delete = "--delete"
-
-  live_parents = "s3://%s/live/parents/" % BUCKET_NAME
-  live_subdomains = "s3://%s/live/subdomains/" % BUCKET_NAME
-  live_db = "s3://%s/live/db/" % BUCKET_NAME
-
-  shell_out(["aws", "s3", "sync", PARENTS_DATA, live_parents, acl, delete])
-  shell_out(["aws", "s3", "sync", SUBDOMAIN_DATA, live_subdomains, acl, delete])
-  shell_out(["aws", "s3", "cp", DB_DATA, live_db, acl])
-
-  # Then copy the entire live directory to a dated archive.
-  # Ask S3 to do the copying, to save on time and bandwidth.
-  live = "s3://%s/live/" % (BUCKET_NAME)
-  archive = "s3://%s/archive/%s/" % (BUCKET_NAME, date)
-  shell_out(["aws", "s3", "sync", live, archive, acl])
+def upload_s3(date, options):
+  try:
+    uploader = uploads.Uploader(
+      BUCKET_NAME, region=AWS_REGION,
+      endpoint=options.get("s3-endpoint"),
+      workers=int(options.get("upload-workers", 8))
+    )
+  except RuntimeError as error:
+    LOGGER.critical(str(error))
+    exit(1)
+
+  try:
+    # Scan data first, then db.json, on its own, once everything else is up.
+    sources = [
+      (PARENTS_DATA, "live/parents/"),
+      (SUBDOMAIN_DATA, "live/subdomains/"),
+    ]
+    if os.path.exists(HISTORY_DATA):
+      sources.append((HISTORY_DATA, "live/db/history.jsonl"))
+    uploader.sync(sources)
+    uploader.sync([(DB_DATA, "live/db/db.json")])
+
+    # Then copy the entire live directory to a dated archive.
+    # Ask S3 to do the copying, to save on time and bandwidth.
+    uploader.copy("live/", "archive/%s/" % date)
+  finally:
+    uploader.close()
+
+  uploader.log()
 
 
 # Makes use of the public URLs so that this can be run in a dev
 # environment that doesn't have write credentials to the bucket.
-def download_s3():
-
-  def download(src, dest):
-    # remote sources relative to bucket
-    url = "https://s3-%s.amazonaws.com/%s/%s" % (AWS_REGION, BUCKET_NAME, src)
-
-    # local destinations are relative to data/
-    path = os.path.join(DATA_DIR, dest)
-
-    shell_out(["curl", url, "--output", path])
+def download_s3(options):
+  # remote sources are relative to the bucket (or --download-url),
+  # local destinations are relative to data/
+  files = []
+  def download(src, dest, required=True):
+    files.append((src, os.path.join(DATA_DIR, dest), required))
 
   # Ensure the destination directories are present.
   os.makedirs(os.path.join(PARENTS_DATA, "results"), exist_ok=True)
   os.makedirs(os.path.join(SUBDOMAIN_DATA_GATHERED, "results"), exist_ok=True)
   os.makedirs(os.path.join(SUBDOMAIN_DATA_SCANNED, "results"), exist_ok=True)
 
-  # Use cURL to download files.
+  # Use plain HTTP to download files.
   # Don't rely on aws being configured, and surface any permission issues.
   #
   # Just grab results, not all the cached data.
@@ -179,10 +249,35 @@ def download_s3():
   download("live/subdomains/gather/results/gathered.csv", "output/subdomains/gather/results/gathered.csv")
   download("live/subdomains/gather/results/meta.json", "output/subdomains/gather/results/meta.json")
 
-  # Also download the latest compiled DB.
+  # Also download the latest compiled DB, and its history, if there is one.
   # This will be overwritten immediately if this is being used in
   # the context of a full data load/processing.
   download("live/db/db.json", "db.json")
+  download("live/db/history.jsonl", "history.jsonl", required=False)
+
+  fetch(files, options)
+
+# The daily history of totals that goes with db.json, if there is one yet.
+def download_history(options):
+  results = fetch([("live/db/history.jsonl", HISTORY_DATA, False)], options)
+  if results[HISTORY_DATA][0] == downloads.MISSING:
+    LOGGER.info("No history in S3 yet, starting a new one.")
+
+# Downloads only what's changed since last time, several files at once.
+def fetch(files, options):
+  base_url = options.get("download-url") or ("https://s3-%s.amazonaws.com/%s/" % (AWS_REGION, BUCKET_NAME))
+  if not base_url.endswith("/"):
+    base_url += "/"
+
+  downloader = downloads.Downloader(
+    base_url, DOWNLOAD_STATE,
+    workers=int(options.get("download-workers", 8))
+  )
+  try:
+    return downloader.download(files)
+  except OSError as error:
+    LOGGER.critical("Error downloading from %s: %s" % (base_url, error))
+    exit(1)
 
 
 # Use domain-scan to scan .gov domains from the set domain URL.
@@ -0,0 +1,205 @@
+###
+#
+# Uploads processed data to S3, for data/update.py.
+#
+# Files are compared with what's already in the bucket by ETag: for S3,
+# that's the MD5 of an object's content or, if it was uploaded in parts,
+# the MD5 of its parts' MD5s with the number of parts. Files are uploaded
+# in parts of PART_SIZE, the same size their local ETags are worked out
+# with, so unchanged files are skipped without downloading anything or
+# keeping hashes of our own. (The AWS CLI uses the same size by default,
+# so files it uploaded are recognized too.)
+#
+# Files are uploaded by a pool of threads, one file per thread (large
+# ones a part at a time), so there are never more than `workers` uploads
+# going at once. Each sync() waits for all of its files, so what's synced
+# last (db.json) only goes up once everything before it is there.
+#
+# Needs boto3 (pip install -e .[upload]). Credentials are found the same
+# way as for the AWS CLI. To try it out against a local S3-compatible
+# server, like MinIO, give it that server's URL as `endpoint`.
+#
+###
+
+import os
+import time
+import hashlib
+import mimetypes
+import concurrent.futures
+
+from data import logger
+
+# Optional: only needed to actually upload.
+try:
+  import boto3
+  from boto3.s3.transfer import TransferConfig
+except ImportError:
+  boto3 = None
+
+
+LOGGER = logger.get_logger(__name__)
+
+PART_SIZE = 8 * 1024 * 1024
+
+# Most keys S3 will delete in one request.
+DELETE_BATCH = 1000
+
+
+# What S3's ETag for the file would be, if uploaded in `part_size` parts.
+# Files of at least `part_size` are uploaded in parts (even if there's
+# only one), smaller ones whole.
+def local_etag(path, part_size=PART_SIZE):
+  digests = []
+  with open(path, 'rb') as f:
+    while True:
+      part = f.read(part_size)
+      if (not part) and digests:
+        break
+      digests.append(hashlib.md5(part).digest())
+      if len(part) < part_size:
+        break
+
+  if os.path.getsize(path) < part_size:
+    return digests[0].hex()
+  return "%s-%i" % (hashlib.md5(b"".join(digests)).hexdigest(), len(digests))
+
+# The files to upload from `source`, with their keys: if it's a directory,
+# everything in it, under `destination` as a prefix, and if it's a file,
+# just that file, as `destination`.
+def local_files(source, destination):
+  if not os.path.isdir(source):
+    return [(source, destination)]
+
+  files = []
+  for directory, subdirectories, names in os.walk(source):
+    subdirectories.sort()
+    for name in sorted(names):
+      path = os.path.join(directory, name)
+      relative = os.path.relpath(path, source).replace(os.sep, "/")
+      files.append((path, destination + relative))
+  return files
+
+# Which of `files` need uploading, given the ETags of what's already in
+# the bucket (key -> ETag), and which keys under `prefix` should be
+# deleted because there's no file for them any more (if `prefix` is given,
+# as when syncing a directory).
+def plan(files, remote, prefix=None):
+  uploads = [
+    (path, key) for path, key in files
+    if remote.get(key) != local_etag(path)
+  ]
+
+  if prefix is None:
+    deletes = []
+  else:
+    keys = set(key for path, key in files)
+    deletes = sorted(key for key in remote if key.startswith(prefix) and (key not in keys))
+
+  return uploads, deletes
+
+
+class Uploader:
+
+  # `workers` is how many files are uploaded at once.
+  def __init__(self, bucket, region=None, endpoint=None, workers=8, acl="public-read"):
+    if boto3 is None:
+      raise RuntimeError("Uploading needs boto3 installed (pip install -e .[upload]).")
+
+    self.bucket = bucket
+    self.acl = acl
+    self.client = boto3.client('s3', region_name=region, endpoint_url=endpoint)
+    # The pool already uploads `workers` files at once, so each file's
+    # parts go one at a time: otherwise every thread would start `workers`
+    # threads of its own.
+    self.transfer = TransferConfig(
+      multipart_threshold=PART_SIZE, multipart_chunksize=PART_SIZE,
+      max_concurrency=1
+    )
+    self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    # destination -> {uploaded, skipped, deleted, bytes, seconds}
+    self.stats = {}
+
+  def close(self):
+    self.pool.shutdown()
+
+  # Key -> ETag, for everything in the bucket under `prefix`.
+  def remote_objects(self, prefix):
+    objects = {}
+    paginator = self.client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+      for item in page.get('Contents', []):
+        objects[item['Key']] = item['ETag'].strip('"')
+    return objects
+
+  # Brings the bucket up to date with each of `sources`, a list of (local
+  # path, destination), all at once: directories to a prefix (ending in
+  # "/"), deleting anything under it that's no longer there, and files to
+  # a key. Returns once everything's done.
+  def sync(self, sources):
+    pending = []
+    for source, destination in sources:
+      started = time.perf_counter()
+      files = local_files(source, destination)
+      is_prefix = os.path.isdir(source)
+
+      remote = self.remote_objects(destination)
+      if not is_prefix:
+        remote = {key: etag for key, etag in remote.items() if key == destination}
+      uploads, deletes = plan(files, remote, prefix=(destination if is_prefix else None))
+
+      self.stats[destination] = stats = {
+        'uploaded': len(uploads), 'skipped': len(files) - len(uploads),
+        'deleted': len(deletes), 'bytes': 0, 'seconds': 0
+      }
+      futures = [self.pool.submit(self.upload, path, key) for path, key in uploads]
+      pending.append((destination, stats, started, futures, deletes))
+
+    for destination, stats, started, futures, deletes in pending:
+      for future in futures:
+        stats['bytes'] += future.result()
+      self.delete(deletes)
+      stats['seconds'] = time.perf_counter() - started
+
+  def upload(self, path, key):
+    extra = {'ACL': self.acl}
+    content_type = mimetypes.guess_type(path)[0]
+    if content_type:
+      extra['ContentType'] = content_type
+
+    self.client.upload_file(path, self.bucket, key, ExtraArgs=extra, Config=self.transfer)
+    return os.path.getsize(path)
+
+  def delete(self, keys):
+    for i in range(0, len(keys), DELETE_BATCH):
+      self.client.delete_objects(Bucket=self.bucket, Delete={
+        'Objects': [{'Key': key} for key in keys[i:i + DELETE_BATCH]]
+      })
+
+  # Copies everything under one prefix to another, within the bucket (so
+  # nothing goes through here).
+  def copy(self, source, destination):
+    started = time.perf_counter()
+    objects = self.remote_objects(source)
+
+    def copy_object(key):
+      self.client.copy(
+        {'Bucket': self.bucket, 'Key': key}, self.bucket, destination + key[len(source):],
+        ExtraArgs={'ACL': self.acl}, Config=self.transfer
+      )
+
+    for future in [self.pool.submit(copy_object, key) for key in objects]:
+      future.result()
+
+    self.stats[destination] = {
+      'uploaded': 0, 'skipped': 0, 'deleted': 0, 'copied': len(objects),
+      'bytes': 0, 'seconds': time.perf_counter() - started
+    }
+
+  def log(self):
+    LOGGER.info("%-40s %8s %8s %8s %10s %8s" % ("destination", "uploaded", "skipped", "deleted", "MB", "seconds"))
+    for destination, stats in self.stats.items():
+      LOGGER.info("%-40s %8i %8i %8i %10.1f %8.2f" % (
+        destination, stats['uploaded'] + stats.get('copied', 0), stats['skipped'],
+        stats['deleted'], stats['bytes'] / (1024 * 1024), stats['seconds']
+      ))
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import gc
 import os
 
 from flask import Flask
@@ -11,13 +12,16 @@ from cfenv import AppEnv
 
 app = Flask(__name__)
 
-# Gzip compress most things
+# Data exports and static assets are served precompressed (see
+# app/compression.py), so only compress dynamic pages on the fly.
 app.config['COMPRESS_MIMETYPES'] = [
-  'text/html', 'text/css', 'text/xml',
-  'text/csv', 'application/json', 'application/javascript'
+  'text/html', 'text/xml'
 ]
 Compress(app)
 
+from app import compression
+compression.register(app)
+
 from app import views
 views.register(app)
 
@@ -27,6 +31,19 @@ helpers.register(app)
 port = int(os.getenv("PORT", 5000))
 environment = os.getenv("PULSE_ENV", "development")
 
+# Request threads. They all share one immutable snapshot of the data (see
+# app/models.py). See "Serving" in the README for sizing against the
+# memory limit in manifest.yml.
+threads = int(os.getenv("WEB_THREADS", 4))
+
+# Load the data snapshot up front, rather than on the first request.
+# It lives until new data is loaded, so it's kept out of the garbage
+# collector's reach, rather than traversed again by every full collection.
+from app import models
+models.read_model()
+if hasattr(gc, "freeze"):
+  gc.freeze()
+
 if environment == "development":
   app.debug = True
 
@@ -45,4 +62,4 @@ if __name__ == "__main__":
   if environment == "development":
     app.run(port=port)
   else:
-    serve(app, port=port, threads=1)
+    serve(app, port=port, threads=threads)
@@ -27,6 +27,7 @@ setuptools.setup(
         'ujson==1.35',
         'waitress==1.0.1',
         'flask-compress==1.4.0',
+        'brotli==1.0.7',
     ],
     extras_require={
         'development': [
@@ -35,5 +36,13 @@ setuptools.setup(
             'pytest==3.5.0',
             'pytest-cov==2.5.1',
         ],
+        # for data processing's --engine=numpy
+        'numpy': [
+            'numpy==1.19.5',
+        ],
+        # for data.update --upload
+        'upload': [
+            'boto3==1.17.112',
+        ],
     },
 )
@@ -4,7 +4,7 @@ var Tables = {
   // e.g. Tables.init($("table"), data)
   init: function(data, options) {
     // assign data
-    if (!options.data) options.data = data;
+    if (!options.data && data) options.data = data;
 
     // add common options to all renderTables requests
     if (!options.responsive) options.responsive = true;
@@ -40,6 +40,17 @@ var Tables = {
     return table;
   },
 
+  // for tables too big to load all at once: DataTables fetches each
+  // page, already searched and sorted, from the server as it's shown.
+  // Columns sort by their raw data value, not what's rendered.
+  initServerSide: function(url, options) {
+    options.serverSide = true;
+    options.processing = true;
+    options.ajax = url;
+
+    return Tables.init(null, options);
+  },
+
   // sets some agency-table-specific options
   initAgency: function(data, options) {
     // Don't paginate agency tables by default.
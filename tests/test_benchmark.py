@@ -0,0 +1,64 @@
+import os
+
+from data import benchmark
+
+
+def read_all(path):
+    files = {}
+    for directory, subdirectories, names in os.walk(path):
+        for name in names:
+            with open(os.path.join(directory, name), 'rb') as f:
+                files[os.path.relpath(os.path.join(directory, name), path)] = f.read()
+    return files
+
+
+def test_synthetic_data_is_deterministic(tmpdir) -> None:
+    benchmark.write_synthetic_data(str(tmpdir.join('a')), 0.02, 1)
+    benchmark.write_synthetic_data(str(tmpdir.join('b')), 0.02, 1)
+    benchmark.write_synthetic_data(str(tmpdir.join('c')), 0.02, 2)
+
+    a, b, c = (read_all(str(tmpdir.join(name))) for name in 'abc')
+    assert sorted(a.keys()) == [
+        'parents/cache/domains.csv',
+        'parents/results/analytics.csv',
+        'parents/results/pshtt.csv',
+        'parents/results/sslyze.csv',
+        'subdomains/gather/results/gathered.csv',
+        'subdomains/scan/results/pshtt.csv',
+        'subdomains/scan/results/sslyze.csv',
+    ]
+    assert a == b
+    assert a != c
+
+    # about 2% of production's gathered hostnames, sorted
+    gathered = a['subdomains/gather/results/gathered.csv'].decode('utf-8').splitlines()[1:]
+    assert len(gathered) == round(benchmark.GATHERED * 0.02)
+    assert gathered == sorted(gathered)
+
+
+def test_compare_flags_regressions() -> None:
+    def results(load, write, output='abc'):
+        stages = [
+            {'name': 'load', 'wall': load, 'peak_rss': 100},
+            {'name': 'write tinydb', 'wall': write, 'peak_rss': 200},
+        ]
+        return {
+            'seed': 0, 'generator': benchmark.GENERATOR_VERSION, 'options': {},
+            'scales': {'1': {'wall': load + write, 'peak_rss': 200, 'stages': stages, 'output': output}}
+        }
+
+    baseline = results(1.0, 2.0)
+
+    lines, regressed = benchmark.compare(results(1.1, 1.0), baseline)
+    assert not regressed
+
+    lines, regressed = benchmark.compare(results(1.5, 1.0), baseline)
+    assert regressed
+    assert [line.split()[0] for line in lines if 'REGRESSED' in line] == ['load']
+
+    # too small a difference to tell from noise
+    lines, regressed = benchmark.compare(results(0.01, 2.0), results(0.001, 2.0))
+    assert not regressed
+
+    lines, regressed = benchmark.compare(results(1.0, 2.0, output='def'), baseline)
+    assert regressed
@@ -0,0 +1,38 @@
+import gzip
+import os
+
+from flask import Flask
+
+from app import compression
+
+
+def test_precompress_writes_fresh_variants(tmpdir) -> None:
+    css = tmpdir.join('main.css')
+    css.write('body { color: black; }\n' * 200)
+    tmpdir.join('logo.png').write_binary(b'\x89PNG' * 100)
+
+    assert compression.precompress(str(tmpdir)) >= 1
+    assert gzip.decompress(tmpdir.join('main.css.gz').read_binary()) == css.read_binary()
+    assert not os.path.exists(str(tmpdir.join('logo.png.gz')))
+
+    # Up to date, nothing to do.
+    assert compression.precompress(str(tmpdir)) == 0
+
+
+def test_static_assets_served_precompressed(tmpdir) -> None:
+    tmpdir.join('main.css').write('body { color: black; }\n' * 200)
+    compression.precompress(str(tmpdir))
+
+    app = Flask(__name__, static_folder=str(tmpdir), static_url_path='/static')
+    compression.register(app)
+    client = app.test_client()
+
+    response = client.get('/static/main.css', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == 'text/css'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.get_data()).startswith(b'body')
+
+    response = client.get('/static/main.css')
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data().startswith(b'body')
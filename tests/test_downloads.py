@@ -0,0 +1,96 @@
+import threading
+import http.server
+
+from data import downloads
+
+
+FILES = {
+    '/live/db/db.json': b'{"domains": {}}' * 100,
+}
+
+# Serves FILES, with ETags, conditional requests and ranges, and notes
+# the headers of each request it gets.
+class Handler(http.server.BaseHTTPRequestHandler):
+    requests = []
+    # if set, where ranges start, whatever was asked for
+    range_start = None
+
+    def do_GET(self) -> None:
+        Handler.requests.append(dict(self.headers))
+        body = FILES.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+
+        etag = '"%i"' % hash(body)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        if self.headers.get('Range') and self.headers.get('If-Range') == etag:
+            start = int(self.headers['Range'][len("bytes="):-1])
+            if Handler.range_start is not None:
+                start = Handler.range_start
+            self.send_response(206)
+            self.send_header('Content-Range', "bytes %i-%i/%i" % (start, len(body) - 1, len(body)))
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+        self.wfile.write(body[start:])
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def test_downloads_are_conditional_and_resume(tmpdir) -> None:
+    server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        base_url = "http://127.0.0.1:%i/" % server.server_port
+        state = str(tmpdir.join('downloads.json'))
+        db = str(tmpdir.join('db.json'))
+        history = str(tmpdir.join('history.jsonl'))
+        files = [("live/db/db.json", db, True), ("live/db/history.jsonl", history, False)]
+
+        results = downloads.Downloader(base_url, state, workers=2).download(files)
+        assert results == {db: (downloads.DOWNLOADED, 1500), history: (downloads.MISSING, 0)}
+        assert tmpdir.join('db.json').read_binary() == FILES['/live/db/db.json']
+        assert not tmpdir.join('db.json.partial').exists()
+
+        # unchanged, so not downloaded again
+        results = downloads.Downloader(base_url, state).download(files[:1])
+        assert results == {db: (downloads.CURRENT, 0)}
+
+        # changed, and cut off part way through
+        FILES['/live/db/db.json'] = b'{"domains": []}' * 100
+        downloader = downloads.Downloader(base_url, state)
+        downloader.save_state(db, dict(downloader.state[db], partial={'etag': '"%i"' % hash(FILES['/live/db/db.json'])}))
+        tmpdir.join('db.json.partial').write_binary(FILES['/live/db/db.json'][:1000])
+
+        Handler.requests.clear()
+        results = downloads.Downloader(base_url, state).download(files[:1])
+        assert Handler.requests[0]['Range'] == "bytes=1000-"
+        assert results == {db: (downloads.RESUMED, 500)}
+        assert tmpdir.join('db.json').read_binary() == FILES['/live/db/db.json']
+        assert not tmpdir.join('db.json.partial').exists()
+
+        # sent the wrong part, so it starts over
+        FILES['/live/db/db.json'] = b'{"domains": {}}' * 100
+        downloader = downloads.Downloader(base_url, state)
+        downloader.save_state(db, dict(downloader.state[db], partial={'etag': '"%i"' % hash(FILES['/live/db/db.json'])}))
+        tmpdir.join('db.json.partial').write_binary(FILES['/live/db/db.json'][:1000])
+
+        Handler.requests.clear()
+        Handler.range_start = 500
+        results = downloads.Downloader(base_url, state).download(files[:1])
+        assert [request.get('Range') for request in Handler.requests] == ["bytes=1000-", None]
+        assert results == {db: (downloads.DOWNLOADED, 1500)}
+        assert tmpdir.join('db.json').read_binary() == FILES['/live/db/db.json']
+    finally:
+        Handler.range_start = None
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,13 @@
+from data import env
+
+
+def test_options_keep_values_as_given(monkeypatch) -> None:
+    monkeypatch.setattr(env.sys, 'argv', [
+        'update', '--Download-URL=http://Example.com/Bucket/?a=b', '--scan=here',
+        '--upload', '--cache=False', '--history=TRUE'
+    ])
+
+    assert env.options() == {
+        'download-url': 'http://Example.com/Bucket/?a=b', 'scan': 'here',
+        'upload': True, 'cache': False, 'history': True
+    }
@@ -0,0 +1,46 @@
+import ujson
+
+from data import metrics
+
+
+def test_stages_record_rows_time_and_memory(tmpdir) -> None:
+    stages = metrics.Stages()
+
+    with stages.stage("load") as stage:
+        rows = list(range(1000))
+        stage['rows_out'] = len(rows)
+
+    with stages.stage("filter", rows_in=len(rows)) as stage:
+        rows = [row for row in rows if row % 2]
+        stage['rows_out'] = len(rows)
+
+    path = str(tmpdir.join('metrics.json'))
+    stages.save(path, date="2018-01-01")
+    with open(path) as f:
+        saved = ujson.load(f)
+
+    assert saved['report_date'] == "2018-01-01"
+    assert [stage['name'] for stage in saved['stages']] == ["load", "filter"]
+    assert [(stage['rows_in'], stage['rows_out']) for stage in saved['stages']] == [(None, 1000), (1000, 500)]
+    for stage in saved['stages']:
+        assert stage['wall'] >= 0
+        assert stage['cpu'] >= 0
+        assert stage['peak_rss'] > 0
+        assert 'peak_traced' not in stage
+    assert saved['peak_rss'] == max(stage['peak_rss'] for stage in saved['stages'])
+
+
+def test_stages_trace_memory_per_stage() -> None:
+    stages = metrics.Stages(trace_memory=True)
+    try:
+        with stages.stage("allocate"):
+            kept = [bytes(1024) for i in range(1024)]
+        with stages.stage("nothing"):
+            pass
+    finally:
+        metrics.tracemalloc.stop()
+
+    allocate, nothing = stages.stages
+    assert allocate['peak_traced'] >= 1024 * 1024
+    assert nothing['peak_traced'] < 1024 * 1024
+    assert len(kept) == 1024
@@ -0,0 +1,348 @@
+import threading
+
+from app import models
+
+
+def domain(name, base, is_parent, https=None, analytics=None) -> dict:
+    record = {
+        'domain': name,
+        'base_domain': base,
+        'agency_slug': 'agency',
+        'is_parent': is_parent,
+    }
+    if https is not None:
+        record['https'] = https
+    if analytics is not None:
+        record['analytics'] = analytics
+    return record
+
+
+def build() -> models.ReadModel:
+    domains = [
+        domain('example.gov', 'example.gov', True,
+               https={'eligible': True, 'eligible_zone': True},
+               analytics={'eligible': True}),
+        domain('www.example.gov', 'example.gov', False, https={'eligible': True}),
+        domain('old.example.gov', 'example.gov', False, https={'eligible': False}),
+        domain('zone.gov', 'zone.gov', True,
+               https={'eligible': False, 'eligible_zone': True},
+               analytics=None),
+        domain('a.zone.gov', 'zone.gov', False, https={'eligible': True}),
+    ]
+    agencies = [
+        {'slug': 'agency', 'https': {'eligible': 3}, 'analytics': {'eligible': 0}},
+        {'slug': 'other', 'https': {'eligible': 0}},
+    ]
+    changes = [{
+        'report': 'https', 'report_date': '2018-01-01', 'since': '2017-12-31',
+        'rows': [['www.example.gov', 'agency', 'hsts', 2, 0, 'regressed'],
+                 ['a.zone.gov', 'agency', 'eligible', False, True, 'added']]
+    }]
+    return models.ReadModel(domains, agencies, [{'report_date': '2018-01-01'}], changes=changes)
+
+
+def test_read_model_lookups() -> None:
+    read_model = build()
+
+    assert read_model.domains_by_name['www.example.gov']['base_domain'] == 'example.gov'
+    assert read_model.domains_by_name.get('missing.gov') is None
+    assert read_model.agencies_by_slug['other']['slug'] == 'other'
+
+
+def test_read_model_eligibility() -> None:
+    read_model = build()
+
+    names = lambda domains: [d['domain'] for d in domains]
+
+    assert names(read_model.eligible_domains['https']) == [
+        'example.gov', 'www.example.gov', 'a.zone.gov'
+    ]
+    assert names(read_model.eligible_domains['analytics']) == ['example.gov']
+    assert names(read_model.eligible_parent_domains['https']) == ['example.gov', 'zone.gov']
+    assert 'analytics' not in read_model.eligible_parent_domains
+    assert names(read_model.eligible_hosts_by_base['https']['example.gov']) == [
+        'example.gov', 'www.example.gov'
+    ]
+    assert [a['slug'] for a in read_model.eligible_agencies['https']] == ['agency']
+    assert 'analytics' not in read_model.eligible_agencies
+
+
+def test_to_csv_rows_streams_in_chunks(monkeypatch) -> None:
+    monkeypatch.setattr(models, 'CSV_CHUNK_SIZE', 100)
+
+    domains = [
+        {
+            'domain': 'host%i.example.gov' % i,
+            'base_domain': 'example.gov',
+            'canonical': 'https://host%i.example.gov' % i,
+            'agency_name': 'Agency',
+            'sources': ['dap', 'censys'],
+            'https': {
+                'compliant': True, 'enforces': 3, 'hsts': 1, 'bod_crypto': -1,
+                '3des': None, 'rc4': False, 'sslv2': False, 'sslv3': False,
+                'preloaded': 0
+            }
+        }
+        for i in range(10)
+    ]
+
+    chunks = list(models.Domain.to_csv_rows(domains, 'https'))
+    assert len(chunks) > 2
+
+    lines = "".join(chunks).splitlines()
+    assert len(lines) == 11
+    assert lines[0].startswith('"Domain","Base Domain","URL"')
+    assert lines[1] == (
+        '"host0.example.gov","example.gov","https://host0.example.gov","Agency",'
+        '"dap, censys","Yes","Yes","No","","","No","No","No","No"'
+    )
+    assert models.Domain.to_csv(domains, 'https') == "".join(chunks)
+
+
+def test_sqlite_read_model_matches_json(tmpdir) -> None:
+    json_model = build()
+    path = str(tmpdir.join('db.sqlite'))
+    models.sqlite_load(json_model.domains, json_model.agencies, json_model.reports, changes=list(json_model.changes.values()), path=path)
+    sqlite_model = models.SqliteReadModel.read(path)
+
+    for read_model in (json_model, sqlite_model):
+        assert read_model.find_domain('www.example.gov')['base_domain'] == 'example.gov'
+        assert read_model.find_domain('missing.gov') is None
+        assert read_model.latest_report()['report_date'] == '2018-01-01'
+
+    for report_name in ('https', 'analytics', 'missing'):
+        assert sqlite_model.eligible(report_name) == json_model.eligible(report_name)
+        assert sqlite_model.eligible_parents(report_name) == json_model.eligible_parents(report_name)
+        assert sqlite_model.eligible_for_domain('example.gov', report_name) == \
+            json_model.eligible_for_domain('example.gov', report_name)
+        assert sqlite_model.knows_report(report_name) == json_model.knows_report(report_name)
+    assert sqlite_model.all_domains() == json_model.all_domains()
+    assert sqlite_model.changes_for('https') == json_model.changes_for('https')
+    assert sqlite_model.changes_for('analytics') is None
+    assert sqlite_model.eligible_agencies_for('https') == json_model.eligible_agencies_for('https')
+
+
+def test_tinydb_load_writes_what_tinydb_would(tmpdir) -> None:
+    from tinydb import TinyDB
+
+    json_model = build()
+    domains = [dict(domain) for domain in json_model.domains]
+    agencies = list(json_model.agencies)
+    reports = list(json_model.reports)
+    orders = models.Order.compute(domains)
+    changes = list(json_model.changes.values())
+
+    expected = TinyDB(str(tmpdir.join('expected.json')))
+    expected.purge_tables()
+    expected.table('domains').insert_multiple(domains)
+    expected.table('agencies').insert_multiple(agencies)
+    expected.table('reports').insert_multiple(reports)
+    expected.table('orders').insert_multiple(orders)
+    expected.table('changes').insert_multiple(changes)
+    expected.close()
+
+    path = tmpdir.join('db.json')
+    path.write('{"reports": {"1": {"report_date": "2017-01-01"}}}')
+    with open(str(path)) as old:
+        models.tinydb_load(domains, agencies, reports, changes=changes, path=str(path))
+
+        # Already-open readers keep reading the whole old file.
+        assert old.read() == '{"reports": {"1": {"report_date": "2017-01-01"}}}'
+
+    assert path.read() == tmpdir.join('expected.json').read()
+    assert not tmpdir.join('db.json.tmp').exists()
+
+    read_model = models.ReadModel.read(str(path))
+    assert read_model.all_domains() == json_model.all_domains()
+    assert read_model.changes_for('https') == json_model.changes_for('https')
+    assert read_model.eligible('https') == json_model.eligible('https')
+    assert read_model.latest_report() == json_model.latest_report()
+
+
+def test_tinydb_load_leaves_tinydb_usable(tmpdir, monkeypatch) -> None:
+    from tinydb import TinyDB
+
+    path = tmpdir.join('db.json')
+    path.write('{}')
+    monkeypatch.setattr(models, 'DB_PATH', str(path))
+    monkeypatch.setattr(models, 'db', TinyDB(str(path)))
+
+    models.tinydb_load([], [{'slug': 'agency'}], [])
+    # reopening it doesn't rewrite the file
+    assert '_default' not in path.read()
+
+    models.Agency.create({'slug': 'other'})
+    assert [agency['slug'] for agency in models.db.table('agencies').all()] == ['agency', 'other']
+    models.db.close()
+
+
+def test_listings_are_served_in_stored_order(tmpdir) -> None:
+    domains = [
+        domain('b.gov', 'b.gov', True, https={'eligible': True, 'eligible_zone': True}),
+        domain('www.a.gov', 'a.gov', False, https={'eligible': True}),
+        domain('a.gov', 'a.gov', True, https={'eligible': True, 'eligible_zone': True}),
+        domain('a.a.gov', 'a.gov', False, https={'eligible': True}),
+    ]
+    orders = models.Order.compute(domains)
+    assert orders == [{'report': 'https', 'hosts': [3, 2, 1, 0], 'parents': [2, 0]}]
+
+    path = str(tmpdir.join('db.sqlite'))
+    models.sqlite_load(domains, [], [], orders=orders, path=path)
+
+    names = lambda domains: [d['domain'] for d in domains]
+    for read_model in (models.ReadModel(domains, [], [], orders=orders), models.SqliteReadModel.read(path)):
+        assert names(read_model.eligible('https')) == ['a.a.gov', 'a.gov', 'www.a.gov', 'b.gov']
+        assert names(read_model.eligible_parents('https')) == ['a.gov', 'b.gov']
+        assert names(read_model.eligible_for_domain('a.gov', 'https')) == ['a.gov', 'a.a.gov', 'www.a.gov']
+
+
+def test_reload_swaps_in_new_data(tmpdir, monkeypatch) -> None:
+    path = tmpdir.join('db.json')
+    path.write('{"reports": {"1": {"report_date": "2018-01-01"}}}')
+    monkeypatch.setattr(models, 'DB_PATH', str(path))
+    monkeypatch.setattr(models, '_read_model', models.ReadModel.read(str(path)))
+
+    models.pin()
+    try:
+        path.write('{"reports": {"1": {"report_date": "2018-01-02", "https": {}}}}')
+        assert models.generation_of(str(path)) != models.read_model().generation
+
+        models._reload_lock.acquire()
+        models.reload()
+
+        # The pinned read model doesn't change underneath a request.
+        assert models.Report.latest()['report_date'] == '2018-01-01'
+    finally:
+        models.unpin()
+
+    assert models.Report.latest()['report_date'] == '2018-01-02'
+
+
+def test_pinned_request_keeps_its_data_while_another_sees_new(monkeypatch) -> None:
+    old = models.ReadModel([], [], [{'report_date': '2018-01-01'}], generation='old')
+    new = models.ReadModel([], [], [{'report_date': '2018-01-02'}], generation='new')
+    monkeypatch.setattr(models, '_read_model', old)
+
+    pinned, swapped, seen = threading.Event(), threading.Event(), []
+
+    def request() -> None:
+        models.pin()
+        try:
+            pinned.set()
+            swapped.wait(5)
+            seen.append((models.read_model().generation, models.Report.latest()['report_date']))
+        finally:
+            models.unpin()
+
+    thread = threading.Thread(target=request)
+    thread.start()
+    assert pinned.wait(5)
+
+    # new data is swapped in while that request is still going
+    models._read_model = new
+    models.pin()
+    try:
+        assert models.read_model().generation == 'new'
+        assert models.Report.latest()['report_date'] == '2018-01-02'
+    finally:
+        models.unpin()
+
+    swapped.set()
+    thread.join(5)
+    assert seen == [('old', '2018-01-01')]
+
+
+def test_slow_export_only_holds_up_requests_for_it() -> None:
+    read_model = build()
+    rendering, release = threading.Event(), threading.Event()
+
+    def slow() -> str:
+        rendering.set()
+        release.wait(5)
+        return "slow"
+
+    thread = threading.Thread(target=read_model.export, args=(('slow',), slow))
+    thread.start()
+    try:
+        assert rendering.wait(5)
+        # another export can be rendered while that one still is
+        assert read_model.export(('fast',), lambda: "fast").body == b"fast"
+    finally:
+        release.set()
+        thread.join(5)
+
+    assert read_model.exports[('slow',)].body == b"slow"
+    assert read_model.export_locks == {}
+
+
+def test_reload_keeps_data_when_file_is_bad(tmpdir, monkeypatch) -> None:
+    path = tmpdir.join('db.json')
+    path.write('{"reports": {"1": {"report_date": "2018-01-01"}}}')
+    monkeypatch.setattr(models, 'DB_PATH', str(path))
+    monkeypatch.setattr(models, '_read_model', models.ReadModel.read(str(path)))
+
+    path.write('{"reports": {"1": {"report_da')
+    models._reload_lock.acquire()
+    models.reload()
+
+    assert models.Report.latest()['report_date'] == '2018-01-01'
+    assert not models._reload_lock.locked()
+
+
+def test_history_answers_range_queries(tmpdir) -> None:
+    from data import processing
+
+    path = str(tmpdir.join('history.jsonl'))
+    agencies = {'agency': {'slug': 'agency', 'https': {'eligible': 2, 'uses': 1}}}
+    for date, uses in [('2018-01-02', 2), ('2018-01-01', 1), ('2018-01-03', 3), ('2018-01-02', 4)]:
+        processing.append_history(path, date, {'https': {'eligible': 10, 'uses': uses}}, agencies)
+
+    # still being written
+    with open(path, 'a') as f:
+        f.write('{"report_date":"2018-01-04","rep')
+
+    history = models.History.read(path)
+    assert history.dates == ['2018-01-01', '2018-01-02', '2018-01-03']
+
+    uses = lambda series: [(day['report_date'], day['uses']) for day in series]
+    assert uses(history.report('https')) == [('2018-01-01', 1), ('2018-01-02', 4), ('2018-01-03', 3)]
+    assert uses(history.report('https', start='2018-01-02')) == [('2018-01-02', 4), ('2018-01-03', 3)]
+    assert uses(history.report('https', start='2018-01-02', end='2018-01-02')) == [('2018-01-02', 4)]
+    assert uses(history.report('https', end='2017-12-31')) == []
+    assert uses(history.report('https', agency='agency', end='2018-01-01')) == [('2018-01-01', 1)]
+    assert history.report('https', agency='missing') == []
+    assert history.report('analytics') == []
+
+    assert models.History.read(str(tmpdir.join('missing.jsonl'))).report('https') == []
+
+
+def test_change_rows_and_csv(monkeypatch) -> None:
+    monkeypatch.setattr(models, '_read_model', build())
+    change = models.Change.latest('https')
+
+    assert models.Change.rows(change, kind='regressed') == [{
+        'domain': 'www.example.gov', 'agency_slug': 'agency', 'field': 'hsts',
+        'before': 2, 'after': 0, 'change': 'regressed'
+    }]
+    assert models.Change.rows(change, agency='other') == []
+
+    csv = "".join(models.Change.to_csv_rows(models.Change.rows(change), 'https'))
+    assert csv.splitlines() == [
+        '"Domain","Agency","Field","Before","After","Change"',
+        '"www.example.gov","agency","Strict Transport Security (HSTS)","Yes","No","regressed"',
+        '"a.zone.gov","agency","Eligible","No","Yes","added"',
+    ]
+
+
+def test_change_csv_uses_the_read_model_it_was_asked_from(monkeypatch) -> None:
+    monkeypatch.setattr(models, '_read_model', build())
+    models.pin()
+    rows = models.Change.rows(models.Change.latest('https'))
+    chunks = models.Change.to_csv_rows(rows, 'https')
+    models.unpin()
+
+    # new data, loaded while the CSV is streamed
+    monkeypatch.setattr(models, '_read_model', models.ReadModel([], [{'slug': 'agency', 'name': 'Renamed'}], []))
+    csv = "".join(chunks)
+    assert "Renamed" not in csv
+    assert '"www.example.gov","agency",' in csv
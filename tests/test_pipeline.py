@@ -0,0 +1,55 @@
+import threading
+
+import pytest
+
+from data import pipeline
+
+
+def test_pipeline_runs_independent_stages_together_and_resumes(tmpdir) -> None:
+    path = str(tmpdir.join('checkpoint.json'))
+    # only passes if both scans are running at once
+    both_scanning = threading.Barrier(2, timeout=5)
+    ran = []
+
+    def stage(name, result=None, fail=False):
+        def run(results):
+            ran.append(name)
+            if name.startswith("scan"):
+                both_scanning.wait()
+            if fail:
+                raise RuntimeError(name)
+            return result
+        return run
+
+    update = pipeline.Pipeline(path, options={'scan': 'here'})
+    update.stage("scan_subdomains", stage("scan_subdomains"))
+    update.stage("scan_parents", stage("scan_parents"))
+    update.stage("process", stage("process", result="2018-01-01"), after=["scan_subdomains", "scan_parents"])
+    update.stage("upload", stage("upload", fail=True), after=["process"])
+    with pytest.raises(RuntimeError):
+        update.run()
+    assert sorted(ran[:2]) == ["scan_parents", "scan_subdomains"]
+    assert ran[2:] == ["process", "upload"]
+
+    # won't resume a run with different options
+    with pytest.raises(ValueError):
+        pipeline.Pipeline(path, resume=True, options={'scan': 'download'})
+
+    # picks up at the upload, with what processing returned
+    ran.clear()
+    update = pipeline.Pipeline(path, resume=True, options={'scan': 'here'})
+    update.stage("scan_subdomains", stage("scan_subdomains"))
+    update.stage("scan_parents", stage("scan_parents"))
+    update.stage("process", stage("process"), after=["scan_subdomains", "scan_parents"])
+    update.stage("upload", lambda results: ran.append(results["process"]), after=["process"])
+    update.run()
+    assert ran == ["2018-01-01"]
+
+    checkpoint = pipeline.load_checkpoint(path)
+    assert checkpoint['finished'] is not None
+    assert [checkpoint['stages'][name]['status'] for name in update.stages] == ["done"] * 4
+    assert all(checkpoint['stages'][name]['seconds'] >= 0 for name in update.stages)
+
+    # and there's nothing left to resume
+    update = pipeline.Pipeline(path, resume=True)
+    assert update.checkpoint['stages'] == {}
@@ -0,0 +1,319 @@
+import random
+
+import pytest
+
+from data import processing
+
+
+def test_scan_rows_keep_only_needed_columns(tmpdir) -> None:
+    path = tmpdir.join('sslyze.csv')
+    path.write(
+        'Domain,Base Domain,Scanned Hostname,SSLv2,SSLv3,Any RC4,Errors\n'
+        'a.gov,a.gov,a.gov,False,True,False,\n'
+    )
+
+    rows = list(processing.scan_rows(str(path), processing.SslyzeRow))
+    assert len(rows) == 1
+    assert tuple(rows[0]) == ('a.gov', 'False', 'True', 'False', None)
+    assert rows[0]['SSLv3'] == 'True'
+    # "Any 3DES" is optional, and missing here.
+    assert rows[0].get('Any 3DES') is None
+    assert rows[0].get('Errors') is None
+
+
+def test_scan_rows_read_like_dict_reader(tmpdir) -> None:
+    path = tmpdir.join('analytics.csv')
+    path.write(
+        'Domain,Participates in Analytics,Participates in Analytics\n'
+        'a.gov,False,True\n'
+        '\n'
+        'b.gov,True,False\n'
+    )
+
+    # blank lines are skipped, and a repeated column is read from the last one
+    rows = list(processing.scan_rows(str(path), processing.AnalyticsRow))
+    assert [tuple(row) for row in rows] == [('a.gov', 'True'), ('b.gov', 'False')]
+
+
+def test_scan_rows_require_columns(tmpdir) -> None:
+    path = tmpdir.join('analytics.csv')
+    path.write('Domain,Base Domain\na.gov,a.gov\n')
+
+    with pytest.raises(SystemExit):
+        list(processing.scan_rows(str(path), processing.AnalyticsRow))
+
+
+def scan(name, base, **fields) -> dict:
+    pshtt = {column: 'False' for column in processing.PshttRow.COLUMNS}
+    pshtt.update({'Domain': name, 'Base Domain': base, 'Live': 'True', 'HSTS Max Age': ''})
+    pshtt.update(fields)
+    return {'pshtt': pshtt}
+
+
+def inputs() -> tuple:
+    domains, subdomains, parent_scan_data, subdomain_scan_data = {}, {}, {}, {}
+    for i in range(12):
+        parent = 'agency%i.gov' % i
+        domains[parent] = {
+            'domain': parent, 'base_domain': parent, 'branch': 'executive',
+            'agency_slug': 'agency%i' % (i % 2),
+            'live': i % 3 != 0, 'redirect': False, 'exclude': {'analytics': False},
+        }
+        parent_scan_data[parent] = scan(parent, parent, **{'Valid HTTPS': 'True'})
+        parent_scan_data[parent]['analytics'] = {'Participates in Analytics': 'True'}
+        for j in range(i % 4):
+            name = 'www%i.%s' % (j, parent)
+            subdomains[name] = {
+                'domain': name, 'base_domain': parent, 'branch': 'executive',
+                'agency_slug': 'agency%i' % (i % 2),
+                'live': True, 'redirect': j == 2,
+            }
+            parent_scan_data[parent].setdefault('subdomains', []).append(name)
+            subdomain_scan_data[name] = scan(name, parent, **{'HSTS Preloaded': 'True'})
+    return domains, subdomains, parent_scan_data, subdomain_scan_data
+
+
+def test_process_domains_in_parallel_matches_serial() -> None:
+    serial = inputs()
+    processing.process_domains(serial[0], {}, serial[1], serial[2], serial[3], workers=1)
+    parallel = inputs()
+    processing.process_domains(parallel[0], {}, parallel[1], parallel[2], parallel[3], workers=3)
+
+    assert parallel[0] == serial[0]
+    assert parallel[1] == serial[1]
+    assert [list(domain) for domain in parallel[0].values()] == \
+        [list(domain) for domain in serial[0].values()]
+    assert 'totals' in serial[0]['agency1.gov']
+
+
+def https_report(**fields) -> dict:
+    report = {
+        'eligible': True, 'uses': 1, 'enforces': 2, 'hsts': 0,
+        'preloaded': 0, 'm1513': False, 'compliant': False,
+        'rc4': None, '3des': None, 'sslv2': None, 'sslv3': None, 'bod_crypto': None,
+    }
+    report.update(fields)
+    return report
+
+
+def test_update_totals() -> None:
+    agencies = {'a': {'slug': 'a'}, 'b': {'slug': 'b'}, 'c': {'slug': 'c'}}
+    domains = {
+        'a.gov': {'agency_slug': 'a', 'https': https_report(preloaded=2, rc4=False, sslv2=False, sslv3=False, bod_crypto=1),
+                  'analytics': {'eligible': True, 'participating': True}},
+        'b.gov': {'agency_slug': 'b', 'https': {'eligible': False, 'preloaded': 1}},
+    }
+    subdomains = {
+        'www.a.gov': {'agency_slug': 'a', 'https': https_report(hsts=2, rc4=True, sslv2=False, sslv3=False, bod_crypto=0)},
+        'www.b.gov': {'agency_slug': 'b'},
+    }
+
+    full = processing.update_totals(agencies, domains, subdomains)
+
+    assert full['https'] == {
+        'eligible': 2, 'uses': 2, 'enforces': 2, 'hsts': 1, 'm1513': 0, 'compliant': 0
+    }
+    assert full['crypto'] == {
+        'eligible': 2, 'bod_crypto': 1, 'rc4': 1, '3des': 0, 'sslv2': 0, 'sslv3': 0
+    }
+    assert full['preloading'] == {'eligible': 2, 'preloaded': 1, 'preload_ready': 1}
+    assert full['analytics'] == {'eligible': 1, 'participating': 1}
+
+    assert agencies['a']['https']['eligible'] == 2
+    assert agencies['b']['https']['eligible'] == 0
+    assert agencies['b']['preloading'] == {'eligible': 1, 'preloaded': 0, 'preload_ready': 1}
+    assert agencies['c']['analytics'] == {'eligible': 0, 'participating': 0}
+    assert list(agencies['a']) == ['slug', 'https', 'crypto', 'preloading', 'analytics']
+
+
+def test_compute_changes() -> None:
+    def host(name, https=None, analytics=None):
+        record = {'domain': name, 'agency_slug': 'a'}
+        if https is not None:
+            record['https'] = https
+        if analytics is not None:
+            record['analytics'] = analytics
+        return record
+
+    before = [
+        host('a.gov', https=https_report(hsts=2, rc4=False, sslv2=False, sslv3=False, bod_crypto=1),
+             analytics={'eligible': True, 'participating': False}),
+        host('gone.a.gov', https=https_report(hsts=2, rc4=False, sslv2=False, sslv3=False, bod_crypto=1)),
+        host('same.a.gov', https=https_report(hsts=0, rc4=True, sslv2=False, sslv3=False, bod_crypto=0)),
+    ]
+    after = [
+        host('a.gov', https=https_report(hsts=0, rc4=True, sslv2=False, sslv3=False, bod_crypto=1),
+             analytics={'eligible': True, 'participating': True}),
+        host('gone.a.gov', https={'eligible': False}),
+        host('same.a.gov', https=https_report(hsts=0, rc4=True, sslv2=False, sslv3=False, bod_crypto=0)),
+        host('new.a.gov', https=https_report(hsts=2, rc4=False, sslv2=False, sslv3=False, bod_crypto=1)),
+    ]
+
+    previous = {record['domain']: processing.host_codes(record) for record in before}
+    https, analytics = processing.compute_changes(previous, '2018-01-01', after, '2018-01-02')
+
+    assert (https['report'], https['since'], https['report_date']) == ('https', '2018-01-01', '2018-01-02')
+    assert https['rows'] == [
+        ['a.gov', 'a', 'hsts', 2, 0, 'regressed'],
+        ['a.gov', 'a', 'rc4', False, True, 'regressed'],
+        ['gone.a.gov', 'a', 'eligible', True, False, 'removed'],
+        ['new.a.gov', 'a', 'eligible', False, True, 'added'],
+    ]
+    assert analytics['rows'] == [['a.gov', 'a', 'participating', False, True, 'improved']]
+
+    # nothing to compare with
+    assert processing.compute_changes({}, None, after, '2018-01-02') == []
+
+
+def test_https_batch_matches_https_behavior_for() -> None:
+    pytest.importorskip('numpy')
+    rng = random.Random(0)
+
+    hosts, groups = [], []
+    for i in range(500):
+        pshtt = {column: rng.choice(['True', 'False', '']) for column in processing.HttpsBatch.PSHTT_COLUMNS}
+        pshtt['HSTS Max Age'] = rng.choice(['', '0', '86400', '31536000', '63072000'])
+        if rng.random() < 0.3:
+            sslyze = None
+        else:
+            sslyze = {column: rng.choice(['True', 'False', '', None]) for column in processing.HttpsBatch.SSLYZE_COLUMNS}
+        hosts.append(('host%i.gov' % i, pshtt, sslyze, rng.choice([None, 0, 2])))
+        groups.append(rng.randrange(20))
+
+    batch = processing.HttpsBatch(hosts, groups, 20)
+
+    reports = [processing.https_behavior_for(*host) for host in hosts]
+    assert batch.reports() == reports
+    assert [list(report) for report in batch.reports()] == [list(report) for report in reports]
+
+    for group, (https, crypto) in enumerate(zip(batch.total_https(), batch.total_crypto())):
+        mine = [report for report, g in zip(reports, groups) if g == group]
+        assert https == processing.total_https_report(mine)
+        assert crypto == processing.total_crypto_report([report for report in mine if report['rc4'] is not None])
+
+
+def test_incremental_processing_matches_full(tmpdir) -> None:
+    path = str(tmpdir.join('state.json'))
+
+    def full(data: tuple) -> tuple:
+        domains, subdomains, parent_scan_data, subdomain_scan_data = data
+        agencies = {'agency0': {'slug': 'agency0'}, 'agency1': {'slug': 'agency1'}}
+        processing.process_domains(domains, agencies, subdomains, parent_scan_data, subdomain_scan_data)
+        totals = processing.update_totals(agencies, domains, subdomains)
+        return domains, subdomains, agencies, totals
+
+    def incremental(data: tuple) -> tuple:
+        domains, subdomains, parent_scan_data, subdomain_scan_data = data
+        agencies = {'agency0': {'slug': 'agency0'}, 'agency1': {'slug': 'agency1'}}
+        fingerprints = processing.zone_fingerprints(domains, subdomains, parent_scan_data, subdomain_scan_data)
+        state = processing.load_state(path)
+        changed = processing.restore_zones(domains, subdomains, state, fingerprints)
+        processing.process_domains(domains, agencies, subdomains, parent_scan_data, subdomain_scan_data, names=changed)
+        zones = {
+            name: processing.zone_results(name, domains, subdomains, parent_scan_data, fingerprints, state)
+            for name in domains
+        }
+        totals = processing.update_totals_incrementally(agencies, zones, state)
+        processing.save_state(path, zones, agencies, totals)
+        return domains, subdomains, agencies, totals, changed
+
+    def changed_inputs() -> tuple:
+        data = inputs()
+        domains, subdomains, parent_scan_data, subdomain_scan_data = data
+        subdomain_scan_data['www1.agency2.gov']['pshtt']['HSTS Preloaded'] = 'False'
+        parent_scan_data['agency5.gov']['pshtt']['Valid HTTPS'] = 'False'
+        domains['agency6.gov']['live'] = True
+        del domains['agency10.gov']
+        return data
+
+    first = incremental(inputs())
+    assert first[:4] == full(inputs())
+    assert len(first[4]) == 12
+
+    # Nothing changed.
+    second = incremental(inputs())
+    assert second[:4] == full(inputs())
+    assert second[4] == []
+
+    third = incremental(changed_inputs())
+    assert third[:4] == full(changed_inputs())
+    assert sorted(third[4]) == ['agency2.gov', 'agency5.gov', 'agency6.gov']
+
+
+def test_parsed_cache_follows_inputs(tmpdir, monkeypatch) -> None:
+    monkeypatch.setattr(processing, 'PARENT_DOMAINS_CSV', str(tmpdir.join('domains.csv')))
+    monkeypatch.setattr(processing, 'SUBDOMAIN_DOMAINS_CSV', str(tmpdir.join('gathered.csv')))
+    monkeypatch.setattr(processing, 'PARENT_RESULTS', str(tmpdir.join('parents')))
+    monkeypatch.setattr(processing, 'SUBDOMAIN_DATA_SCANNED', str(tmpdir.join('subdomains')))
+    monkeypatch.setattr(processing, 'PARSED_CACHE', str(tmpdir.join('cache')))
+    tmpdir.join('domains.csv').write('Domain Name\na.gov\n')
+    tmpdir.join('parents', 'pshtt.csv').write('Domain\na.gov\n', ensure=True)
+
+    key = processing.parsed_cache_key()
+    assert processing.parsed_cache_key() == key
+    assert processing.read_parsed_cache(key) is None
+
+    processing.write_parsed_cache(key, ({'a.gov': {}}, {}, {}, {}, {}))
+    assert processing.read_parsed_cache(key) == ({'a.gov': {}}, {}, {}, {}, {})
+
+    # Any change to an input, or a new one, makes for a new key.
+    tmpdir.join('parents', 'pshtt.csv').write('Domain\nb.gov\n')
+    changed = processing.parsed_cache_key()
+    assert changed != key
+    tmpdir.join('parents', 'analytics.csv').write('Domain\n')
+    assert processing.parsed_cache_key() not in (key, changed)
+
+    # Only the latest is kept.
+    processing.write_parsed_cache(changed, ({}, {}, {}, {}, {}))
+    assert processing.read_parsed_cache(key) is None
+    assert len(tmpdir.join('cache').listdir()) == 1
+
+
+def test_merge_join_matches_hash_join(tmpdir, monkeypatch) -> None:
+    monkeypatch.setattr(processing, 'SUBDOMAIN_DOMAINS_CSV', str(tmpdir.join('gathered.csv')))
+    monkeypatch.setattr(processing, 'SUBDOMAIN_DATA_SCANNED', str(tmpdir))
+    others = ',False' * (len(processing.GATHERER_NAMES) - 1)
+    tmpdir.join('gathered.csv').write(
+        'Domain,Base Domain,%s\n' % ','.join(processing.GATHERER_NAMES) +
+        ''.join('%s,a.gov,True%s\n' % (name, others) for name in
+                ['api.a.gov', 'api.a.gov', 'b.c.gov', 'old.a.gov', 'www.a.gov'])
+    )
+    columns = processing.PshttRow.COLUMNS
+    pshtt = ','.join(columns) + '\n'
+    for name, base, live in [('api.a.gov', 'a.gov', 'True'), ('api.a.gov', 'a.gov', 'False'),
+                             ('b.c.gov', 'c.gov', 'True'), ('new.a.gov', 'a.gov', 'True'),
+                             ('www.a.gov', 'a.gov', 'True')]:
+        row = dict.fromkeys(columns, 'False')
+        row.update({'Domain': name, 'Base Domain': base, 'Live': live})
+        pshtt += ','.join(row[column] for column in columns) + '\n'
+    tmpdir.join('results', 'pshtt.csv').write(pshtt, ensure=True)
+    tmpdir.join('results', 'sslyze.csv').write(
+        'Domain,SSLv2,SSLv3,Any RC4,Any 3DES\n'
+        'api.a.gov,,,,\n'
+        'new.a.gov,False,False,False,False\n'
+        'www.a.gov,False,True,False,False\n'
+        'www.a.gov,False,False,False,False\n'
+    )
+
+    def domains() -> dict:
+        return {
+            'a.gov': {'branch': 'executive', 'agency_slug': 'a', 'agency_name': 'A'},
+            'c.gov': {'branch': 'legislative', 'agency_slug': 'c', 'agency_name': 'C'},
+        }
+
+    hashed_parents = {'a.gov': {}, 'c.gov': {}}
+    hashed = processing.load_subdomain_scan_data(domains(), hashed_parents, processing.gathered_subdomain_map())
+    merged_parents = {'a.gov': {}, 'c.gov': {}}
+    merged = processing.merge_subdomain_scan_data(domains(), merged_parents)
+
+    assert merged == hashed
+    assert merged_parents == hashed_parents == {'a.gov': {'subdomains': ['api.a.gov', 'www.a.gov']}, 'c.gov': {}}
+    assert merged[1]['www.a.gov']['sslyze']['SSLv3'] == 'False'
+
+    tmpdir.join('results', 'sslyze.csv').write(
+        'Domain,SSLv2,SSLv3,Any RC4,Any 3DES\n'
+        'www.a.gov,False,False,False,False\n'
+        'api.a.gov,False,False,False,False\n'
+    )
+    with pytest.raises(processing.UnsortedInput):
+        processing.merge_subdomain_scan_data(domains(), {'a.gov': {}, 'c.gov': {}})
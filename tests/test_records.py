@@ -0,0 +1,46 @@
+import ujson
+
+from app import records
+
+
+def record() -> dict:
+    return {
+        'domain': 'www.example.gov',
+        'sources': ['dap', 'censys'],
+        'is_parent': False,
+        'https': {'eligible': True, 'uses': 2},
+        'totals': {'https': {'eligible': 3}},
+    }
+
+
+def test_compact_records_read_like_dicts() -> None:
+    compact = records.compact_all([record(), record()])
+
+    assert compact[0]['https']['uses'] == 2
+    assert compact[0].get('missing') is None
+    assert 'sources' in compact[0]
+    assert list(compact[0].keys()) == list(record().keys())
+    assert compact[0]['sources'] == ('dap', 'censys')
+    assert list(compact[0].values())[0] == 'www.example.gov'
+    assert dict(compact[0].items())['is_parent'] is False
+    assert dict(compact[0]['https'].items()) == record()['https']
+
+    # Shapes and repeated strings are shared.
+    assert compact[0].shape is compact[1].shape
+    assert compact[0]['domain'] is compact[1]['domain']
+
+
+def test_compact_records_serialize_unchanged() -> None:
+    compact = records.compact_all([record()])[0]
+
+    assert records.plain(compact) == record()
+    assert ujson.loads(ujson.dumps({'data': [compact]})) == {'data': [record()]}
+
+
+def test_memory_report(tmpdir) -> None:
+    path = tmpdir.join('db.json')
+    path.write(ujson.dumps({'domains': {str(i): record() for i in range(100)}}))
+
+    report = records.memory_report(str(path))
+    assert report['records'] == 100
+    assert report['record_bytes'] < report['dict_bytes']
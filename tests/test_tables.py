@@ -0,0 +1,78 @@
+from app import models
+from app import tables
+
+
+def hosts() -> tuple:
+    return tuple(
+        {'domain': name, 'agency_name': agency, 'https': {'hsts': hsts}}
+        for name, agency, hsts in [
+            ('a.example.gov', 'Agency One', 2),
+            ('b.example.gov', 'Agency Two', None),
+            ('c.example.gov', 'Agency One', 0),
+            ('d.example.gov', 'Agency Two', 3),
+        ]
+    )
+
+
+def args(**extra) -> dict:
+    base = {
+        'draw': '7',
+        'columns[0][data]': 'domain',
+        'columns[1][data]': 'agency_name',
+        'columns[2][data]': 'https.hsts',
+        'columns[2][searchable]': 'false',
+    }
+    base.update(extra)
+    return base
+
+
+def test_page_in_natural_order() -> None:
+    query = tables.query_for(args(start='1', length='2'))
+    page = tables.page(models.ReadModel([], [], []), ('hosts', 'https'), hosts(), query)
+
+    assert page['draw'] == 7
+    assert page['recordsTotal'] == page['recordsFiltered'] == 4
+    assert [host['domain'] for host in page['data']] == ['b.example.gov', 'c.example.gov']
+
+
+def test_page_sorted_and_searched() -> None:
+    read_model = models.ReadModel([], [], [])
+    query = tables.query_for(args(**{
+        'order[0][column]': '2', 'order[0][dir]': 'desc', 'search[value]': 'two'
+    }))
+    page = tables.page(read_model, ('hosts', 'https'), hosts(), query)
+
+    assert page['recordsTotal'] == 4
+    assert page['recordsFiltered'] == 2
+    # missing values sort first, so last when descending
+    assert [host['domain'] for host in page['data']] == ['d.example.gov', 'b.example.gov']
+    assert ('hosts', 'https', 'order', 'https.hsts', True) in read_model.memos
+
+
+def test_only_known_sort_orders_are_kept() -> None:
+    read_model = models.ReadModel([], [], [])
+    query = tables.query_for(args(**{
+        'columns[3][data]': 'bogus', 'order[0][column]': '3'
+    }))
+    page = tables.page(read_model, ('hosts', 'https'), hosts(), query)
+
+    assert page['recordsFiltered'] == 4
+    assert read_model.memos == {}
+
+
+def test_search_skips_missing_values() -> None:
+    query = tables.query_for(args(**{
+        'columns[2][searchable]': 'true', 'search[value]': 'none'
+    }))
+    page = tables.page(models.ReadModel([], [], []), ('hosts', 'https'), hosts(), query)
+
+    assert page['recordsFiltered'] == 0
+
+
+def test_query_rejects_bad_columns() -> None:
+    try:
+        tables.query_for(args(**{'order[0][column]': '9'}))
+    except ValueError:
+        pass
+    else:
+        assert False, "expected a ValueError"
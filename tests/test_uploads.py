@@ -0,0 +1,58 @@
+import hashlib
+
+from data import uploads
+
+
+def test_local_etag_matches_s3(tmpdir) -> None:
+    path = tmpdir.join('data')
+    path.write_binary(b"a" * 10)
+    assert uploads.local_etag(str(path)) == hashlib.md5(b"a" * 10).hexdigest()
+
+    # uploaded in parts, it's the MD5 of the parts' MD5s, and how many
+    parts = [hashlib.md5(b"a" * 4).digest()] * 2 + [hashlib.md5(b"a" * 2).digest()]
+    expected = "%s-3" % hashlib.md5(b"".join(parts)).hexdigest()
+    assert uploads.local_etag(str(path), part_size=4) == expected
+
+    # exactly a multiple of the part size leaves no empty part at the end
+    path.write_binary(b"a" * 8)
+    parts = [hashlib.md5(b"a" * 4).digest()] * 2
+    assert uploads.local_etag(str(path), part_size=4) == "%s-2" % hashlib.md5(b"".join(parts)).hexdigest()
+
+    # a file of exactly one part is still uploaded in parts
+    path.write_binary(b"a" * 4)
+    parts = [hashlib.md5(b"a" * 4).digest()]
+    assert uploads.local_etag(str(path), part_size=4) == "%s-1" % hashlib.md5(b"".join(parts)).hexdigest()
+
+    # and an empty file is one empty part
+    path.write_binary(b"")
+    assert uploads.local_etag(str(path)) == hashlib.md5(b"").hexdigest()
+
+
+def test_plan_skips_unchanged_files_and_deletes_missing_ones(tmpdir) -> None:
+    tmpdir.join('results', 'pshtt.csv').write("Domain\nexample.gov\n", ensure=True)
+    tmpdir.join('results', 'meta.json').write("{}", ensure=True)
+    tmpdir.join('cache', 'example.gov.json').write("[]", ensure=True)
+
+    files = uploads.local_files(str(tmpdir), "live/parents/")
+    assert [key for path, key in files] == [
+        "live/parents/cache/example.gov.json",
+        "live/parents/results/meta.json",
+        "live/parents/results/pshtt.csv",
+    ]
+
+    remote = {
+        "live/parents/results/meta.json": hashlib.md5(b"{}").hexdigest(),
+        "live/parents/results/pshtt.csv": hashlib.md5(b"Domain\n").hexdigest(),
+        "live/parents/results/old.csv": hashlib.md5(b"").hexdigest(),
+        "live/db/db.json": hashlib.md5(b"{}").hexdigest(),
+    }
+    upload, delete = uploads.plan(files, remote, prefix="live/parents/")
+    assert [key for path, key in upload] == [
+        "live/parents/cache/example.gov.json",
+        "live/parents/results/pshtt.csv",
+    ]
+    assert delete == ["live/parents/results/old.csv"]
+
+    # a single file, to a key, never deletes anything
+    db = str(tmpdir.join('results', 'meta.json'))
+    assert uploads.plan([(db, "live/db/db.json")], remote) == ([], [])
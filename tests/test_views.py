@@ -0,0 +1,159 @@
+import flask
+import jinja2
+from flask import Flask
+
+from app import helpers
+from app import models
+from app import views
+
+
+def host(i) -> dict:
+    return {
+        'domain': 'host%i.example.gov' % i,
+        'base_domain': 'example.gov',
+        'canonical': 'https://host%i.example.gov' % i,
+        'agency_slug': 'agency',
+        'agency_name': 'Agency',
+        'is_parent': i == 0,
+        'sources': ['dap'],
+        'https': {
+            'eligible': True, 'eligible_zone': True,
+            'compliant': True, 'enforces': 3, 'hsts': 1, 'bod_crypto': -1,
+            '3des': None, 'rc4': False, 'sslv2': False, 'sslv3': False,
+            'preloaded': 0
+        }
+    }
+
+
+# A test client for the data endpoints, serving a small read model. Each
+# time a CSV is rendered, its report's name is added to `rendered`.
+def client(monkeypatch, rendered):
+    read_model = models.ReadModel(
+        [host(i) for i in range(200)],
+        [{'slug': 'agency', 'name': 'Agency', 'https': {'eligible': 200}}],
+        [{'report_date': '2018-01-01', 'https': {'eligible': 200}}]
+    )
+    monkeypatch.setattr(models, '_read_model', read_model)
+    monkeypatch.setattr(models, 'check_for_updates', lambda: None)
+
+    to_csv_rows = models.Domain.to_csv_rows
+    def counted(domains, report_name):
+        rendered.append(report_name)
+        return to_csv_rows(domains, report_name)
+    monkeypatch.setattr(models.Domain, 'to_csv_rows', counted)
+
+    app = Flask(__name__)
+    app.jinja_loader = jinja2.DictLoader({'404.html': 'Not found'})
+    views.register(app)
+    return app.test_client()
+
+
+def test_uncompressed_csv_is_streamed(monkeypatch) -> None:
+    rendered = []
+    response = client(monkeypatch, rendered).get('/data/hosts/https.csv')
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert 'Content-Length' not in response.headers
+    assert response.get_data(as_text=True).count("\n") == 201
+    assert response.headers['ETag']
+
+
+def test_not_modified_without_rendering(monkeypatch) -> None:
+    rendered = []
+    test_client = client(monkeypatch, rendered)
+    etag = test_client.get('/data/hosts/https.csv').headers['ETag']
+    rendered.clear()
+
+    response = test_client.get('/data/hosts/https.csv', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert rendered == []
+
+
+def test_exports_have_strong_etags_per_encoding(monkeypatch) -> None:
+    test_client = client(monkeypatch, [])
+
+    plain = test_client.get('/data/reports/https.json')
+    assert plain.status_code == 200
+    assert not plain.headers['ETag'].startswith('W/')
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    gzipped = test_client.get('/data/reports/https.json', headers={'Accept-Encoding': 'gzip'})
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzipped.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+
+    for response in (plain, gzipped):
+        again = test_client.get('/data/reports/https.json', headers={
+            'If-None-Match': response.headers['ETag'],
+            'Accept-Encoding': response.headers.get('Content-Encoding', 'identity')
+        })
+        assert again.status_code == 304
+        assert again.get_data() == b''
+
+
+def test_only_real_reports_and_domains_are_kept(monkeypatch) -> None:
+    test_client = client(monkeypatch, [])
+    exports = models.read_model().exports
+
+    assert test_client.get('/data/hosts/https.json').status_code == 200
+    assert test_client.get('/data/hosts/example.gov/https.json').status_code == 200
+    assert ('hosts', 'https', 'json') in exports
+    assert ('hosts', 'example.gov', 'https', 'json') in exports
+
+    # made-up reports and domains are answered, but not kept
+    assert test_client.get('/data/hosts/bogus.json').status_code == 200
+    assert test_client.get('/data/hosts/nope.gov/https.json').status_code == 200
+    assert test_client.get('/data/reports/bogus.json').status_code == 200
+    assert ('hosts', 'bogus', 'json') not in exports
+    assert ('hosts', 'nope.gov', 'https', 'json') not in exports
+    assert ('reports', 'bogus') not in exports
+
+
+def test_unknown_extensions_are_not_found(monkeypatch) -> None:
+    test_client = client(monkeypatch, [])
+
+    assert test_client.get('/data/hosts/https.xml').status_code == 404
+    assert test_client.get('/data/domains/https.xml').status_code == 404
+
+
+def test_exports_are_built_before_a_new_read_model_is_used(monkeypatch) -> None:
+    rendered = []
+    test_client = client(monkeypatch, rendered)
+    read_model = models.ReadModel(
+        [host(i) for i in range(10)],
+        [{'slug': 'agency', 'name': 'Agency', 'https': {'eligible': 10}}],
+        [{'report_date': '2018-01-02', 'https': {'eligible': 10}}]
+    )
+
+    assert models.warm_up(read_model) is read_model
+    for key in [('reports', 'https'), ('agencies', 'https'), ('hosts', 'https', 'csv'), ('domains', 'https', 'json')]:
+        assert key in read_model.exports
+    assert 'https' in rendered
+
+    # the read model in service is left alone
+    assert models.read_model() is not read_model
+    assert ('reports', 'https') not in models.read_model().exports
+
+    monkeypatch.setattr(models, '_read_model', read_model)
+    rendered.clear()
+    response = test_client.get('/data/hosts/https.csv', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert rendered == []
+
+
+def test_scan_date_is_worked_out_once_and_allows_for_no_report(monkeypatch) -> None:
+    app = Flask(__name__)
+    helpers.register(app)
+    monkeypatch.setattr(models, '_read_model', models.ReadModel([], [], []))
+    with app.test_request_context():
+        assert flask.render_template_string('{{ scan_date | date("%Y-%m-%d") }}') == ""
+
+    read_model = models.ReadModel([], [], [{'report_date': '2018-01-01'}])
+    monkeypatch.setattr(models, '_read_model', read_model)
+    with app.test_request_context():
+        assert flask.render_template_string('{{ scan_date | date("%Y-%m-%d") }}') == "2018-01-01"
+
+        read_model.reports[0]['report_date'] = '2018-01-02'
+        assert flask.render_template_string('{{ scan_date | date("%Y-%m-%d") }}') == "2018-01-01"